@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'workspace.middleware.UserRolesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -101,6 +102,37 @@ DATABASES = {
 }
 
 
+# Cache
+# Общий для всех процессов сервера кэш (данные для проверки изменений страниц, версии тем событий).
+# CACHE_BACKEND: file — файловый кэш (по умолчанию), redis — Redis (CACHE_LOCATION — адрес сервера),
+# locmem — память процесса (только для одного процесса)
+
+CACHE_BACKENDS = {
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379'),
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'workspace'),
+}
+
+cache_backend, cache_location = CACHE_BACKENDS[os.environ.get(
+    'CACHE_BACKEND', 'file')]
+
+CACHES = {
+    'default': {
+        'BACKEND': cache_backend,
+        'LOCATION': os.environ.get('CACHE_LOCATION', cache_location),
+        'KEY_PREFIX': os.environ.get('CACHE_KEY_PREFIX', 'work_server'),
+        'VERSION': int(os.environ.get('CACHE_VERSION', 1)),
+    }
+}
+
+# Время хранения значений (в секундах) по пространствам ключей (workspace.caching), если оно отличается от заданного в коде
+CACHE_TIMEOUTS = {}
+
+# Кэш разобранных Спецификаций (workspace.spec_cache): папка и наибольший размер в байтах
+SPEC_CACHE_DIR = os.environ.get('SPEC_CACHE_DIR', BASE_DIR / 'cache' / 'specs')
+SPEC_CACHE_MAX_SIZE = int(os.environ.get('SPEC_CACHE_MAX_SIZE', 256 * 1024 * 1024))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -139,6 +171,15 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 STATIC_URL = '/static/'
 
+# Загруженные файлы (Спецификации, поставленные в очередь импорта)
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Кол-во потоков, выполняющих импорт Спецификаций в фоне (workspace.jobs)
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 1))
+
+# Кол-во процессов, разбирающих Спецификации при пакетном импорте
+IMPORT_PROCESSES = int(os.environ.get('IMPORT_PROCESSES', min(os.cpu_count() or 1, 4)))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
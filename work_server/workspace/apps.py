@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class WorkspaceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'workspace'
+
+    def ready(self):
+        # Подключаем обработчики, поддерживающие счётчики производства
+        from . import signals
@@ -0,0 +1,63 @@
+import re
+import threading
+from fnmatch import translate
+from .caching import BLACKLIST_VERSIONS
+from .models import ParseBlacklistValue
+
+
+BLACKLIST_KEY = 'all'
+"""Ключ версии чёрного списка парсинга"""
+
+
+class BlacklistMatcher:
+    """
+    Проверка наименований частей по маскам чёрного списка парсинга.
+    Все маски переводятся в одно регулярное выражение (каждая — в свою именованную группу),
+    поэтому наименование проверяется одним сопоставлением, а не перебором масок
+
+    - patterns — маски наименований (синтаксис fnmatch)
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.regex = re.compile('|'.join(f'(?P<p{idx}>{translate(pattern)})' for idx, pattern
+                                         in enumerate(self.patterns))) if self.patterns else None
+
+    def __bool__(self):
+        return self.regex is not None
+
+    def match(self, name):
+        """Возвращает маску, которой соответствует наименование (None, если наименование не в чёрном списке)"""
+        if self.regex is None:
+            return None
+        found = self.regex.match(str(name))
+        return self.patterns[int(found.lastgroup[1:])] if found else None
+
+    def __contains__(self, name):
+        return self.match(name) is not None
+
+
+_matcher = (None, None)
+_matcher_lock = threading.Lock()
+
+
+def get_blacklist_matcher():
+    """
+    Возвращает проверку по текущему чёрному списку. Список загружается из БД и компилируется один раз
+    и используется процессом, пока не изменится его версия (invalidate_blacklist)
+    """
+    global _matcher
+    version = BLACKLIST_VERSIONS.get_versions([BLACKLIST_KEY])[0]
+    with _matcher_lock:
+        if _matcher[0] == version:
+            return _matcher[1]
+    matcher = BlacklistMatcher(
+        ParseBlacklistValue.objects.order_by('id').values_list('value', flat=True))
+    with _matcher_lock:
+        _matcher = (version, matcher)
+    return matcher
+
+
+def invalidate_blacklist():
+    """Сбрасывает скомпилированный чёрный список во всех процессах (при изменении масок)"""
+    BLACKLIST_VERSIONS.bump([BLACKLIST_KEY])
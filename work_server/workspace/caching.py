@@ -0,0 +1,187 @@
+import atexit
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+
+
+STATS_FLUSH_EVERY = 50
+"""Через сколько обращений к кэшу счётчики попаданий/промахов процесса переносятся в общий кэш"""
+
+MISSING = object()
+
+
+class CacheNamespace:
+    """
+    Пространство ключей общего кэша (settings.CACHES) с собственными временем хранения и версией.
+    Ключ строится как <имя>:<части ключа>, версия передаётся кэшу, поэтому увеличение версии
+    делает недоступными все ранее сохранённые значения пространства.
+    Время хранения можно переопределить в settings.CACHE_TIMEOUTS по имени пространства
+
+    - name — имя пространства
+    - timeout — время хранения значений в секундах (None — без ограничения)
+    - version — версия формата значений
+    """
+    namespaces = dict()
+
+    def __init__(self, name, timeout, version=1):
+        self.name = name
+        self.default_timeout = timeout
+        self.version = version
+        CacheNamespace.namespaces[name] = self
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'CACHE_TIMEOUTS', dict()).get(self.name, self.default_timeout)
+
+    def key(self, key):
+        """Возвращает полный ключ кэша (key — строка, число или кортеж частей ключа)"""
+        parts = key if isinstance(key, tuple) else (key,)
+        return ':'.join([self.name, *map(str, parts)])
+
+    def get(self, key, default=None):
+        """Возвращает значение по ключу (default, если его нет)"""
+        value = cache.get(self.key(key), MISSING, version=self.version)
+        record_access(self.name, value is not MISSING)
+        return default if value is MISSING else value
+
+    def get_many(self, keys):
+        """Возвращает словарь {ключ: значение} для найденных ключей"""
+        full_keys = {self.key(key): key for key in keys}
+        values = cache.get_many(full_keys.keys(), version=self.version)
+        for full_key in full_keys:
+            record_access(self.name, full_key in values)
+        return {full_keys[full_key]: value for full_key, value in values.items()}
+
+    def set(self, key, value):
+        """Сохраняет значение по ключу"""
+        cache.set(self.key(key), value, timeout=self.timeout,
+                  version=self.version)
+
+    def add(self, key, value):
+        """Сохраняет значение, если ключа ещё нет. Возвращает True, если значение сохранено"""
+        return cache.add(self.key(key), value, timeout=self.timeout, version=self.version)
+
+    def incr(self, key, delta=1):
+        """Увеличивает числовое значение по ключу (ValueError, если ключа нет)"""
+        return cache.incr(self.key(key), delta, version=self.version)
+
+    def changed(self, key, value):
+        """
+        Сохраняет значение по ключу и возвращает True, если оно отличается от сохранённого ранее
+        (используется для проверки изменения данных при периодическом опросе страниц)
+        """
+        if self.get(key) == value:
+            return False
+        self.set(key, value)
+        return True
+
+
+class VersionNamespace(CacheNamespace):
+    """
+    Пространство монотонно растущих версий (например, версий данных для проверки их изменения).
+    Отсутствующая в кэше версия начинается с текущего времени, чтобы не повторить выданные ранее версии
+    """
+
+    def bump(self, keys):
+        """Увеличивает версии по ключам"""
+        for key in keys:
+            try:
+                self.incr(key)
+            except ValueError:
+                self.add(key, time.time_ns())
+
+    def get_versions(self, keys):
+        """Возвращает список текущих версий (в порядке ключей)"""
+        versions = self.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                self.add(key, time.time_ns())
+                versions[key] = cache.get(self.key(key), version=self.version)
+        return [versions[key] for key in keys]
+
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+STATS = CacheNamespace('cache_stats', None)
+"""Счётчики попаданий/промахов кэша по пространствам (общие для всех процессов)"""
+
+
+def record_access(name, hit):
+    """
+    Учитывает обращение к кэшу. Счётчики копятся в процессе и периодически переносятся в общий кэш
+
+    - name — имя пространства
+    - hit — найдено ли значение
+    """
+    if name == STATS.name:
+        return
+    with _stats_lock:
+        _stats[(name, 'hits' if hit else 'misses')] += 1
+        if sum(_stats.values()) < STATS_FLUSH_EVERY:
+            return
+        pending = dict(_stats)
+        _stats.clear()
+    flush_stats(pending)
+
+
+def flush_stats(pending):
+    """Переносит накопленные счётчики в общий кэш"""
+    for key, delta in pending.items():
+        try:
+            STATS.incr(key, delta)
+        except ValueError:
+            if not STATS.add(key, delta):
+                STATS.incr(key, delta)
+
+
+@atexit.register
+def flush_pending_stats():
+    """Переносит в общий кэш счётчики, накопленные процессом (при его завершении)"""
+    with _stats_lock:
+        pending = dict(_stats)
+        _stats.clear()
+    if pending:
+        flush_stats(pending)
+
+
+def get_stats():
+    """Возвращает словарь {имя пространства: (попадания, промахи)} по данным общего кэша"""
+    names = [name for name in CacheNamespace.namespaces if name != STATS.name]
+    values = cache.get_many([STATS.key((name, kind)) for name in names for kind in ('hits', 'misses')],
+                            version=STATS.version)
+    return {name: (values.get(STATS.key((name, 'hits')), 0), values.get(STATS.key((name, 'misses')), 0))
+            for name in names}
+
+
+TOPIC_VERSIONS = VersionNamespace('topic_version', None)
+"""Версии тем событий (events.get_versions)"""
+
+ROLE_VERSIONS = VersionNamespace('role_version', None)
+"""Версии групп пользователей и данных работников (middleware.UserRolesMiddleware)"""
+
+BLACKLIST_VERSIONS = VersionNamespace('blacklist_version', None)
+"""Версия чёрного списка парсинга (blacklist.get_blacklist_matcher)"""
+
+NOTIFICATION_HASHES = CacheNamespace('notification_hash', 300)
+"""Последнее уведомление, показанное пользователю"""
+
+WORKER_PRODUCTS_HASHES = CacheNamespace('worker_products_hash', 300)
+"""Список изделий, доступных работнику (главная страница работника)"""
+
+MASTER_OBJECTS_HASHES = CacheNamespace('master_objects_hash', 300)
+"""Список объектов и вопросов (главная страница мастера)"""
+
+PRODUCT_DETAIL_HASHES = CacheNamespace('product_detail_hash', 300)
+"""Данные изделия на странице взятия в работу"""
+
+WORKER_PRODUCT_HASHES = CacheNamespace('worker_product_hash', 300)
+"""Вопросы по изделию в работе у работника"""
+
+OBJECT_DETAIL_HASHES = CacheNamespace('object_detail_hash', 300)
+"""Данные объекта"""
+
+PRODUCT_IN_WORK_HASHES = CacheNamespace('product_in_work_hash', 300)
+"""Данные изделия в работе (страница мастера)"""
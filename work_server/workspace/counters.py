@@ -0,0 +1,190 @@
+from django.db import transaction
+from django.db.models import F, Q, Sum, DecimalField
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
+import math
+from .models import Product, Part, Object, ProductionCounter, INSTANCE_AMOUNT_ANNOTATIONS
+
+
+STATUS_FIELDS = {'QUEUED': 'queued',
+                 'IN_WORK': 'in_work', 'COMPLETED': 'completed'}
+"""Поля счётчиков, соответствующие статусам экземпляров изделий/частей"""
+
+RATIO_PLACES = Decimal('0.0001')
+"""Точность хранения долей изделия, занятых/произведённых частями"""
+
+PERCENTAGE_PLACES = Decimal('0.01')
+"""Точность хранения процента готовности объекта"""
+
+
+def recount(product_counter: ProductionCounter, part_counters):
+    """
+    Пересчитывает производные значения счётчиков изделия и его частей (доступное кол-во, доли частей)
+    по уже известным кол-вам экземпляров. Не обращается к БД
+
+    - product_counter — счётчики изделия (с заполненным product)
+    - part_counters — счётчики всех частей изделия (с заполненным part)
+    """
+    product = product_counter.product
+    free = product.amount - product_counter.get_total()
+    busy = Decimal(0)
+    completed = None
+    for counter in part_counters:
+        counter.available = free * counter.part.amount - counter.get_total()
+        busy = max(busy, counter.get_total() / counter.part.amount)
+        ratio = counter.completed / counter.part.amount
+        completed = ratio if completed is None else min(completed, ratio)
+    # Округление в сторону, сохраняющую результат ceil/int при чтении
+    product_counter.parts_busy = busy.quantize(
+        RATIO_PLACES, rounding=ROUND_CEILING)
+    product_counter.parts_completed = max(completed or Decimal(0), Decimal(0)).quantize(
+        RATIO_PLACES, rounding=ROUND_FLOOR)
+    product_counter.available = free - math.ceil(product_counter.parts_busy)
+
+
+def rebuild_counters(products=None):
+    """
+    Пересчитывает счётчики производства изделий и их частей заново по экземплярам изделий/частей.
+    Используется, если счётчики отсутствуют, и для ручного восстановления (команда rebuild_counters)
+
+    - products — выборка изделий (None — все изделия)
+    """
+    if products is None:
+        products = Product.objects.all()
+    with transaction.atomic():
+        products = list(products.with_instance_totals())
+        ProductionCounter.objects.filter(
+            Q(product__in=products) | Q(part__product__in=products)).delete()
+        counters = []
+        for product in products:
+            product_counter = ProductionCounter(product=product, **{
+                field: getattr(product, INSTANCE_AMOUNT_ANNOTATIONS[status]) for status, field in STATUS_FIELDS.items()})
+            part_counters = [ProductionCounter(part=part, **{
+                field: getattr(part, INSTANCE_AMOUNT_ANNOTATIONS[status]) for status, field in STATUS_FIELDS.items()})
+                for part in product.part_set.all()]
+            recount(product_counter, part_counters)
+            counters.append(product_counter)
+            counters.extend(part_counters)
+        ProductionCounter.objects.bulk_create(counters, batch_size=500)
+    return len(counters)
+
+
+def rebalance_product(product_id):
+    """
+    Пересчитывает доступное кол-во изделия и его частей по текущим счётчикам (блокирует счётчик изделия).
+    Возвращает id объекта изделия или None, если у изделия нет счётчиков
+
+    - product_id — id изделия
+    """
+    product_counter = ProductionCounter.objects.select_for_update().select_related(
+        'product').filter(product_id=product_id).first()
+    # Счётчиков нет, если изделие удаляется (или ещё не пересчитано — тогда они создадутся при чтении)
+    if product_counter is None:
+        return None
+    part_counters = list(ProductionCounter.objects.select_related(
+        'part').filter(part__product_id=product_id))
+    recount(product_counter, part_counters)
+    product_counter.save(
+        update_fields=['available', 'parts_busy', 'parts_completed'])
+    ProductionCounter.objects.bulk_update(part_counters, ['available'])
+    return product_counter.product.object_id
+
+
+def apply_instance_change(old_state, new_state):
+    """
+    Применяет к счётчикам изменение экземпляра изделия/части (создание, смену статуса или кол-ва, удаление).
+    Должна вызываться в транзакции, изменившей экземпляр
+
+    - old_state — состояние экземпляра до изменения (None, если экземпляр создан)
+    - new_state — состояние экземпляра после изменения (None, если экземпляр удалён)
+    """
+    if old_state is not None and new_state is not None and old_state[:4] == new_state[:4]:
+        return
+    changes = []
+    for state, sign in ((old_state, -1), (new_state, 1)):
+        if state is None:
+            continue
+        product_id, part_id, status, amount = state[:4]
+        field = STATUS_FIELDS.get(status)
+        if field is None or not amount:
+            continue
+        if product_id:
+            changes.append((product_id, Q(product_id=product_id), field, sign * amount))
+        elif part_id:
+            part_product_id = Part.objects.filter(
+                pk=part_id).values_list('product_id', flat=True).first()
+            if part_product_id:
+                changes.append((part_product_id, Q(part_id=part_id), field, sign * amount))
+    apply_counter_changes(changes)
+
+
+def apply_counter_changes(changes):
+    """
+    Изменяет кол-ва в счётчиках и пересчитывает доступное кол-во каждого затронутого изделия один раз.
+    Используется и при массовой записи экземпляров (bulk_create/bulk_update), которая не вызывает сигналы.
+    Должна вызываться в транзакции, изменившей экземпляры
+
+    - changes — изменения (id изделия, условие выбора счётчика, поле счётчика, изменение кол-ва)
+    """
+    product_ids = sorted({change[0] for change in changes})
+    # Блокируем счётчики изделий в одном порядке, чтобы параллельные изменения не пересекались
+    list(ProductionCounter.objects.select_for_update().filter(
+        product_id__in=product_ids).order_by('product_id').values_list('id', flat=True))
+    for product_id, condition, field, delta in changes:
+        ProductionCounter.objects.filter(condition).update(
+            **{field: F(field) + delta})
+    object_ids = {rebalance_product(product_id) for product_id in product_ids}
+    object_ids.discard(None)
+    if object_ids and any(change[2] == 'completed' for change in changes):
+        # Готовность объекта зависит от произведённого кол-ва — пересчитываем её сразу (один раз для каждого объекта)
+        refresh_ready_percentages(Object.objects.filter(pk__in=object_ids))
+
+
+def refresh_ready_percentages(objects):
+    """
+    Пересчитывает процент готовности объектов (доля стоимости произведённых изделий и частей)
+    по счётчикам производства. Для всей выборки выполняется два агрегирующих запроса,
+    в БД сохраняются только изменившиеся значения.
+    Возвращает список объектов с обновлённым полем ready_percentage
+
+    - objects — объекты (выборка или список)
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    amount_field = DecimalField(max_digits=20, decimal_places=2)
+    totals = {object.id: {'full_price': Decimal(0), 'ready_price': Decimal(0), 'all_amount': Decimal(0), 'compl_amount': Decimal(0)}
+              for object in objects}
+    products = Product.objects.filter(object__in=totals.keys()).values('object_id').annotate(
+        full_price=Sum(F('price') * F('amount'), output_field=amount_field),
+        ready_price=Sum(F('price') * F('counter__completed'),
+                        output_field=amount_field),
+        all_amount=Sum('amount', output_field=amount_field),
+        compl_amount=Sum('counter__completed', output_field=amount_field)).order_by()
+    parts = Part.objects.filter(product__object__in=totals.keys()).values(object_id=F('product__object_id')).annotate(
+        ready_price=Sum(F('price') * F('counter__completed'),
+                        output_field=amount_field),
+        all_amount=Sum(F('amount') * F('product__amount'),
+                       output_field=amount_field),
+        compl_amount=Sum('counter__completed', output_field=amount_field)).order_by()
+    for row in list(products) + list(parts):
+        for key, value in totals[row['object_id']].items():
+            totals[row['object_id']][key] = value + \
+                Decimal(row.get(key) or 0)
+    changed = []
+    for object in objects:
+        data = totals[object.id]
+        if data['all_amount'] == data['compl_amount']:
+            percentage = Decimal(100)
+        elif data['compl_amount'] == 0 or data['full_price'] == 0:
+            percentage = Decimal(0)
+        else:
+            percentage = min(
+                max(data['ready_price'] / data['full_price'] * 100, Decimal(0)), Decimal(100))
+        percentage = percentage.quantize(
+            PERCENTAGE_PLACES, rounding=ROUND_HALF_UP)
+        if object.ready_percentage is None or Decimal(object.ready_percentage) != percentage:
+            object.ready_percentage = percentage
+            changed.append(object)
+    if changed:
+        Object.objects.bulk_update(changed, ['ready_percentage'])
+    return objects
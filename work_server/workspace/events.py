@@ -0,0 +1,163 @@
+import asyncio
+import re
+import threading
+from django.db import transaction
+from .caching import TOPIC_VERSIONS
+
+
+PRODUCTION_TOPIC = 'production'
+"""Тема событий об изменении производства (объекты, изделия, части, экземпляры, состояния объектов)"""
+
+QUESTIONS_TOPIC = 'questions'
+"""Тема событий об изменении вопросов"""
+
+NOTIFICATIONS_TOPIC = 'notifications'
+"""Тема событий о новых уведомлениях (для подписчика заменяется темой его группы)"""
+
+TOPIC_PATTERN = re.compile(
+    r'^(production|questions|notifications|(object|product|instance|import|import_batch):\d+)$')
+"""Темы, на которые может подписаться клиент"""
+
+HEARTBEAT_INTERVAL = 25
+"""Интервал (в секундах) отправки пустых сообщений, поддерживающих соединение"""
+
+
+def object_topic(object_id):
+    """Возвращает тему событий об изменении объекта"""
+    return f'object:{object_id}'
+
+
+def product_topic(product_id):
+    """Возвращает тему событий об изменении изделия (его частей и экземпляров)"""
+    return f'product:{product_id}'
+
+
+def instance_topic(instance_id):
+    """Возвращает тему событий об изменении экземпляра изделия/части (его вопросов)"""
+    return f'instance:{instance_id}'
+
+
+def import_topic(job_id):
+    """Возвращает тему событий о ходе фонового импорта Спецификации"""
+    return f'import:{job_id}'
+
+
+def import_batch_topic(batch_id):
+    """Возвращает тему событий о ходе пакетного импорта Спецификаций"""
+    return f'import_batch:{batch_id}'
+
+
+def group_notifications_topic(group_id):
+    """Возвращает тему событий о новых уведомлениях группы пользователей"""
+    return f'{NOTIFICATIONS_TOPIC}:{group_id}'
+
+
+class Subscription:
+    """
+    Подписка на темы событий: очередь тем и набор тем, которые уже в очереди (о них подписчик ещё не уведомлён).
+    Используется только в цикле событий подписчика
+
+    - topics — набор тем
+    """
+
+    def __init__(self, topics):
+        self.topics = frozenset(topics)
+        self.queue = asyncio.Queue(maxsize=len(self.topics) or 1)
+        self.pending = set()
+
+    def put(self, topic):
+        """Добавляет тему в очередь, пропуская темы, о которых подписчик ещё не уведомлён"""
+        if topic not in self.pending:
+            try:
+                self.queue.put_nowait(topic)
+            except asyncio.QueueFull:
+                return
+            self.pending.add(topic)
+
+    async def get(self):
+        """Возвращает следующую изменившуюся тему (ожидает её появления)"""
+        topic = await self.queue.get()
+        self.pending.discard(topic)
+        return topic
+
+
+class EventBroker:
+    """
+    Брокер событий в пределах процесса: рассылает подписчикам (соединениям SSE) названия изменившихся тем.
+    Публиковать события можно из любого потока, подписчики работают в цикле событий ASGI-сервера.
+    При запуске нескольких процессов сервера каждый процесс получает только свои события
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics):
+        """
+        Регистрирует подписчика и возвращает его подписку (Subscription), из которой он получает темы событий.
+        Должна вызываться из цикла событий
+
+        - topics — набор тем
+        """
+        subscription = Subscription(topics)
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), subscription))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Удаляет подписчика с указанной подпиской"""
+        with self._lock:
+            self._subscribers = {
+                subscriber for subscriber in self._subscribers if subscriber[1] is not subscription}
+
+    def publish(self, topics):
+        """
+        Отправляет темы событий подписчикам
+
+        - topics — набор изменившихся тем
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, subscription in subscribers:
+            for topic in subscription.topics.intersection(topics):
+                try:
+                    loop.call_soon_threadsafe(subscription.put, topic)
+                except RuntimeError:
+                    # Цикл событий подписчика уже закрыт
+                    self.unsubscribe(subscription)
+
+
+broker = EventBroker()
+"""Брокер событий текущего процесса"""
+
+
+def bump_versions(topics):
+    """
+    Увеличивает версии тем
+
+    - topics — темы изменившихся данных
+    """
+    TOPIC_VERSIONS.bump(topics)
+
+
+def get_versions(topics):
+    """
+    Возвращает список текущих версий тем (в порядке тем)
+
+    - topics — темы, от которых зависят данные
+    """
+    return TOPIC_VERSIONS.get_versions(topics)
+
+
+def publish_on_commit(*topics):
+    """
+    Увеличивает версии тем и публикует события после фиксации текущей транзакции (сразу, если транзакции нет)
+
+    - topics — темы изменившихся данных
+    """
+    topics = set(topics)
+    if topics:
+        def publish():
+            bump_versions(topics)
+            broker.publish(topics)
+        transaction.on_commit(publish)
@@ -0,0 +1,132 @@
+import csv
+import tempfile
+from decimal import Decimal
+from django.http import StreamingHttpResponse
+from openpyxl import Workbook
+from .models import PayrollLedger, Product
+
+
+EXPORT_CHUNK_SIZE = 2000
+"""Кол-во строк, получаемых из БД за одно обращение к курсору"""
+
+XLSX_READ_SIZE = 64 * 1024
+"""Размер частей (в байтах), которыми отправляется готовый XLSX-файл"""
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+"""Форматы выгрузки и их типы содержимого"""
+
+PAYROLL_HEADER = ['Работник', 'Месяц', 'Произведено', 'Выплата, руб.', 'Месяц закрыт']
+"""Заголовки столбцов выгрузки ведомости выплат"""
+
+PRODUCTION_HEADER = ['Объект', 'Готовность объекта, %', 'Код изделия', 'Наименование', 'Кол-во', 'Стоимость',
+                     'В очереди', 'В работе', 'Произведено', 'Доступно']
+"""Заголовки столбцов выгрузки хода производства"""
+
+
+class Echo:
+    """Файловый объект, возвращающий записанную строку вместо её сохранения (для построчной выгрузки CSV)"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(header, rows):
+    """
+    Возвращает строки CSV по одной. Разделитель — точка с запятой, в начале — BOM,
+    чтобы Excel открывал файл в кодировке UTF-8 с русскими десятичными запятыми
+
+    - header — заголовки столбцов
+    - rows — строки (итератор)
+    """
+    writer = csv.writer(Echo(), delimiter=';')
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([str(value).replace('.', ',') if isinstance(value, Decimal) else value
+                               for value in row])
+
+
+def iter_xlsx(title, header, rows):
+    """
+    Формирует XLSX-файл в режиме write-only (строки сразу записываются во временный файл, а не хранятся в памяти)
+    и возвращает его содержимое по частям
+
+    - title — название листа
+    - header — заголовки столбцов
+    - rows — строки (итератор)
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while chunk := file.read(XLSX_READ_SIZE):
+            yield chunk
+
+
+def export_response(name, title, header, rows, export_format):
+    """
+    Возвращает потоковый ответ с выгрузкой: строки получаются из БД по мере отправки
+
+    - name — имя файла (без расширения, латиницей)
+    - title — название листа XLSX
+    - header — заголовки столбцов
+    - rows — строки (итератор)
+    - export_format — csv или xlsx
+    """
+    if export_format == 'xlsx':
+        content = iter_xlsx(title, header, rows)
+    else:
+        export_format = 'csv'
+        content = iter_csv(header, rows)
+    response = StreamingHttpResponse(
+        content, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{export_format}"'
+    return response
+
+
+def iter_payroll_rows(workers=None, start=None, end=None):
+    """
+    Возвращает строки ведомости выплат (работник, месяц, произведено, выплата, месяц закрыт)
+    из PayrollLedger через курсор БД (iterator), не загружая ведомость в память целиком
+
+    - workers — id работников (None — все работники)
+    - start — первый выгружаемый месяц (дата в пределах месяца)
+    - end — последний выгружаемый месяц (дата в пределах месяца)
+    """
+    ledger = PayrollLedger.objects.all()
+    if workers is not None:
+        ledger = ledger.filter(worker__in=workers)
+    if start:
+        ledger = ledger.filter(month__gte=start.replace(day=1))
+    if end:
+        ledger = ledger.filter(month__lte=end.replace(day=1))
+    rows = ledger.order_by('worker__display_name', 'worker_id', 'month').values_list(
+        'worker__display_name', 'month', 'amount', 'payment', 'closed')
+    for name, month, amount, payment, closed in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [name, f'{month:%m.%Y}', amount, round(payment, 2), 'да' if closed else 'нет']
+
+
+def iter_production_rows(objects=None, hidden=False):
+    """
+    Возвращает строки хода производства по изделиям объектов (по счётчикам производства)
+    через курсор БД (iterator)
+
+    - objects — id объектов (None — все объекты)
+    - hidden — выгружать ли скрытые объекты
+    """
+    products = Product.objects.all()
+    if objects is not None:
+        products = products.filter(object__in=objects)
+    if not hidden:
+        products = products.filter(object__hidden=False)
+    rows = products.order_by('object__obj_number', 'object_id', 'prod_number', 'id').values_list(
+        'object__obj_number', 'object__ready_percentage', 'prod_number', 'name', 'amount', 'price',
+        'counter__queued', 'counter__in_work', 'counter__completed', 'counter__available')
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [value if value is not None else '' for value in row]
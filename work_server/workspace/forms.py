@@ -120,6 +120,35 @@ class SelectFileForm(forms.Form):
     #     return deadline
 
 
+class ImportSpecForm(SelectFileForm):
+
+    dry_run = forms.BooleanField(label="Только предпросмотр изменений", required=False,
+                                 help_text="Показать отличия от уже импортированного объекта, ничего не изменяя")
+
+
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    """Поле для загрузки нескольких файлов (проверки выполняются для каждого файла)"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("widget", MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        if isinstance(data, (list, tuple)):
+            return [super(MultipleFileField, self).clean(item, initial) for item in data]
+        return [super().clean(data, initial)]
+
+
+class BatchImportForm(forms.Form):
+
+    specs = MultipleFileField(label="Выберите файлы Спецификаций или zip-архив", validators=[
+        FileExtensionValidator(allowed_extensions=['xls', 'xlsx', 'xlsm', 'zip'])], widget=MultipleFileInput(attrs={'accept': '.xls, .xlsx, .xlsm, .zip', 'title': 'Выберите Спецификации'}))
+
+
 class AddProductToQueueForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
@@ -150,6 +179,29 @@ class AddProductToQueueForm(forms.Form):
         return worker
 
 
+class QueueAssignmentForm(forms.Form):
+    """Строка распределения очереди: изделие/часть, работник и кол-во"""
+
+    def __init__(self, *args, **kwargs):
+        items = kwargs.pop('items')
+        workers = kwargs.pop('workers')
+        super().__init__(*args, **kwargs)
+        self.fields['item'].choices = items
+        self.fields['worker'].choices = workers
+
+    item = forms.ChoiceField(label='Изготовить')
+
+    worker = forms.ChoiceField(label='Работник')
+
+    amount = forms.DecimalField(
+        min_value=Decimal('0.1'), label='Кол-во', decimal_places=1, max_digits=10)
+
+
+QueueAssignmentFormSet = forms.formset_factory(
+    QueueAssignmentForm, extra=10, max_num=100, validate_max=True)
+"""Набор строк распределения очереди (пустые строки не учитываются)"""
+
+
 class CustomUserCreationForm(UserCreationForm):
 
     def __init__(self, *args, **kwargs):
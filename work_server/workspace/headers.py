@@ -0,0 +1,95 @@
+from django.core.exceptions import ValidationError
+from decimal import Decimal
+
+
+ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz!@#$%^&*()-=_+"№;:?'
+"""Символы буквенной приставки номеров в диапазонах изделий (пр. А01 - А05)"""
+
+LIST_SEPARATOR = ', '
+"""Разделитель изделий в заголовке"""
+
+RANGE_SEPARATOR = ' - '
+"""Разделитель начала и конца диапазона изделий"""
+
+
+def is_multi_header(header):
+    """Проверяет, перечислены ли в заголовке несколько изделий (через запятую или диапазоном)"""
+    return LIST_SEPARATOR in header or RANGE_SEPARATOR in header
+
+
+def split_prefix(value):
+    """
+    Отделяет буквенную приставку номера (символы из ALPHABET в начале строки).
+    Возвращает (приставка, оставшаяся часть номера)
+    """
+    idx = 0
+    while idx < len(value) and value[idx].lower() in ALPHABET:
+        idx += 1
+    if idx == len(value):
+        raise ValidationError(f"В диапазоне изделий нет числового номера: {value}")
+    return value[:idx], value[idx:]
+
+
+def expand_range(item):
+    """
+    Возвращает наименования изделий диапазона (пр. А1.1 - А1.3 -> А1.1, А1.2, А1.3).
+    Шаг диапазона определяется кол-вом знаков после запятой в конце диапазона.
+    Наименования вычисляются сразу для всего диапазона (начало + номер * шаг), без пошагового сложения
+
+    - item — диапазон изделий (начало - конец)
+    """
+    start, end = item.split(RANGE_SEPARATOR)[:2]
+    prefix, start = split_prefix(start)
+    dec_places = len(end.split('.')[1]) if '.' in end else 0
+    start = Decimal(start)
+    end = Decimal(end.replace(prefix, '', 1))
+    step = Decimal(1) / pow(10, dec_places)
+    if start > end:
+        return []
+    # Начало диапазона сохраняет свою запись (0 * шаг изменил бы кол-во знаков после запятой)
+    return [prefix + f'{start}'] + [prefix + f'{start + idx * step}' for idx in range(1, int((end - start) // step) + 1)]
+
+
+def expand_header(header, prod_amount):
+    """
+    Разбивает заголовок с несколькими изделиями (через запятую и/или диапазонами) на отдельные изделия.
+    Возвращает список (наименование, номер в заголовке), номера дополняются нулями до длины prod_amount
+
+    - header — заголовок изделия из Спецификации
+    - prod_amount — кол-во изделий, указанное в Спецификации
+    """
+    names = []
+    for item in header.split(LIST_SEPARATOR):
+        if RANGE_SEPARATOR in item:
+            names.extend(expand_range(item))
+        else:
+            names.append(item)
+    width = len(str(prod_amount))
+    return [(name, str(idx).zfill(width)) for idx, name in enumerate(names, start=1)]
+
+
+def number_products(prod_data, max_idx):
+    """
+    Присваивает изделиям итоговые номера: порядковый номер заголовка, дополненный нулями до длины max_idx,
+    и для изделий из заголовков с несколькими изделиями — номер в заголовке через дефис (пр. 02-03)
+
+    - prod_data — данные изделий {индекс: данные изделия} (в порядке Спецификации)
+    - max_idx — кол-во заголовков изделий
+    """
+    width = len(str(max_idx))
+    idx = 1
+    lst_number = 0
+    for data in prod_data.values():
+        number = data.get('number')
+        if number is None:
+            if lst_number != 0:
+                idx += 1
+                lst_number = 0
+            data['number'] = str(idx).zfill(width)
+            idx += 1
+        else:
+            if Decimal(lst_number) > Decimal(number):
+                idx += 1
+            lst_number = number
+            data['number'] = str(idx).zfill(width) + '-' + number
+    return prod_data
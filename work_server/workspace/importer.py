@@ -0,0 +1,328 @@
+from collections import Counter
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from typing import NamedTuple
+import json
+import time
+from .models import Object, ObjectStateInstance, Product, Part, ProductionCounter, CreationInstance
+from .counters import recount, rebalance_product, refresh_ready_percentages
+from .events import publish_on_commit, PRODUCTION_TOPIC, object_topic, product_topic
+from . import payroll
+
+
+IMPORT_BATCH_SIZE = 500
+"""Кол-во записей в одном запросе при массовом добавлении"""
+
+PRODUCT_DIFF_FIELDS = ('name', 'amount', 'price')
+"""Поля изделия, сравниваемые с данными Спецификации"""
+
+PART_DIFF_FIELDS = ('price',)
+"""Поля части, сравниваемые с данными Спецификации"""
+
+
+class ImportReport(NamedTuple):
+    """
+    Итоги импорта объекта: объект, кол-во добавленных изделий и частей, время записи в БД (в секундах),
+    кол-во изменённых и удалённых изделий и частей (при обновлении существующего объекта)
+    """
+    object: Object
+    products: int
+    parts: int
+    seconds: float
+    updated: int = 0
+    deleted: int = 0
+
+
+class PartChange(NamedTuple):
+    """
+    Изменение части изделия
+
+    - action — create, update, delete, keep (отсутствует в Спецификации, но уже есть в работе) или same
+    - changes — {поле: (старое значение, новое значение)}
+    """
+    name: str
+    action: str
+    changes: dict
+    part: Part = None
+    data: dict = None
+
+
+class ProductChange(NamedTuple):
+    """Изменение изделия (действия — как у PartChange)"""
+    number: str
+    name: str
+    action: str
+    changes: dict
+    parts: list
+    product: Product = None
+    data: dict = None
+
+    @property
+    def changed(self):
+        return self.action != 'same' or any(part.action != 'same' for part in self.parts)
+
+
+class SpecDiff(NamedTuple):
+    """Отличия данных Спецификации от существующего объекта (object — None, если объекта ещё нет)"""
+    obj_number: str
+    object: Object
+    products: list
+
+    def get_totals(self):
+        """Возвращает кол-во изделий и частей по действиям"""
+        totals = Counter(product.action for product in self.products)
+        totals.update(part.action for product in self.products for part in product.parts)
+        return dict(totals)
+
+    def as_json(self):
+        """Возвращает изменившиеся изделия и итоги в виде, пригодном для хранения в JSONField"""
+        return {'object': self.object.pk if self.object else None, 'totals': self.get_totals(),
+                'products': [{'number': product.number, 'name': product.name, 'action': product.action,
+                              'changes': product.changes,
+                              'parts': [{'name': part.name, 'action': part.action, 'changes': part.changes}
+                                        for part in product.parts if part.action != 'same']}
+                             for product in self.products if product.changed]}
+
+    def matches(self, preview):
+        """Возвращает True, если отличия совпадают с сохранёнными при предпросмотре (as_json из JSONField)"""
+        return json.loads(json.dumps(self.as_json(), cls=DjangoJSONEncoder)) == preview
+
+
+class PreviewOutdated(ValidationError):
+    """
+    Отличия Спецификации от объекта изменились после предпросмотра (изменились изделия или чёрный список),
+    поэтому показанные изменения не применяются
+
+    - diff — текущие отличия (SpecDiff)
+    """
+
+    def __init__(self, diff):
+        super().__init__("Объект или чёрный список изменились после предпросмотра. "
+                         "Проверьте изменения и примените их снова")
+        self.diff = diff
+
+
+def get_changes(instance, data, fields):
+    """Возвращает {поле: (значение в БД, значение из Спецификации)} для отличающихся полей"""
+    return {field: (getattr(instance, field), data.get(field)) for field in fields
+            if getattr(instance, field) != data.get(field)}
+
+
+def diff_parts(product, parts_data, busy_parts):
+    """
+    Сопоставляет части изделия с частями из Спецификации по наименованию (одноимённые части — по порядку)
+
+    - product — изделие из БД (None — новое изделие)
+    - parts_data — данные частей из Спецификации
+    - busy_parts — id частей, у которых есть экземпляры
+    """
+    existing = dict()
+    if product is not None:
+        for part in product.part_set.all():
+            existing.setdefault(part.name, []).append(part)
+    changes = []
+    for data in parts_data.values():
+        same_name = existing.get(data.get('name'))
+        if same_name:
+            part = same_name.pop(0)
+            part_changes = get_changes(part, data, PART_DIFF_FIELDS)
+            changes.append(PartChange(part.name, 'update' if part_changes else 'same', part_changes, part, data))
+        else:
+            changes.append(PartChange(data.get('name'), 'create', dict(), None, data))
+    for parts in existing.values():
+        for part in parts:
+            changes.append(PartChange(part.name, 'keep' if part.pk in busy_parts else 'delete', dict(), part))
+    return changes
+
+
+def diff_spec(obj_number, prod_data):
+    """
+    Сравнивает данные Спецификации (spec.parse_spec) с существующим объектом с тем же номером.
+    Изделия сопоставляются по номеру, части — по наименованию. Изделия и части, отсутствующие в Спецификации,
+    удаляются, только если по ним ещё не было работ (иначе они сохраняются).
+    Возвращает отличия (SpecDiff), ничего не изменяя в БД
+
+    - obj_number — номер объекта
+    - prod_data — данные изделий {индекс: данные изделия}
+    """
+    obj = Object.objects.filter(obj_number=obj_number).order_by('id').first()
+    existing = dict()
+    busy_products = set()
+    busy_parts = set()
+    if obj is not None:
+        for product in obj.product_set.order_by('id').prefetch_related('part_set'):
+            existing.setdefault(product.prod_number, []).append(product)
+        instances = CreationInstance.objects.filter(
+            Q(product__object=obj) | Q(part__product__object=obj))
+        busy_parts = set(instances.filter(part__isnull=False).values_list('part_id', flat=True))
+        busy_products = set(instances.values_list('product_id', flat=True)) | set(
+            Part.objects.filter(pk__in=busy_parts).values_list('product_id', flat=True))
+    changes = []
+    for data in prod_data.values():
+        same_number = existing.get(data.get('number'))
+        product = same_number.pop(0) if same_number else None
+        parts = diff_parts(product, data.get('parts'), busy_parts)
+        if product is None:
+            changes.append(ProductChange(data.get('number'), data.get('name'), 'create', dict(), parts, None, data))
+        else:
+            product_changes = get_changes(product, data, PRODUCT_DIFF_FIELDS)
+            changes.append(ProductChange(product.prod_number, product.name, 'update' if product_changes else 'same',
+                                         product_changes, parts, product, data))
+    for products in existing.values():
+        for product in products:
+            action = 'keep' if product.pk in busy_products else 'delete'
+            changes.append(ProductChange(product.prod_number, product.name, action, dict(),
+                                         [PartChange(part.name, action, dict(), part)
+                                          for part in product.part_set.all()], product))
+    return SpecDiff(obj_number, obj, changes)
+
+
+def create_counters(product_parts):
+    """
+    Создаёт счётчики производства новых изделий и их частей (bulk_create не отправляет сигналы)
+
+    - product_parts — список (изделие, новые части изделия)
+    """
+    counters = []
+    for product, new_parts in product_parts:
+        product_counter = ProductionCounter(product=product)
+        part_counters = [ProductionCounter(part=part) for part in new_parts]
+        recount(product_counter, part_counters)
+        counters.append(product_counter)
+        counters.extend(part_counters)
+    return counters
+
+
+def create_products(obj, products_data, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Добавляет изделия объекта и их части массово, вместе со счётчиками производства.
+    Возвращает кол-во добавленных изделий и частей
+
+    - obj — объект
+    - products_data — данные изделий из Спецификации
+    - batch_size — кол-во записей в одном запросе
+    """
+    products = [Product(prod_number=data.get('number'), object=obj, name=data.get('name'),
+                        amount=data.get('amount'), price=data.get('price')) for data in products_data]
+    Product.objects.bulk_create(products, batch_size=batch_size)
+    product_parts = [(product, [Part(name=part_data.get('name'), product=product, price=part_data.get('price'))
+                                for part_data in data.get('parts').values()])
+                     for product, data in zip(products, products_data)]
+    parts = [part for _, new_parts in product_parts for part in new_parts]
+    Part.objects.bulk_create(parts, batch_size=batch_size)
+    ProductionCounter.objects.bulk_create(create_counters(product_parts), batch_size=batch_size)
+    return len(products), len(parts)
+
+
+def write_spec(obj_number, prod_data, state, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Записывает в БД объект с изделиями и частями, извлечёнными из Спецификации (spec.parse_spec), в одной транзакции.
+    Изделия, части и их счётчики производства добавляются массово (bulk_create), поэтому при ошибке
+    в БД не остаётся частично импортированного объекта.
+    Возвращает итоги импорта (ImportReport)
+
+    - obj_number — номер объекта
+    - prod_data — данные изделий {индекс: данные изделия}
+    - state — начальное состояние объекта
+    - batch_size — кол-во записей в одном запросе
+    """
+    started = time.perf_counter()
+    with transaction.atomic():
+        obj = Object.objects.create(
+            obj_number=obj_number, created_at=timezone.now().date())
+        ObjectStateInstance.objects.create(
+            object=obj, state=state, created_at=timezone.now())
+        products, parts = create_products(obj, list(prod_data.values()), batch_size)
+    return ImportReport(obj, products, parts, time.perf_counter() - started)
+
+
+def apply_spec_diff(diff, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Применяет к существующему объекту отличия от Спецификации (diff_spec) в одной транзакции:
+    добавляет новые изделия и части, массово обновляет изменившиеся и удаляет отсутствующие в Спецификации.
+    Счётчики производства пересчитываются только для затронутых изделий.
+    Возвращает итоги импорта (ImportReport)
+
+    - diff — отличия Спецификации от объекта (с существующим объектом)
+    - batch_size — кол-во записей в одном запросе
+    """
+    started = time.perf_counter()
+    obj = diff.object
+    touched = set()
+    with transaction.atomic():
+        products, parts = create_products(
+            obj, [change.data for change in diff.products if change.action == 'create'], batch_size)
+        updated_products = []
+        for change in diff.products:
+            if change.action == 'update':
+                for field, (old, new) in change.changes.items():
+                    setattr(change.product, field, new)
+                updated_products.append(change.product)
+        Product.objects.bulk_update(updated_products, PRODUCT_DIFF_FIELDS, batch_size=batch_size)
+        touched.update(product.pk for product in updated_products)
+        new_parts = []
+        updated_parts = []
+        deleted_parts = []
+        for change in diff.products:
+            if change.action not in ('update', 'same'):
+                continue
+            for part_change in change.parts:
+                if part_change.action == 'create':
+                    new_parts.append(Part(name=part_change.name, product=change.product,
+                                          price=part_change.data.get('price')))
+                elif part_change.action == 'update':
+                    for field, (old, new) in part_change.changes.items():
+                        setattr(part_change.part, field, new)
+                    updated_parts.append(part_change.part)
+                elif part_change.action == 'delete':
+                    deleted_parts.append(part_change.part.pk)
+                else:
+                    continue
+                touched.add(change.product.pk)
+        Part.objects.bulk_create(new_parts, batch_size=batch_size)
+        ProductionCounter.objects.bulk_create(
+            [ProductionCounter(part=part) for part in new_parts], batch_size=batch_size)
+        Part.objects.bulk_update(updated_parts, PART_DIFF_FIELDS, batch_size=batch_size)
+        deleted_products = [change.product.pk for change in diff.products if change.action == 'delete']
+        # Удаление выполняется через выборку, поэтому сигналы удаления (события, счётчики) срабатывают как обычно
+        Part.objects.filter(pk__in=deleted_parts).delete()
+        Product.objects.filter(pk__in=deleted_products).delete()
+        for product_id in sorted(touched):
+            rebalance_product(product_id)
+        refresh_ready_percentages(Object.objects.filter(pk=obj.pk))
+        # Цены изделий и частей определяют выплаты за текущий месяц: пересчитываются только записи ведомости
+        # работников, произведших изделия/части с изменившейся ценой
+        repriced_products = [change.product.pk for change in diff.products
+                             if change.action == 'update' and 'price' in change.changes]
+        repriced_parts = [part.pk for part in updated_parts]
+        if repriced_products or repriced_parts:
+            payroll.rebuild_entries(products=repriced_products, parts=repriced_parts)
+        publish_on_commit(PRODUCTION_TOPIC, object_topic(obj.pk),
+                          *[product_topic(product_id) for product_id in touched])
+    return ImportReport(obj, products, parts + len(new_parts), time.perf_counter() - started,
+                        len(updated_products) + len(updated_parts), len(deleted_products) + len(deleted_parts))
+
+
+def import_spec(obj_number, prod_data, state, batch_size=IMPORT_BATCH_SIZE, preview=None):
+    """
+    Импортирует Спецификацию: создаёт новый объект или, если объект с таким номером уже есть,
+    применяет к нему только отличия от Спецификации (без повторного создания объекта).
+    Отличия сравниваются с показанными при предпросмотре и записываются в одной транзакции.
+    Возвращает итоги импорта (ImportReport), если отличия изменились после предпросмотра — PreviewOutdated
+
+    - obj_number — номер объекта
+    - prod_data — данные изделий {индекс: данные изделия}
+    - state — начальное состояние нового объекта
+    - batch_size — кол-во записей в одном запросе
+    - preview — отличия, показанные при предпросмотре (SpecDiff.as_json; None — импорт без предпросмотра)
+    """
+    with transaction.atomic():
+        diff = diff_spec(obj_number, prod_data)
+        if preview is not None and not diff.matches(preview):
+            raise PreviewOutdated(diff)
+        if diff.object is None:
+            return write_spec(obj_number, prod_data, state, batch_size)
+        return apply_spec_diff(diff, batch_size)
@@ -0,0 +1,246 @@
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from .models import ImportJob, ImportBatch
+from .spec_cache import spec_cache, hash_file, parse_spec_cached
+from .importer import diff_spec, import_spec, PreviewOutdated
+from .blacklist import get_blacklist_matcher
+from .events import publish_on_commit, import_topic, import_batch_topic
+from .pool import init_process, parse_file
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Возвращает пул потоков процесса, выполняющий задачи импорта (создаётся при первой задаче)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMPORT_WORKERS', 1),
+                                           thread_name_prefix='import')
+        return _executor
+
+
+def update_job(job_id, batch_id=None, **fields):
+    """
+    Обновляет поля задачи импорта одним запросом и сообщает подписчикам о ходе импорта
+
+    - job_id — id задачи
+    - batch_id — id пакета, в который входит задача (None — задача не входит в пакет)
+    - fields — новые значения полей
+    """
+    ImportJob.objects.filter(pk=job_id).update(**fields)
+    topics = [import_topic(job_id)]
+    if batch_id is not None:
+        topics.append(import_batch_topic(batch_id))
+    publish_on_commit(*topics)
+
+
+def submit_import(job, state):
+    """
+    Ставит задачу импорта в очередь пула потоков после фиксации текущей транзакции,
+    поэтому запрос, загрузивший Спецификацию, не ждёт её разбора и записи в БД
+
+    - job — задача импорта (ImportJob)
+    - state — начальное состояние объекта
+    """
+    transaction.on_commit(
+        lambda: get_executor().submit(run_import_job, job.pk, state))
+
+
+def run_import_job(job_id, state):
+    """
+    Выполняет задачу импорта: разбирает Спецификацию (spec.parse_spec или кэш spec_cache), сообщая о кол-ве прочитанных строк,
+    и записывает объект в БД (importer.import_spec) или, при предпросмотре, сохраняет отличия Спецификации
+    от существующего объекта (importer.diff_spec). После предпросмотра записываются только показанные отличия:
+    если они изменились, задача возвращается к предпросмотру с новыми отличиями.
+    Ошибки формата и записи сохраняются в задаче
+
+    - job_id — id задачи
+    - state — начальное состояние объекта
+    """
+    close_old_connections()
+    try:
+        job = ImportJob.objects.get(pk=job_id)
+        update_job(job_id, status='PARSING')
+        with job.file.open('rb') as file:
+            # Спецификация с тем же содержимым берётся из кэша без повторного разбора
+            prod_data, rows_parsed = parse_spec_cached(file, job.content_hash or hash_file(file),
+                                                       lambda rows: update_job(job_id, rows_parsed=rows))
+        update_job(job_id, rows_parsed=rows_parsed)
+        if job.dry_run:
+            diff = diff_spec(job.obj_number, prod_data)
+            update_job(job_id, status='PREVIEW', object=diff.object,
+                       diff=diff.as_json(), finished_at=timezone.now())
+            return
+        update_job(job_id, status='WRITING')
+        try:
+            report = import_spec(job.obj_number, prod_data, state, preview=job.diff)
+        except PreviewOutdated as e:
+            update_job(job_id, status='PREVIEW', dry_run=True, object=e.diff.object, diff=e.diff.as_json(),
+                       error='\n'.join(e.messages), finished_at=timezone.now())
+            return
+        update_job(job_id, status='DONE', object=report.object, products_created=report.products,
+                   parts_created=report.parts, records_updated=report.updated, records_deleted=report.deleted,
+                   finished_at=timezone.now())
+    except ValidationError as e:
+        update_job(job_id, status='FAILED', error='\n'.join(
+            e.messages), finished_at=timezone.now())
+    except Exception as e:
+        logger.exception("Ошибка импорта Спецификации (задача %s)", job_id)
+        update_job(job_id, status='FAILED', error=str(e)
+                   or e.__class__.__name__, finished_at=timezone.now())
+    finally:
+        # Поток пула не обслуживает запросы, поэтому соединение с БД закрывается вручную
+        connection.close()
+
+
+SPEC_EXTENSIONS = ('.xls', '.xlsx', '.xlsm')
+"""Расширения файлов Спецификаций"""
+
+
+def iter_archive_specs(archive):
+    """
+    Возвращает (имя файла, содержимое) для Спецификаций из zip-архива (вложенные папки не учитываются).
+    Имена, записанные архиваторами Windows в кодировке cp866, перекодируются
+
+    - archive — zip-архив (файловый объект)
+    """
+    try:
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                name = info.filename
+                if not info.flag_bits & 0x800:
+                    try:
+                        name = name.encode('cp437').decode('cp866')
+                    except UnicodeError:
+                        pass
+                name = os.path.basename(name)
+                if info.is_dir() or name.startswith('.') or not name.lower().endswith(SPEC_EXTENSIONS):
+                    continue
+                yield name, zip_file.read(info)
+    except zipfile.BadZipFile:
+        raise ValidationError(f"Файл {archive.name} не является zip-архивом")
+
+
+def create_import_batch(files, user):
+    """
+    Создаёт пакет импорта с отдельной задачей для каждой Спецификации (zip-архивы распаковываются).
+    Номер объекта берётся из имени файла Спецификации
+
+    - files — загруженные файлы Спецификаций и zip-архивы
+    - user — пользователь, загрузивший файлы
+    """
+    specs = []
+    for file in files:
+        if file.name.lower().endswith('.zip'):
+            specs.extend((name, ContentFile(data, name=name))
+                         for name, data in iter_archive_specs(file))
+        else:
+            specs.append((file.name, file))
+    if not specs:
+        raise ValidationError("Не найдено ни одной Спецификации")
+    with transaction.atomic():
+        batch = ImportBatch.objects.create(created_by=user)
+        for name, file in specs:
+            ImportJob.objects.create(file=file, file_name=name, content_hash=hash_file(file),
+                                     obj_number=name.split()[0], batch=batch, created_by=user)
+    return batch
+
+
+def submit_batch(batch, state):
+    """
+    Ставит пакетный импорт в очередь пула потоков после фиксации текущей транзакции
+
+    - batch — пакет (ImportBatch) с уже созданными задачами импорта
+    - state — начальное состояние новых объектов
+    """
+    transaction.on_commit(
+        lambda: get_executor().submit(run_import_batch, batch.pk, state))
+
+
+def write_batch_job(job, batch_id, prod_data, rows_parsed, error, state):
+    """
+    Записывает в БД объект разобранной Спецификации пакета (в своей транзакции) или сохраняет ошибку разбора
+
+    - job — задача импорта
+    - batch_id — id пакета
+    - prod_data — данные изделий (None при ошибке)
+    - rows_parsed — кол-во прочитанных строк
+    - error — текст ошибки разбора (None, если Спецификация разобрана)
+    - state — начальное состояние нового объекта
+    """
+    if error is not None:
+        update_job(job.pk, batch_id, status='FAILED', rows_parsed=rows_parsed, error=error,
+                   finished_at=timezone.now())
+        return
+    try:
+        update_job(job.pk, batch_id, status='WRITING', rows_parsed=rows_parsed)
+        report = import_spec(job.obj_number, prod_data, state)
+        update_job(job.pk, batch_id, status='DONE', object=report.object, products_created=report.products,
+                   parts_created=report.parts, records_updated=report.updated,
+                   records_deleted=report.deleted, finished_at=timezone.now())
+    except Exception as e:
+        logger.exception("Ошибка импорта Спецификации (задача %s)", job.pk)
+        update_job(job.pk, batch_id, status='FAILED', error=str(e) or e.__class__.__name__,
+                   finished_at=timezone.now())
+
+
+def run_import_batch(batch_id, state):
+    """
+    Выполняет пакетный импорт: Спецификации разбираются параллельно в пуле процессов (pool.parse_file),
+    а каждый разобранный объект сразу записывается в БД в своей транзакции (importer.import_spec),
+    поэтому ошибка в одной Спецификации не отменяет импорт остальных
+
+    - batch_id — id пакета
+    - state — начальное состояние новых объектов
+    """
+    close_old_connections()
+    try:
+        jobs = list(ImportJob.objects.filter(batch_id=batch_id, status='QUEUED'))
+        blacklist = get_blacklist_matcher().patterns
+        parse_jobs = []
+        for job in jobs:
+            update_job(job.pk, batch_id, status='PARSING')
+            # Спецификации, уже разобранные ранее, записываются сразу, без передачи в пул процессов
+            cached = spec_cache.get(job.content_hash, blacklist) if job.content_hash else None
+            if cached is None:
+                parse_jobs.append(job)
+            else:
+                write_batch_job(job, batch_id, *cached, None, state)
+        if not parse_jobs:
+            return
+        # Дочерние процессы запускаются заново, а не копируют процесс сервера с его потоками и соединениями
+        with ProcessPoolExecutor(max_workers=min(len(parse_jobs), getattr(settings, 'IMPORT_PROCESSES', 1)),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_process) as pool:
+            futures = {pool.submit(parse_file, job.file.path, blacklist): job for job in parse_jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    prod_data, rows_parsed, error = future.result()
+                except Exception as e:
+                    prod_data, rows_parsed, error = None, 0, str(e) or e.__class__.__name__
+                if error is None and job.content_hash:
+                    spec_cache.set(job.content_hash, blacklist, (prod_data, rows_parsed))
+                write_batch_job(job, batch_id, prod_data, rows_parsed, error, state)
+    except Exception:
+        logger.exception("Ошибка пакетного импорта (пакет %s)", batch_id)
+        ImportJob.objects.filter(batch_id=batch_id).exclude(status__in=ImportJob.FINISHED_STATUSES).update(
+            status='FAILED', error="Пакетный импорт прерван", finished_at=timezone.now())
+    finally:
+        ImportBatch.objects.filter(pk=batch_id).update(finished_at=timezone.now())
+        publish_on_commit(import_batch_topic(batch_id))
+        connection.close()
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from workspace.caching import get_stats
+
+
+class Command(BaseCommand):
+    help = "Выводит кол-во попаданий и промахов кэша по пространствам ключей"
+
+    def handle(self, *args, **options):
+        for name, (hits, misses) in get_stats().items():
+            total = hits + misses
+            rate = f"{hits / total * 100:.1f}%" if total else "—"
+            self.stdout.write(
+                f"{name}: попаданий {hits}, промахов {misses}, доля попаданий {rate}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from workspace.models import Notification
+
+
+class Command(BaseCommand):
+    help = "Удаляет уведомления, срок хранения которых истёк (вместе с отметками о прочтении)"
+
+    def handle(self, *args, **options):
+        _, deleted = Notification.objects.expired().delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Удалено уведомлений: {deleted.get(Notification._meta.label, 0)}"))
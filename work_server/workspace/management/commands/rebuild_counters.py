@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from workspace.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики производства изделий и частей по экземплярам изделий/частей"
+
+    def handle(self, *args, **options):
+        amount = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересчитано счётчиков: {amount}"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from workspace.payroll import rebuild_ledger
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает ведомость выплат работникам по завершённым экземплярам изделий/частей"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Пересчитать также итоги закрытых месяцев")
+
+    def handle(self, *args, **options):
+        amount = rebuild_ledger(include_closed=options['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересчитано записей ведомости: {amount}"))
@@ -0,0 +1,89 @@
+from .caching import ROLE_VERSIONS
+from .models import WorkerData
+
+
+ROLES_SESSION_KEY = 'workspace_roles'
+"""Ключ сессии, в котором хранятся группы пользователя и id его данных работника"""
+
+ALL_ROLES = 'all'
+"""Ключ версии, общей для всех пользователей (меняется при изменении групп)"""
+
+
+class UserRoles:
+    """
+    Группы пользователя и id его данных работника, определённые один раз для запроса
+
+    - group_ids — id групп пользователя (по возрастанию)
+    - group_names — имена групп пользователя
+    - worker_data_id — id данных работника (None, если их нет)
+    """
+
+    def __init__(self, group_ids, group_names, worker_data_id):
+        self.group_ids = group_ids
+        self.group_names = frozenset(group_names)
+        self.worker_data_id = worker_data_id
+
+    def __contains__(self, group_name):
+        return group_name in self.group_names
+
+    @property
+    def first_group_id(self):
+        """Возвращает id первой группы пользователя (None, если групп нет)"""
+        return self.group_ids[0] if self.group_ids else None
+
+
+def get_roles_versions(user_id):
+    """Возвращает текущие версии групп пользователя (общую и личную)"""
+    return ROLE_VERSIONS.get_versions([ALL_ROLES, user_id])
+
+
+def invalidate_roles(user_ids=None):
+    """
+    Сбрасывает сохранённые в сессиях группы пользователей
+
+    - user_ids — id пользователей (None — всех пользователей)
+    """
+    ROLE_VERSIONS.bump([ALL_ROLES] if user_ids is None else user_ids)
+
+
+def load_roles(user):
+    """Загружает из БД группы пользователя и id его данных работника"""
+    groups = list(user.groups.order_by('id').values_list('id', 'name'))
+    worker_data_id = WorkerData.objects.filter(
+        worker=user).values_list('id', flat=True).first()
+    return UserRoles([group[0] for group in groups], [group[1] for group in groups], worker_data_id)
+
+
+def get_request_roles(request):
+    """Возвращает группы пользователя запроса (загружает их из БД, если middleware не подключена)"""
+    roles = getattr(request, 'roles', None)
+    if roles is None:
+        roles = request.roles = load_roles(request.user)
+    return roles
+
+
+class UserRolesMiddleware:
+    """
+    Определяет группы пользователя и id его данных работника один раз и сохраняет их в сессии.
+    Сохранённые данные используются, пока не изменятся версии групп пользователя (при изменении групп
+    или данных работника), и доступны в запросе как ***request.roles***.
+    Должна подключаться после ***AuthenticationMiddleware***
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.user.is_authenticated:
+            request.roles = self.get_roles(request)
+        return self.get_response(request)
+
+    def get_roles(self, request):
+        versions = get_roles_versions(request.user.pk)
+        saved = request.session.get(ROLES_SESSION_KEY)
+        if saved and saved['user'] == request.user.pk and saved['versions'] == versions:
+            return UserRoles(saved['group_ids'], saved['group_names'], saved['worker_data_id'])
+        roles = load_roles(request.user)
+        request.session[ROLES_SESSION_KEY] = {'user': request.user.pk, 'versions': versions, 'group_ids': roles.group_ids,
+                                              'group_names': sorted(roles.group_names), 'worker_data_id': roles.worker_data_id}
+        return roles
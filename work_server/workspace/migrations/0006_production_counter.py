@@ -0,0 +1,76 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:35
+
+import django.db.models.deletion
+import math
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_counters(apps, schema_editor):
+    """Заполняет счётчики производства по существующим экземплярам изделий/частей"""
+    Product = apps.get_model('workspace', 'Product')
+    CreationInstance = apps.get_model('workspace', 'CreationInstance')
+    ProductionCounter = apps.get_model('workspace', 'ProductionCounter')
+    totals = dict()
+    for row in CreationInstance.objects.values('product_id', 'part_id', 'status').annotate(total=Sum('amount')):
+        key = ('product', row['product_id']) if row['product_id'] else (
+            'part', row['part_id'])
+        totals.setdefault(key, dict())[row['status']] = row['total']
+
+    def make_counter(key, **kwargs):
+        amounts = totals.get(key, dict())
+        return ProductionCounter(queued=amounts.get('QUEUED') or Decimal(0), in_work=amounts.get('IN_WORK') or Decimal(0),
+                                 completed=amounts.get('COMPLETED') or Decimal(0), **kwargs)
+
+    counters = []
+    for product in Product.objects.prefetch_related('part_set'):
+        product_counter = make_counter(('product', product.id), product=product)
+        free = product.amount - (product_counter.queued +
+                                 product_counter.in_work + product_counter.completed)
+        busy = Decimal(0)
+        completed = None
+        for part in product.part_set.all():
+            part_counter = make_counter(('part', part.id), part=part)
+            part_total = part_counter.queued + part_counter.in_work + part_counter.completed
+            part_counter.available = free * part.amount - part_total
+            busy = max(busy, part_total / part.amount)
+            ratio = part_counter.completed / part.amount
+            completed = ratio if completed is None else min(completed, ratio)
+            counters.append(part_counter)
+        product_counter.parts_busy = busy.quantize(
+            Decimal('0.0001'), rounding=ROUND_CEILING)
+        product_counter.parts_completed = max(completed or Decimal(0), Decimal(0)).quantize(
+            Decimal('0.0001'), rounding=ROUND_FLOOR)
+        product_counter.available = free - \
+            math.ceil(product_counter.parts_busy)
+        counters.append(product_counter)
+    ProductionCounter.objects.bulk_create(counters, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0005_part_ava_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductionCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued', models.DecimalField(decimal_places=1, default=0, max_digits=10, verbose_name='В очереди')),
+                ('in_work', models.DecimalField(decimal_places=1, default=0, max_digits=10, verbose_name='В работе')),
+                ('completed', models.DecimalField(decimal_places=1, default=0, max_digits=10, verbose_name='Произведено')),
+                ('available', models.DecimalField(decimal_places=1, default=0, max_digits=12, verbose_name='Доступное кол-во')),
+                ('parts_busy', models.DecimalField(decimal_places=4, default=0, help_text='Наибольшая доля изделия, занятая экземплярами одной из его частей (только для изделий)', max_digits=14, verbose_name='Занято частями')),
+                ('parts_completed', models.DecimalField(decimal_places=4, default=0, help_text='Доля изделия, произведённая экземплярами всех его частей (только для изделий)', max_digits=14, verbose_name='Произведено частями')),
+                ('part', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='counter', to='workspace.part', verbose_name='Часть')),
+                ('product', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='counter', to='workspace.product', verbose_name='Изделие')),
+            ],
+            options={
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('part__isnull', True), ('product__isnull', False)), models.Q(('part__isnull', False), ('product__isnull', True)), _connector='OR'), name='counter_product_xor_part', violation_error_message='Счётчики относятся либо к изделию, либо к части')],
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
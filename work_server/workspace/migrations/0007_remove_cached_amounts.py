@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0006_production_counter'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='part',
+            name='ava_amount',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='ava_amount',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='completed_amount',
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:41
+
+import django.db.models.deletion
+import datetime
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+
+def fill_ledger(apps, schema_editor):
+    """Заполняет ведомость выплат по существующим завершённым экземплярам изделий/частей"""
+    CreationInstance = apps.get_model('workspace', 'CreationInstance')
+    PayrollLedger = apps.get_model('workspace', 'PayrollLedger')
+    current_month = datetime.date.today().replace(day=1)
+    rows = CreationInstance.objects.filter(status='COMPLETED', completed__isnull=False).annotate(
+        month=TruncMonth('completed')).values('worker_id', 'month').annotate(
+        total_amount=Sum('amount'),
+        total_payment=Sum(F('amount') * Coalesce(F('product__price'), F('part__price')),
+                          output_field=DecimalField(max_digits=20, decimal_places=3)),
+        total_items=Count('id')).order_by()
+    PayrollLedger.objects.bulk_create([
+        PayrollLedger(worker_id=row['worker_id'], month=row['month'], amount=row['total_amount'],
+                      payment=row['total_payment'] or Decimal(0), items=row['total_items'],
+                      closed=row['month'] < current_month) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0007_remove_cached_amounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayrollLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Первый день месяца', verbose_name='Месяц')),
+                ('amount', models.DecimalField(decimal_places=1, default=0, max_digits=12, verbose_name='Произведено')),
+                ('payment', models.DecimalField(decimal_places=3, default=0, max_digits=20, verbose_name='Выплата')),
+                ('items', models.IntegerField(default=0, verbose_name='Кол-во записей')),
+                ('closed', models.BooleanField(default=False, help_text='Итоги закрытого месяца больше не изменяются', verbose_name='Месяц закрыт')),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to='workspace.workerdata', verbose_name='Работник')),
+            ],
+            options={
+                'ordering': ['worker', 'month'],
+                'constraints': [models.UniqueConstraint(models.F('worker'), models.F('month'), name='payroll_ledger_worker_month_unique', violation_error_message='Итоги работника за этот месяц уже существуют')],
+            },
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0009_notification_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/')),
+                ('file_name', models.CharField(max_length=255)),
+                ('obj_number', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('QUEUED', 'В очереди'), ('PARSING', 'Чтение файла'), ('WRITING', 'Запись в базу данных'), ('DONE', 'Завершено'), ('FAILED', 'Ошибка')], default='QUEUED', max_length=255)),
+                ('rows_parsed', models.PositiveIntegerField(default=0)),
+                ('products_created', models.PositiveIntegerField(default=0)),
+                ('parts_created', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('object', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='workspace.object')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:20
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0010_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='diff',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='dry_run',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='records_deleted',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='records_updated',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='status',
+            field=models.CharField(choices=[('QUEUED', 'В очереди'), ('PARSING', 'Чтение файла'), ('WRITING', 'Запись в базу данных'), ('PREVIEW', 'Предпросмотр'), ('DONE', 'Завершено'), ('FAILED', 'Ошибка')], default='QUEUED', max_length=255),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0013_import_job_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='creationinstance',
+            index=models.Index(fields=['product', 'status'], name='instance_product_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creationinstance',
+            index=models.Index(fields=['part', 'status'], name='instance_part_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creationinstance',
+            index=models.Index(fields=['worker', 'status', 'completed'], name='instance_worker_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creationinstance',
+            index=models.Index(fields=['worker', 'product', 'part', 'status'], name='instance_worker_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creationinstance',
+            index=models.Index(condition=models.Q(('status', 'IN_WORK')), fields=['id'], name='instance_in_work_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('answer', '')), fields=['instance', 'id'], name='question_unanswered_idx'),
+        ),
+    ]
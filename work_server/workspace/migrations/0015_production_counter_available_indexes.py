@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workspace', '0014_creation_instance_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productioncounter',
+            index=models.Index(condition=models.Q(('available__gt', 0)), fields=['product'], name='counter_product_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productioncounter',
+            index=models.Index(condition=models.Q(('available__gt', 0)), fields=['part'], name='counter_part_available_idx'),
+        ),
+    ]
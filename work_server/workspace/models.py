@@ -1,13 +1,16 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.db.models import UniqueConstraint, Prefetch
-from django.db.models.functions import Lower
+from django.db.models import (UniqueConstraint, CheckConstraint, Prefetch, Sum, F, Q, Value, DecimalField, Exists,
+                              OuterRef)
+from django.db.models.functions import Lower, Coalesce, Concat
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
+import math
 from django.contrib.auth.models import User, Group
 
 
@@ -22,7 +25,93 @@ def validate_worker(worker):
         raise ValidationError(f"{worker.username} не является рабочим")
 
 
-class Product(models.Model):
+INSTANCE_AMOUNT_ANNOTATIONS = {
+    'QUEUED': 'instances_queued',
+    'IN_WORK': 'instances_in_work',
+    'COMPLETED': 'instances_completed',
+}
+"""Имена аннотаций с суммарным кол-вом экземпляров CreationInstance (по статусам)"""
+
+
+def instances_amount_sum(status):
+    """
+    Условная сумма кол-ва экземпляров CreationInstance для аннотации изделий/частей
+
+    - status — статус экземпляров
+    """
+    return Coalesce(Sum('creationinstance__amount', filter=Q(creationinstance__status=status)), Value(Decimal(0)),
+                    output_field=DecimalField(max_digits=10, decimal_places=1))
+
+
+class PartQuerySet(models.QuerySet):
+
+    def with_instance_totals(self):
+        """Добавляет к частям суммарное кол-во экземпляров по статусам (один запрос с группировкой)"""
+        return self.annotate(**{name: instances_amount_sum(status)
+                                for status, name in INSTANCE_AMOUNT_ANNOTATIONS.items()})
+
+    def with_availability(self):
+        """Подгружает счётчики производства частей"""
+        return self.select_related('counter')
+
+
+class SavedPriceMixin:
+    """Запоминает цену, загруженную из БД: по ней при сохранении определяется, изменилась ли цена"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'price' not in instance.get_deferred_fields():
+            instance._saved_price = instance.price
+        return instance
+
+    def price_changed(self):
+        """Проверяет, отличается ли цена от загруженной из БД (без обращения к БД)"""
+        return hasattr(self, '_saved_price') and self._saved_price != self.price
+
+
+class ProductQuerySet(models.QuerySet):
+
+    def with_instance_totals(self):
+        """
+        Добавляет к изделиям суммарное кол-во экземпляров по статусам
+        и подгружает их части с такими же данными (используется для пересчёта счётчиков)
+        """
+        return self.annotate(**{name: instances_amount_sum(status)
+                                for status, name in INSTANCE_AMOUNT_ANNOTATIONS.items()}).prefetch_related(
+            Prefetch('part_set', queryset=Part.objects.with_instance_totals()))
+
+    def with_availability(self):
+        """
+        Подгружает счётчики производства изделий, их части и счётчики частей.
+
+        Доступное, находящееся в работе и произведённое кол-во всех изделий выборки и их частей
+        после этого не требует обращений к БД (два запроса на всю выборку)
+        """
+        return self.select_related('counter').prefetch_related(
+            Prefetch('part_set', queryset=Part.objects.with_availability()))
+
+    def available_for_work(self, search=''):
+        """
+        Оставляет изделия, которые работник может взять в работу: объект не скрыт, не завершён и находится В сборке,
+        а доступно само изделие или хотя бы одна его часть. Доступность проверяется по счётчикам производства,
+        а поиск — по номеру изделия (объект-изделие) в том же запросе
+
+        - search — часть номера изделия (пр. 105-0)
+        """
+        products = self.filter(
+            Exists(ObjectStateInstance.objects.filter(
+                object=OuterRef('object'), state__name=READY_STATE_NAME)),
+            Q(counter__available__gt=0) | Exists(ProductionCounter.objects.filter(
+                part__product=OuterRef('pk'), available__gt=0)),
+            object__hidden=False, object__ready_percentage__lt=100)
+        if search:
+            products = products.annotate(full_id=Concat(
+                'object__obj_number', Value('-'), 'prod_number')).filter(full_id__icontains=search)
+        return products.select_related('object').order_by('object__obj_number', 'object_id', 'id')
+
+
+class Product(SavedPriceMixin, models.Model):
     """Модель, описывающая изделие"""
     prod_number = models.CharField(
         verbose_name="Номер изделия",
@@ -60,11 +149,7 @@ class Product(models.Model):
         limit_value=1, message="Значение должно быть не меньше 1")], help_text="Введите цену изделия (не меньше 1)",
         default=1)
 
-    ava_amount = models.IntegerField(
-        verbose_name="Доступное кол-во", validators=[MinValueValidator(0)], null=True, blank=True)
-
-    completed_amount = models.DecimalField(verbose_name="Произведённое кол-во", validators=[
-                                           MinValueValidator(0)], null=True, blank=True, max_digits=10, decimal_places=1)
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.object}-{self.prod_number} {self.name}"
@@ -81,51 +166,31 @@ class Product(models.Model):
     def get_deadline_days(self):
         return self.object.get_deadline_days()
 
+    def get_counter(self):
+        """Возвращает счётчики производства изделия (пересчитывает их, если они ещё не созданы)"""
+        try:
+            return self.counter
+        except ObjectDoesNotExist:
+            from .counters import rebuild_counters
+            rebuild_counters(Product.objects.filter(pk=self.pk))
+            self.counter = ProductionCounter.objects.get(product=self)
+            return self.counter
+
     def get_ava_amount(self):
-        if self.ava_amount:
-            return self.ava_amount
-        amount = 0
-        instances = CreationInstance.objects.filter(product=self)
-        for instance in instances:
-            if instance.product:
-                amount += instance.amount
-        max_amount = 0
-        parts = Part.objects.filter(product=self)
-        for part in parts:
-            busy = part.get_all_amount() / part.amount
-            busy = int(busy) + 1 if int(busy) != busy else int(busy)
-            max_amount = max(max_amount, busy)
-        amount += max_amount
-        self.ava_amount = self.amount - amount
-        self.save()
-        return self.ava_amount
+        available = self.get_counter().available
+        # Целое кол-во изделий отображается без дробной части
+        return int(available) if available == int(available) else available
 
     def ava_float(self):
-        amount = 0
-        instances = CreationInstance.objects.filter(product=self)
-        for instance in instances:
-            if instance.product:
-                amount += instance.amount
-        max_amount = 0
-        parts = Part.objects.filter(product=self)
-        for part in parts:
-            busy = part.get_all_amount() / part.amount
-            max_amount = max(max_amount, busy)
-        amount += max_amount
-        return self.amount - amount
+        counter = self.get_counter()
+        return counter.available + math.ceil(counter.parts_busy) - counter.parts_busy
 
     def get_in_work_amount(self):
-        amount = 0
-        instances = CreationInstance.objects.filter(
-            product=self, status='IN_WORK')
-        for instance in instances:
-            amount += instance.amount
-        return amount
+        return self.get_counter().in_work
 
     def get_in_work_by_parts_amount(self):
         min_amount = -1
-        parts = Part.objects.filter(product=self)
-        for part in parts:
+        for part in self.part_set.all():
             in_work = part.get_in_work_amount() / part.amount
             in_work = int(in_work)
             if min_amount == -1:
@@ -139,71 +204,30 @@ class Product(models.Model):
         return self.get_in_work_amount() + self.get_in_work_by_parts_amount()
 
     def get_parts_in_work_amount(self):
-        parts = Part.objects.filter(product=self)
         amount = 0
-        for part in parts:
+        for part in self.part_set.all():
             amount += part.get_in_work_amount()
         return amount
 
     def get_ava_parts_amount(self):
-        parts = Part.objects.filter(product=self)
         amount = 0
-        for part in parts:
+        for part in self.part_set.all():
             amount += part.get_ava_amount()
         return amount
 
     def get_completed_amount(self):
-        if self.completed_amount != None:
-            return int(self.completed_amount)
-        amount = 0
-        products = CreationInstance.objects.filter(
-            product=self, status='COMPLETED')
-        for product in products:
-            amount += product.amount
-        parts = Part.objects.filter(product=self)
-        min_amount = -1
-        for part in parts:
-            if min_amount == -1:
-                min_amount = Decimal(part.get_completed_amount()) / part.amount
-            else:
-                min_amount = min(
-                    min_amount, Decimal(part.get_completed_amount()) / part.amount)
-        min_amount = max(min_amount, 0)
-        amount = Decimal(amount) + min_amount
-        self.completed_amount = amount
-        self.save()
-        return int(self.completed_amount)
+        return int(self.completed_float())
 
     def completed_float(self):
-        amount = Decimal(0)
-        products = CreationInstance.objects.filter(
-            product=self, status='COMPLETED')
-        for product in products:
-            amount += product.amount
-        parts = Part.objects.filter(product=self)
-        min_amount = Decimal(-1)
-        for part in parts:
-            if min_amount == -1:
-                min_amount = Decimal(part.get_completed_amount()) / part.amount
-            else:
-                min_amount = min(
-                    min_amount, Decimal(part.get_completed_amount()) / part.amount)
-        min_amount = max(min_amount, 0)
-        amount = amount + min_amount
-        return amount
+        counter = self.get_counter()
+        return counter.completed + max(counter.parts_completed, 0)
 
     def get_full_completed(self):
-        amount = 0
-        products = CreationInstance.objects.filter(
-            product=self, status='COMPLETED')
-        for product in products:
-            amount += product.amount
-        return amount
+        return self.get_counter().completed
 
     def get_completed_parts_amount(self):
         amount = 0
-        parts = Part.objects.filter(product=self)
-        for part in parts:
+        for part in self.part_set.all():
             amount += part.get_completed_amount()
         return amount
 
@@ -211,7 +235,7 @@ class Product(models.Model):
         ordering = ['object', 'prod_number']
 
 
-class Part(models.Model):
+class Part(SavedPriceMixin, models.Model):
     """Модель, описывающая часть изделия"""
     name = models.CharField(
         verbose_name="Название части",
@@ -238,44 +262,29 @@ class Part(models.Model):
         max_digits=12, decimal_places=2
     )
 
-    ava_amount = models.DecimalField(verbose_name="Доступное кол-во", validators=[
-                                     MinValueValidator(0)], max_digits=10, decimal_places=1, null=True, blank=True)
+    objects = PartQuerySet.as_manager()
+
+    def get_counter(self):
+        """Возвращает счётчики производства части (пересчитывает их, если они ещё не созданы)"""
+        try:
+            return self.counter
+        except ObjectDoesNotExist:
+            from .counters import rebuild_counters
+            rebuild_counters(Product.objects.filter(pk=self.product_id))
+            self.counter = ProductionCounter.objects.get(part=self)
+            return self.counter
 
     def get_in_work_amount(self):
-        amount = 0
-        parts = CreationInstance.objects.filter(part=self, status='IN_WORK')
-        for part in parts:
-            amount += part.amount
-        return amount
+        return self.get_counter().in_work
 
     def get_all_amount(self):
-        amount = 0
-        instances = CreationInstance.objects.filter(part=self)
-        for instance in instances:
-            amount += instance.amount
-        return amount
+        return self.get_counter().get_total()
 
     def get_ava_amount(self):
-        if self.ava_amount:
-            return self.ava_amount
-        ava_amount = self.product.amount
-        instances = CreationInstance.objects.filter(product=self.product)
-        for instance in instances:
-            ava_amount -= instance.amount
-        ava_amount *= self.amount
-        parts = CreationInstance.objects.filter(part=self)
-        for part in parts:
-            ava_amount -= part.amount
-        self.ava_amount = ava_amount
-        self.save()
-        return self.ava_amount
+        return self.get_counter().available
 
     def get_completed_amount(self):
-        amount = 0
-        parts = CreationInstance.objects.filter(part=self, status='COMPLETED')
-        for part in parts:
-            amount += part.amount
-        return amount
+        return self.get_counter().completed
 
     def get_id(self):
         return self.product.get_id()
@@ -287,6 +296,10 @@ class Part(models.Model):
         return f'{self.product.get_id()} {self.name}'
 
 
+READY_STATE_NAME = "В сборке"
+"""Состояние объекта, изделия которого можно брать в работу"""
+
+
 class ObjectState(models.Model):
     """Модель, описывающая состояние объекта"""
     name = models.CharField(
@@ -412,52 +425,19 @@ class Object(models.Model):
         return ret_str
 
     def get_ready_percentage(self):
-        if self.ready_percentage != None:
-            return int(self.ready_percentage)
-        full_price = Decimal(0)
-        ready_price = Decimal(0)
-        products = Product.objects.filter(
-            object=self).prefetch_related(Prefetch('part_set', queryset=Part.objects.all()))
-        all_amount = 0
-        compl_amount = 0
-        for product in products:
-            full_price += product.price * product.amount
-            ready_price += product.price * product.get_full_completed()
-            all_amount += product.amount
-            compl_amount += product.get_full_completed()
-            for part in product.part_set.all():
-                ready_price += part.price * part.get_completed_amount()
-                all_amount += part.amount * product.amount
-                compl_amount += part.get_completed_amount()
-
-        if all_amount == compl_amount:
-            self.ready_percentage = 100
-            self.save()
-            return int(self.ready_percentage)
-        if compl_amount == 0:
-            self.ready_percentage = 0
-            self.save()
-            return int(self.ready_percentage)
-
-        if full_price != 0:
-            res = (ready_price / full_price) * 100
-            res = max(0, res)
-            res = min(res, 100)
-            self.ready_percentage = res
-            self.save()
-        else:
-            self.ready_percentage = 0
-            self.save()
-            res = 0
+        if self.ready_percentage is None:
+            from .counters import refresh_ready_percentages
+            refresh_ready_percentages([self])
         return int(self.ready_percentage)
 
     def get_state_color(self):
-        states = ObjectStateInstance.objects.filter(object_id=self.id)
+        # Состояния берутся через связь, поэтому могут быть загружены заранее (prefetch_related)
+        states = self.objectstateinstance_set.all()
         color = 'none'
         for state in states:
             if state.state.name == "Приостановлен":
                 color = 'chocolate'
-            elif state.state.name == "В сборке":
+            elif state.state.name == READY_STATE_NAME:
                 color = 'chartreuse'
                 break
         return color
@@ -482,6 +462,43 @@ class ObjectStateInstance(models.Model):
         ordering = ['object', 'state']
 
 
+def instance_price(prefix=''):
+    """
+    Выражение стоимости единицы экземпляра изделия/части: цена изделия, а для части — цена части
+
+    - prefix — путь до CreationInstance от модели, к которой применяется выражение (пр. creationinstance__)
+    """
+    return Coalesce(F(f'{prefix}product__price'), F(f'{prefix}part__price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+PAYMENT_FIELD = DecimalField(max_digits=20, decimal_places=3)
+"""Тип сумм выплат, вычисляемых в БД"""
+
+
+class WorkerDataQuerySet(models.QuerySet):
+
+    def with_payroll(self, month):
+        """
+        Добавляет к работникам кол-во произведённых изделий/частей и сумму выплат
+        за месяц (period_completed, period_payment) и за всё время (total_completed, total_payment).
+        Данные берутся из ведомости выплат (PayrollLedger) одним сгруппированным запросом
+
+        - month — дата в пределах месяца
+        """
+        in_month = Q(ledger__month=month.replace(day=1))
+        amount_field = DecimalField(max_digits=12, decimal_places=1)
+        return self.annotate(
+            period_completed=Coalesce(Sum('ledger__amount', filter=in_month),
+                                      Value(Decimal(0)), output_field=amount_field),
+            period_payment=Coalesce(Sum('ledger__payment', filter=in_month),
+                                    Value(Decimal(0)), output_field=PAYMENT_FIELD),
+            total_completed=Coalesce(Sum('ledger__amount'),
+                                     Value(Decimal(0)), output_field=amount_field),
+            total_payment=Coalesce(Sum('ledger__payment'),
+                                   Value(Decimal(0)), output_field=PAYMENT_FIELD),
+        )
+
+
 class WorkerData(models.Model):
     """Модель, описывающая данные работника"""
     worker = models.ForeignKey(get_user_model(
@@ -490,53 +507,33 @@ class WorkerData(models.Model):
     display_name = models.CharField(
         max_length=256, verbose_name="Отображаемое имя")
 
-    def get_payment(self):
+    objects = WorkerDataQuerySet.as_manager()
+
+    def get_completed_instances(self, start=None, end=None):
+        """Возвращает произведённые работником экземпляры (за период, если он указан)"""
         creations = CreationInstance.objects.filter(
-            worker=self, completed__gte=timezone.now().date().replace(day=1), status='COMPLETED').all()
-        pay = 0
-        for creation in creations:
-            pay += creation.get_price()
-        return pay
+            worker=self, status='COMPLETED')
+        if start:
+            creations = creations.filter(completed__gte=start)
+        if end:
+            creations = creations.filter(completed__lte=end)
+        return creations
+
+    def get_payment(self, start, end):
+        return self.get_completed_instances(start, end).aggregate(
+            pay=Sum(F('amount') * instance_price(), output_field=PAYMENT_FIELD))['pay'] or 0
+
+    def get_completed(self, start, end):
+        return self.get_completed_instances(start, end).aggregate(amount=Sum('amount'))['amount'] or 0
 
     def get_completed_amount(self):
-        creations = CreationInstance.objects.filter(
-            worker=self, completed__gte=timezone.now().date().replace(day=1), status='COMPLETED').all()
-        amount = 0
-        for creation in creations:
-            amount += creation.amount
-        return amount
+        return self.get_completed(timezone.now().date().replace(day=1), None)
 
     def get_all_payment(self):
-        creations = CreationInstance.objects.filter(
-            worker=self, status='COMPLETED').all()
-        pay = 0
-        for creation in creations:
-            pay += creation.get_price()
-        return pay
+        return self.get_payment(None, None)
 
     def get_all_completed_amount(self):
-        creations = CreationInstance.objects.filter(
-            worker=self, status='COMPLETED').all()
-        amount = 0
-        for creation in creations:
-            amount += creation.amount
-        return amount
-
-    def get_completed(self, start, end):
-        creations = CreationInstance.objects.filter(
-            worker=self, completed__gte=start, completed__lte=end, status='COMPLETED').all()
-        amount = 0
-        for creation in creations:
-            amount += creation.amount
-        return amount
-
-    def get_payment(self, start, end):
-        creations = CreationInstance.objects.filter(
-            worker=self, completed__gte=start, completed__lte=end, status='COMPLETED').all()
-        pay = 0
-        for creation in creations:
-            pay += creation.get_price()
-        return pay
+        return self.get_completed(None, None)
 
     def get_absolute_url(self):
         return reverse("worker", args=[str(self.id)])
@@ -572,6 +569,23 @@ class CreationInstance(models.Model):
     completed = models.DateField(
         verbose_name="Дата окончания изготовления", null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем сохранённое в БД состояние для обновления счётчиков производства и ведомости выплат
+        if not instance.get_deferred_fields():
+            instance._saved_state = instance.get_counted_state()
+        return instance
+
+    def get_counted_state(self):
+        """Возвращает данные экземпляра, от которых зависят счётчики производства и ведомость выплат"""
+        return (self.product_id, self.part_id, self.status, self.amount, self.worker_id, self.completed)
+
+    def save(self, *args, **kwargs):
+        # Экземпляр, счётчики производства и ведомость выплат (обновляются сигналом) сохраняются в одной транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse("my-product", args=[str(self.id)])
 
@@ -595,6 +609,96 @@ class CreationInstance(models.Model):
 
     class Meta:
         ordering = ['queued', 'product', 'part']
+        indexes = [
+            # Счётчики и страницы изделий: экземпляры изделия/части в нужном статусе
+            models.Index(fields=['product', 'status'],
+                         name='instance_product_status_idx'),
+            models.Index(fields=['part', 'status'],
+                         name='instance_part_status_idx'),
+            # Выплаты и история работника: произведённые экземпляры за период
+            models.Index(fields=['worker', 'status', 'completed'],
+                         name='instance_worker_status_idx'),
+            # Объединение экземпляров одного работника при завершении и постановке в очередь
+            models.Index(fields=['worker', 'product', 'part', 'status'],
+                         name='instance_worker_item_idx'),
+            # Вкладка «В работе» (постранично по id)
+            models.Index(fields=['id'], condition=Q(status='IN_WORK'),
+                         name='instance_in_work_idx'),
+        ]
+
+
+class ProductionCounter(models.Model):
+    """Модель, описывающая счётчики производства изделия или части (обновляются вместе с экземплярами изделий/частей)"""
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, null=True, blank=True, related_name='counter', verbose_name="Изделие")
+    part = models.OneToOneField(
+        Part, on_delete=models.CASCADE, null=True, blank=True, related_name='counter', verbose_name="Часть")
+    queued = models.DecimalField(
+        verbose_name="В очереди", default=0, max_digits=10, decimal_places=1)
+    in_work = models.DecimalField(
+        verbose_name="В работе", default=0, max_digits=10, decimal_places=1)
+    completed = models.DecimalField(
+        verbose_name="Произведено", default=0, max_digits=10, decimal_places=1)
+    available = models.DecimalField(
+        verbose_name="Доступное кол-во", default=0, max_digits=12, decimal_places=1)
+    parts_busy = models.DecimalField(
+        verbose_name="Занято частями", default=0, max_digits=14, decimal_places=4,
+        help_text="Наибольшая доля изделия, занятая экземплярами одной из его частей (только для изделий)")
+    parts_completed = models.DecimalField(
+        verbose_name="Произведено частями", default=0, max_digits=14, decimal_places=4,
+        help_text="Доля изделия, произведённая экземплярами всех его частей (только для изделий)")
+
+    def get_total(self):
+        return self.queued + self.in_work + self.completed
+
+    def __str__(self):
+        return f'Счётчики {self.product if self.product_id else self.part}'
+
+    class Meta:
+        constraints = [
+            CheckConstraint(
+                condition=Q(product__isnull=False, part__isnull=True) | Q(
+                    product__isnull=True, part__isnull=False),
+                name='counter_product_xor_part',
+                violation_error_message="Счётчики относятся либо к изделию, либо к части"
+            ),
+        ]
+        # Каталог работника: изделия и части, которые можно взять в работу
+        indexes = [
+            models.Index(fields=['product'], condition=Q(available__gt=0),
+                         name='counter_product_available_idx'),
+            models.Index(fields=['part'], condition=Q(available__gt=0),
+                         name='counter_part_available_idx'),
+        ]
+
+
+class PayrollLedger(models.Model):
+    """Модель, описывающая итоги работника за месяц (обновляются при завершении изделий/частей)"""
+    worker = models.ForeignKey(
+        WorkerData, on_delete=models.CASCADE, related_name='ledger', verbose_name="Работник")
+    month = models.DateField(verbose_name="Месяц",
+                             help_text="Первый день месяца")
+    amount = models.DecimalField(
+        verbose_name="Произведено", default=0, max_digits=12, decimal_places=1)
+    payment = models.DecimalField(
+        verbose_name="Выплата", default=0, max_digits=20, decimal_places=3)
+    items = models.IntegerField(
+        verbose_name="Кол-во записей", default=0)
+    closed = models.BooleanField(
+        verbose_name="Месяц закрыт", default=False, help_text="Итоги закрытого месяца больше не изменяются")
+
+    def __str__(self):
+        return f'{self.worker} {self.month:%m.%Y}'
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                'worker', 'month',
+                name='payroll_ledger_worker_month_unique',
+                violation_error_message="Итоги работника за этот месяц уже существуют"
+            ),
+        ]
+        ordering = ['worker', 'month']
 
 
 class Question(models.Model):
@@ -616,6 +720,9 @@ class Question(models.Model):
 
     class Meta:
         ordering = ['instance']
+        # Вопросы без ответа (вкладка «Вопросы» и счётчик вопросов)
+        indexes = [models.Index(fields=['instance', 'id'], condition=Q(answer=''),
+                                name='question_unanswered_idx')]
 
 
 class ParseBlacklistValue(models.Model):
@@ -627,6 +734,31 @@ class ParseBlacklistValue(models.Model):
         return self.value
 
 
+NOTIFICATION_SHOW_PERIOD = timedelta(seconds=100)
+"""Время после создания, в течение которого уведомление показывается пользователям"""
+
+NOTIFICATION_RETENTION_PERIOD = timedelta(days=30)
+"""Время хранения уведомлений (более старые удаляются командой prune_notifications)"""
+
+
+class NotificationQuerySet(models.QuerySet):
+
+    def unread(self, user, group):
+        """
+        Возвращает непрочитанные пользователем уведомления группы, которые ещё показываются пользователям
+        (новые — первыми). Прочтение проверяется подзапросом по индексу таблицы прочтений
+
+        - user — пользователь
+        - group — группа пользователя
+        """
+        return self.filter(recipient_group=group, created_at__gte=timezone.now() - NOTIFICATION_SHOW_PERIOD).exclude(
+            read_by=user).order_by('-created_at')
+
+    def expired(self):
+        """Возвращает уведомления, срок хранения которых истёк"""
+        return self.filter(created_at__lt=timezone.now() - NOTIFICATION_RETENTION_PERIOD)
+
+
 class Notification(models.Model):
     recipient_group = models.ForeignKey(Group, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
@@ -634,8 +766,97 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     read_by = models.ManyToManyField(User, blank=True)
 
+    objects = NotificationQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(
+            fields=['recipient_group', '-created_at'], name='notification_group_created_idx')]
 
     def __str__(self):
         return f"Уведомление для {self.recipient_group.name}: {self.title} {self.message}"
+
+
+class ImportBatch(models.Model):
+    """Пакетный импорт нескольких Спецификаций (jobs.run_import_batch), каждая — отдельной задачей ImportJob"""
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Пакетный импорт от {self.created_at:%d.%m.%Y %H:%M}"
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def get_totals(self):
+        """Возвращает итоги пакета: кол-во задач по состояниям и добавленных/изменённых записей"""
+        return self.importjob_set.aggregate(jobs=models.Count('id'),
+                                            done=models.Count('id', filter=Q(status='DONE')),
+                                            failed=models.Count('id', filter=Q(status='FAILED')),
+                                            products=Coalesce(Sum('products_created'), 0),
+                                            parts=Coalesce(Sum('parts_created'), 0),
+                                            updated=Coalesce(Sum('records_updated'), 0),
+                                            deleted=Coalesce(Sum('records_deleted'), 0))
+
+
+class ImportJob(models.Model):
+    """
+    Задача фонового импорта Спецификации (выполняется в jobs.run_import_job).
+    При предпросмотре (dry_run) задача только сохраняет отличия Спецификации от существующего объекта (diff)
+    """
+    STATUSES = [('QUEUED', 'В очереди'), ('PARSING', 'Чтение файла'), ('WRITING', 'Запись в базу данных'),
+                ('PREVIEW', 'Предпросмотр'), ('DONE', 'Завершено'), ('FAILED', 'Ошибка')]
+    FINISHED_STATUSES = ('PREVIEW', 'DONE', 'FAILED')
+
+    file = models.FileField(upload_to='imports/%Y/%m/')
+    file_name = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    obj_number = models.CharField(max_length=255)
+    status = models.CharField(
+        choices=STATUSES, max_length=255, default='QUEUED')
+    dry_run = models.BooleanField(default=False)
+    rows_parsed = models.PositiveIntegerField(default=0)
+    products_created = models.PositiveIntegerField(default=0)
+    parts_created = models.PositiveIntegerField(default=0)
+    records_updated = models.PositiveIntegerField(default=0)
+    records_deleted = models.PositiveIntegerField(default=0)
+    diff = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True, default='')
+    object = models.ForeignKey(
+        Object, on_delete=models.SET_NULL, null=True, blank=True)
+    batch = models.ForeignKey(
+        ImportBatch, on_delete=models.CASCADE, null=True, blank=True)
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Импорт {self.file_name} ({self.get_status_display()})"
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    def get_previous_import(self):
+        """Возвращает более раннюю завершённую задачу импорта той же Спецификации (с тем же содержимым)"""
+        if not self.content_hash:
+            return None
+        return ImportJob.objects.filter(content_hash=self.content_hash, obj_number=self.obj_number, status='DONE',
+                                        created_at__lt=self.created_at).order_by('-created_at').first()
+
+    def progress(self):
+        """Возвращает состояние задачи для периодического опроса страницы импорта"""
+        return {'status': self.status, 'status_display': self.get_status_display(), 'finished': self.finished,
+                'rows_parsed': self.rows_parsed, 'products_created': self.products_created,
+                'parts_created': self.parts_created, 'records_updated': self.records_updated,
+                'records_deleted': self.records_deleted, 'error': self.error}
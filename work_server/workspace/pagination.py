@@ -0,0 +1,108 @@
+from datetime import date
+from django.core import signing
+from django.db.models import Q
+
+
+PAGE_SIZE = 50
+"""Кол-во строк на странице списков"""
+
+CURSOR_PARAM = 'cursor'
+"""Параметр запроса с курсором страницы"""
+
+CURSOR_SALT = 'workspace.pagination'
+"""Соль подписи курсоров (курсор нельзя подделать, изменив параметр запроса)"""
+
+
+class KeysetPage:
+    """
+    Страница списка, полученная по курсору (значениям ключей сортировки последней строки
+    предыдущей страницы), а не по смещению: БД не перебирает строки предыдущих страниц
+
+    - items — строки страницы
+    - next_url — ссылка на следующую страницу (None — страница последняя)
+    - first_url — ссылка на первую страницу (None — страница первая)
+    """
+
+    def __init__(self, items, next_url=None, first_url=None):
+        self.items = items
+        self.next_url = next_url
+        self.first_url = first_url
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_other_pages(self):
+        return self.next_url is not None or self.first_url is not None
+
+
+def encode_cursor(values):
+    """Возвращает подписанный курсор из значений ключей сортировки (даты записываются в ISO-формате)"""
+    return signing.dumps([value.isoformat() if isinstance(value, date) else value for value in values],
+                         salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, length):
+    """Возвращает значения ключей сортировки из курсора или None, если курсор повреждён"""
+    try:
+        values = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Возвращает условие «строка после курсора» для сортировки по нескольким полям:
+    (f1 > v1) ИЛИ (f1 = v1 И f2 > v2) ИЛИ ... (для полей по убыванию — «меньше»)
+
+    - ordering — поля сортировки (с «-» для сортировки по убыванию)
+    - values — значения полей последней строки предыдущей страницы
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def paginate_keyset(request, queryset, ordering, page_size=PAGE_SIZE):
+    """
+    Возвращает страницу списка (KeysetPage) по курсору из параметра запроса cursor.
+    Из БД получается page_size + 1 строка: лишняя строка показывает, что есть следующая страница.
+    Остальные параметры запроса (поиск, дата) сохраняются в ссылках на страницы
+
+    - request — запрос
+    - queryset — строки списка
+    - ordering — поля сортировки; последним должно быть уникальное поле (id),
+      поля не должны принимать значение NULL
+    - page_size — кол-во строк на странице
+    """
+    queryset = queryset.order_by(*ordering)
+    cursor = request.GET.get(CURSOR_PARAM)
+    values = decode_cursor(cursor, len(ordering)) if cursor else None
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    items = list(queryset[:page_size + 1])
+    params = request.GET.copy()
+    params.pop(CURSOR_PARAM, None)
+    first_url = f'?{params.urlencode()}' if values is not None else None
+    next_url = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        params[CURSOR_PARAM] = encode_cursor(
+            [getattr(last, field.lstrip('-')) for field in ordering])
+        next_url = f'?{params.urlencode()}'
+    return KeysetPage(items, next_url, first_url)
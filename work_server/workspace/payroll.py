@@ -0,0 +1,178 @@
+from django.db import transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from decimal import Decimal
+from .models import Product, Part, CreationInstance, PayrollLedger, PAYMENT_FIELD, instance_price
+
+
+def get_current_month():
+    """Возвращает первый день текущего месяца"""
+    return timezone.now().date().replace(day=1)
+
+
+def close_past_months():
+    """Закрывает итоги всех месяцев, предшествующих текущему"""
+    return PayrollLedger.objects.filter(closed=False, month__lt=get_current_month()).update(closed=True)
+
+
+def get_ledger_entry(state, prices=None):
+    """
+    Возвращает данные экземпляра для ведомости: (id работника, месяц, кол-во, выплата)
+    или None, если экземпляр не завершён
+
+    - state — состояние экземпляра (CreationInstance.get_counted_state)
+    - prices — уже полученные цены изделий/частей {(id изделия, id части): цена} (дополняется)
+    """
+    if state is None:
+        return None
+    product_id, part_id, status, amount, worker_id, completed = state
+    if status != 'COMPLETED' or completed is None:
+        return None
+    if prices is None:
+        prices = {}
+    if (product_id, part_id) not in prices:
+        if product_id:
+            prices[(product_id, part_id)] = Product.objects.filter(
+                pk=product_id).values_list('price', flat=True).first()
+        else:
+            prices[(product_id, part_id)] = Part.objects.filter(
+                pk=part_id).values_list('price', flat=True).first()
+    price = prices[(product_id, part_id)]
+    if price is None:
+        return None
+    return (worker_id, completed.replace(day=1), amount, price * amount)
+
+
+def book(worker_id, month, amount, payment, items):
+    """
+    Добавляет к итогам работника за месяц указанные значения (закрытые месяцы не изменяются)
+
+    - worker_id — id работника
+    - month — первый день месяца
+    - amount, payment, items — изменение кол-ва, выплаты и числа записей
+    """
+    if month < get_current_month() or (not amount and not payment and not items):
+        return
+    entry, _ = PayrollLedger.objects.get_or_create(
+        worker_id=worker_id, month=month)
+    PayrollLedger.objects.filter(pk=entry.pk, closed=False).update(
+        amount=F('amount') + amount, payment=F('payment') + payment, items=F('items') + items)
+
+
+def apply_instance_change(old_state, new_state):
+    """
+    Применяет к ведомости выплат изменение экземпляра изделия/части.
+    Должна вызываться в транзакции, изменившей экземпляр
+
+    - old_state — состояние экземпляра до изменения (None, если экземпляр создан)
+    - new_state — состояние экземпляра после изменения (None, если экземпляр удалён)
+    """
+    apply_instance_changes([(old_state, new_state)])
+
+
+def apply_instance_changes(changes, prices=None):
+    """
+    Применяет к ведомости выплат изменения нескольких экземпляров: изменения суммируются
+    по работнику и месяцу, поэтому каждая запись ведомости изменяется один раз.
+    Должна вызываться в транзакции, изменившей экземпляры
+
+    - changes — изменения [(состояние до изменения, состояние после изменения)]
+    - prices — уже известные цены изделий/частей {(id изделия, id части): цена}
+    """
+    prices = dict(prices or {})
+    totals = {}
+
+    def add(worker_id, month, amount, payment, items):
+        total = totals.setdefault((worker_id, month), [0, 0, 0])
+        total[0] += amount
+        total[1] += payment
+        total[2] += items
+    for old_state, new_state in changes:
+        old = get_ledger_entry(old_state, prices)
+        new = get_ledger_entry(new_state, prices)
+        if old == new:
+            continue
+        # Итоги закрытых месяцев не изменяются (book), а в новый месяц экземпляр записывается целиком —
+        # так же, как при пересчёте ведомости (rebuild_ledger). Поэтому произведённые экземпляры
+        # не объединяются с экземплярами прошлых месяцев (reservations.complete_instances)
+        if old:
+            add(old[0], old[1], -old[2], -old[3], -1)
+        if new:
+            add(new[0], new[1], new[2], new[3], 1)
+    for (worker_id, month), (amount, payment, items) in totals.items():
+        book(worker_id, month, amount, payment, items)
+
+
+def rebuild_entries(products=(), parts=()):
+    """
+    Пересчитывает только открытые записи ведомости (работник, месяц), в которые входят произведённые
+    экземпляры указанных изделий/частей (пр. после изменения их цены). Записи блокируются до пересчёта,
+    поэтому параллельные изменения ведомости (book) не теряются.
+    Возвращает кол-во пересчитанных записей
+
+    - products — id изделий
+    - parts — id частей
+    """
+    instances = CreationInstance.objects.filter(
+        status='COMPLETED', completed__gte=get_current_month())
+    changed = (instances.filter(product_id__in=list(products)) |
+               instances.filter(part_id__in=list(parts)))
+    entries = set(changed.annotate(month=TruncMonth('completed')).values_list(
+        'worker_id', 'month').distinct().order_by())
+    if not entries:
+        return 0
+    workers = {worker_id for worker_id, _ in entries}
+    with transaction.atomic():
+        ledger = {(entry.worker_id, entry.month): entry for entry in PayrollLedger.objects.select_for_update().filter(
+            worker_id__in=workers, month__gte=get_current_month(), closed=False).order_by('pk')}
+        rows = instances.filter(worker_id__in=workers).annotate(month=TruncMonth('completed')).values(
+            'worker_id', 'month').annotate(
+            total_amount=Sum('amount'),
+            total_payment=Sum(F('amount') * instance_price(),
+                              output_field=PAYMENT_FIELD),
+            total_items=Count('id')).order_by()
+        updated = []
+        created = []
+        for row in rows:
+            key = (row['worker_id'], row['month'])
+            if key not in entries:
+                continue
+            entry = ledger.get(key) or PayrollLedger(
+                worker_id=row['worker_id'], month=row['month'])
+            entry.amount = row['total_amount']
+            entry.payment = row['total_payment'] or Decimal(0)
+            entry.items = row['total_items']
+            (updated if entry.pk else created).append(entry)
+        PayrollLedger.objects.bulk_update(updated, ['amount', 'payment', 'items'])
+        PayrollLedger.objects.bulk_create(created)
+    return len(updated) + len(created)
+
+
+def rebuild_ledger(include_closed=False):
+    """
+    Пересчитывает ведомость выплат по завершённым экземплярам изделий/частей.
+    Возвращает кол-во пересчитанных записей
+
+    - include_closed — пересчитывать ли итоги закрытых месяцев (по умолчанию — только текущий и будущие)
+    """
+    with transaction.atomic():
+        close_past_months()
+        instances = CreationInstance.objects.filter(
+            status='COMPLETED', completed__isnull=False)
+        ledger = PayrollLedger.objects.all()
+        if not include_closed:
+            instances = instances.filter(completed__gte=get_current_month())
+            ledger = ledger.filter(closed=False)
+        ledger.delete()
+        rows = instances.annotate(month=TruncMonth('completed')).values('worker_id', 'month').annotate(
+            total_amount=Sum('amount'),
+            total_payment=Sum(F('amount') * instance_price(),
+                              output_field=PAYMENT_FIELD),
+            total_items=Count('id')).order_by()
+        current_month = get_current_month()
+        entries = [PayrollLedger(worker_id=row['worker_id'], month=row['month'], amount=row['total_amount'],
+                                 payment=row['total_payment'] or Decimal(0), items=row['total_items'],
+                                 closed=row['month'] < current_month) for row in rows]
+        PayrollLedger.objects.bulk_create(entries, batch_size=500)
+    return len(entries)
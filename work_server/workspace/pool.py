@@ -0,0 +1,31 @@
+# Функции, выполняемые в дочерних процессах пакетного импорта (jobs.run_import_batch).
+# Процессы запускаются заново (spawn), поэтому модуль не импортирует модели на верхнем уровне:
+# Django настраивается в init_process до разбора первого файла
+
+
+def init_process():
+    """Настраивает Django в дочернем процессе (DJANGO_SETTINGS_MODULE наследуется от сервера)"""
+    import django
+    django.setup()
+
+
+def parse_file(path, blacklist):
+    """
+    Разбирает Спецификацию в дочернем процессе, не обращаясь к БД.
+    Возвращает (данные изделий, кол-во прочитанных строк, None) или (None, 0, текст ошибки)
+
+    - path — путь к файлу Спецификации
+    - blacklist — маски чёрного списка парсинга (загружаются один раз для всего пакета)
+    """
+    from django.core.exceptions import ValidationError
+    from .spec import parse_spec
+    rows = [0]
+
+    def progress(rows_parsed):
+        rows[0] = rows_parsed
+    try:
+        return parse_spec(path, blacklist, progress), rows[0], None
+    except ValidationError as e:
+        return None, rows[0], '\n'.join(e.messages)
+    except Exception as e:
+        return None, rows[0], str(e) or e.__class__.__name__
@@ -0,0 +1,321 @@
+from django.contrib.auth.models import Group
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import CreationInstance, ProductionCounter, Product, Notification
+from .counters import apply_counter_changes
+from .signals import bulk_instance_changes
+from .events import PRODUCTION_TOPIC, publish_on_commit, product_topic, object_topic, instance_topic
+from . import payroll
+
+
+class Availability:
+    """
+    Доступное кол-во изделий и частей по счётчикам производства, заблокированным до конца транзакции
+
+    - products — {id изделия: доступное кол-во}
+    - parts — {id части: доступное кол-во}
+    """
+
+    def __init__(self, products, parts):
+        self.products = products
+        self.parts = parts
+
+    def get(self, product_id=None, part_id=None):
+        """Возвращает доступное кол-во изделия или части (0, если счётчиков нет)"""
+        if product_id:
+            return self.products.get(product_id, 0)
+        return self.parts.get(part_id, 0)
+
+    def take(self, amount, product_id=None, part_id=None):
+        """Уменьшает доступное кол-во изделия или части (для проверки нескольких строк одной выборкой)"""
+        if product_id:
+            self.products[product_id] = self.get(product_id) - amount
+        else:
+            self.parts[part_id] = self.get(part_id=part_id) - amount
+
+
+def lock_availability(product_ids):
+    """
+    Блокирует счётчики изделий (select_for_update, в порядке id, как и при изменении экземпляров)
+    и возвращает доступное кол-во изделий и их частей (Availability).
+    Должна вызываться в транзакции: параллельные запросы к тем же изделиям ждут её завершения
+
+    - product_ids — id изделий
+    """
+    product_ids = sorted(set(product_ids))
+    products = dict(ProductionCounter.objects.select_for_update().filter(
+        product_id__in=product_ids).order_by('product_id').values_list('product_id', 'available'))
+    parts = dict(ProductionCounter.objects.filter(
+        part__product_id__in=product_ids).values_list('part_id', 'available'))
+    return Availability(products, parts)
+
+
+def take_to_work(worker, amount, product=None, part=None):
+    """
+    Берёт изделие или часть в работу. Проверка доступного кол-ва и запись экземпляра выполняются
+    в одной транзакции под блокировкой счётчика изделия, поэтому работники, одновременно берущие
+    последние изделия, не могут взять больше доступного. Возвращает экземпляр в работе,
+    при нехватке изделий — ValidationError
+
+    - worker — работник (WorkerData)
+    - amount — кол-во
+    - product — изделие (если берётся всё изделие)
+    - part — часть изделия (если берётся часть)
+    """
+    product_id = product.pk if product else part.product_id
+    with transaction.atomic():
+        availability = lock_availability([product_id])
+        available = availability.get(product.pk) if product else availability.get(part_id=part.pk)
+        if amount > available:
+            raise ValidationError(
+                "Указанное количество изделий превышает допустимое")
+        # Если запись уже есть, обновляем её (увеличилось кол-во в работе)
+        instance = CreationInstance.objects.filter(
+            worker=worker, product=product, part=part, status='IN_WORK').first()
+        if instance:
+            instance.amount += amount
+            instance.save()
+        else:
+            instance = CreationInstance.objects.create(
+                product=product, part=part, worker=worker, amount=amount, status='IN_WORK',
+                started=timezone.now().date())
+    return instance
+
+
+def claim_queued(instance):
+    """
+    Переводит экземпляр из очереди работника в работу: объединяет его с экземпляром того же работника
+    и изделия/части, уже находящимся в работе, или сам экземпляр становится экземпляром в работе.
+    Как и при взятии в работу, сначала блокируется счётчик изделия, затем экземпляры.
+    Возвращает экземпляр в работе (None, если экземпляр уже не в очереди)
+
+    - instance — экземпляр в очереди
+    """
+    with transaction.atomic():
+        lock_availability([instance.product_id or instance.part.product_id])
+        instance = CreationInstance.objects.select_for_update().filter(
+            pk=instance.pk, status='QUEUED').first()
+        if instance is None:
+            return None
+        in_work = CreationInstance.objects.select_for_update().filter(
+            worker_id=instance.worker_id, product_id=instance.product_id, part_id=instance.part_id,
+            status='IN_WORK').order_by('id').first()
+        if in_work:
+            in_work.amount += instance.amount
+            in_work.save()
+            instance.delete()
+            return in_work
+        instance.status = 'IN_WORK'
+        instance.queued = None
+        instance.started = timezone.now().date()
+        instance.save()
+    return instance
+
+
+def cancel_instance(instance):
+    """
+    Отменяет работу над экземпляром: удаляет экземпляр вместе с вопросами по нему.
+    Как и при взятии в работу, сначала блокируется счётчик изделия, затем экземпляр
+
+    - instance — экземпляр изделия/части
+    """
+    with transaction.atomic():
+        lock_availability([instance.product_id or instance.part.product_id])
+        instance = CreationInstance.objects.select_for_update().filter(pk=instance.pk).first()
+        if instance is not None:
+            instance.delete()
+
+
+def queue_to_workers(rows):
+    """
+    Ставит в очередь работников несколько изделий/частей одной транзакцией: доступное кол-во всех строк
+    проверяется по заблокированным счётчикам, новые экземпляры QUEUED создаются одним bulk_create,
+    а уже стоящие в очереди дополняются одним bulk_update. Массовая запись не вызывает сигналы,
+    поэтому счётчики пересчитываются здесь же (один раз для каждого изделия), а клиенты уведомляются
+    после фиксации транзакции. Ведомость выплат не меняется (учитываются только произведённые экземпляры).
+    Возвращает (кол-во созданных, кол-во дополненных экземпляров), при нехватке — ValidationError по каждой строке
+
+    - rows — строки (работник, кол-во, изделие или None, часть или None)
+    """
+    # Одинаковые строки (работник и изделие/часть) объединяются
+    amounts = {}
+    items = {}
+    for worker, amount, product, part in rows:
+        item_key = (product.pk, None) if product else (None, part.pk)
+        items[item_key] = product or part
+        key = (worker.pk,) + item_key
+        amounts[key] = amounts.get(key, 0) + amount
+    if not amounts:
+        return 0, 0
+    product_ids = {item.pk if product_id else item.product_id
+                   for (product_id, part_id), item in items.items()}
+    with transaction.atomic():
+        availability = lock_availability(product_ids)
+        before = Availability(dict(availability.products), dict(availability.parts))
+        errors = []
+        for (worker_id, product_id, part_id), amount in amounts.items():
+            available = availability.get(product_id, part_id)
+            if amount > available:
+                errors.append(ValidationError(
+                    f'{items[(product_id, part_id)]}: выбрано {amount} шт., к изготовлению доступно {available} шт.'))
+            availability.take(amount, product_id, part_id)
+        if errors:
+            raise ValidationError(errors)
+        # Экземпляры, уже стоящие в очереди тех же работников, дополняются
+        queued = CreationInstance.objects.filter(
+            Q(product_id__in=[key[1] for key in amounts if key[1]]) |
+            Q(part_id__in=[key[2] for key in amounts if key[2]]),
+            worker_id__in={key[0] for key in amounts}, status='QUEUED')
+        existing = {}
+        for instance in queued:
+            existing.setdefault(
+                (instance.worker_id, instance.product_id, instance.part_id), instance)
+        now = timezone.now()
+        created = []
+        updated = []
+        for key, amount in amounts.items():
+            instance = existing.get(key)
+            if instance:
+                instance.amount += amount
+                updated.append(instance)
+            else:
+                created.append(CreationInstance(worker_id=key[0], product_id=key[1], part_id=key[2],
+                                                amount=amount, status='QUEUED', queued=now))
+        CreationInstance.objects.bulk_create(created)
+        CreationInstance.objects.bulk_update(updated, ['amount'])
+        # Кол-во в очереди изменяется по изделиям/частям (а не по каждому экземпляру)
+        totals = {}
+        for (worker_id, product_id, part_id), amount in amounts.items():
+            totals[(product_id, part_id)] = totals.get(
+                (product_id, part_id), 0) + amount
+        apply_counter_changes([
+            (product_id, Q(product_id=product_id), 'queued', amount) if product_id else
+            (items[(None, part_id)].product_id, Q(part_id=part_id), 'queued', amount)
+            for (product_id, part_id), amount in totals.items()])
+        # Изделие и его части могли пройти проверку по отдельности, но вместе превысить доступное.
+        # Проверяются только счётчики изделий, поставленных в очередь вместе со своими частями, и этих частей:
+        # доступное кол-во могло стать отрицательным и раньше (пр. при уменьшении кол-ва изделия), поэтому ошибкой
+        # считается только его уменьшение ниже нуля
+        combined = {product_id for product_id, part_id in items if product_id} & {
+            item.product_id for (product_id, part_id), item in items.items() if part_id}
+        if combined:
+            counters = ProductionCounter.objects.filter(
+                Q(product_id__in=combined) | Q(part_id__in=[part_id for product_id, part_id in items
+                                                           if part_id and items[(None, part_id)].product_id in combined]))
+            for product_id, part_id, available in counters.values_list('product_id', 'part_id', 'available'):
+                if available < 0 and available < before.get(product_id, part_id):
+                    raise ValidationError(
+                        "Выбранные изделия и их части вместе превышают доступное кол-во")
+        object_ids = set(Product.objects.filter(
+            pk__in=product_ids).values_list('object_id', flat=True))
+        publish_on_commit(PRODUCTION_TOPIC, *map(product_topic, product_ids), *map(object_topic, object_ids))
+    return len(created), len(updated)
+
+
+def complete_instances(instance_ids, worker=None):
+    """
+    Завершает несколько экземпляров в работе одной транзакцией. Как и при завершении одного экземпляра,
+    экземпляр объединяется с уже произведённым в этом месяце экземпляром того же работника и изделия/части
+    (или сам становится произведённым). Экземпляры записываются одним bulk_update, объединённые удаляются одним запросом,
+    счётчики пересчитываются один раз для каждого изделия, готовность — один раз для каждого объекта.
+    Возвращает завершённые экземпляры с их кол-вом: [(экземпляр, кол-во)]
+
+    - instance_ids — id экземпляров (экземпляры не в работе пропускаются)
+    - worker — работник (WorkerData), если завершать можно только его экземпляры
+    """
+    today = timezone.now().date()
+    instances = CreationInstance.objects.filter(
+        pk__in=instance_ids, status='IN_WORK')
+    if worker is not None:
+        instances = instances.filter(worker=worker)
+    with transaction.atomic():
+        # Как и при взятии в работу, сначала блокируются счётчики изделий (в порядке id), затем экземпляры,
+        # поэтому параллельные изменения тех же изделий не блокируют друг друга взаимно
+        lock_availability({product_id or part_product_id for product_id, part_product_id in
+                           instances.values_list('product_id', 'part__product_id')})
+        instances = list(instances.select_for_update(of=('self',)).select_related(
+            'worker', 'product__object', 'part__product__object').order_by('id'))
+        if not instances:
+            return []
+        finished = [(instance, instance.amount) for instance in instances]
+        targets = {}
+        # Произведённые экземпляры, с которыми объединяются завершаемые, блокируются: иначе параллельное
+        # завершение того же изделия тем же работником потеряло бы одно из прибавлений кол-ва.
+        # Объединение выполняется только в пределах текущего месяца: произведённое в прошлых месяцах
+        # остаётся в их итогах ведомости и не переносится в текущий месяц
+        for instance in CreationInstance.objects.select_for_update().filter(
+                Q(product_id__in={instance.product_id for instance in instances if instance.product_id}) |
+                Q(part_id__in={instance.part_id for instance in instances if instance.part_id}),
+                worker_id__in={instance.worker_id for instance in instances}, status='COMPLETED',
+                completed__gte=today.replace(day=1)).order_by('id'):
+            targets.setdefault(
+                (instance.worker_id, instance.product_id, instance.part_id), instance)
+        old_states = {}
+        changed = {}
+        merged = []
+        totals = {}
+        for instance in instances:
+            key = (instance.worker_id, instance.product_id, instance.part_id)
+            item = (instance.product_id or instance.part.product_id,
+                    instance.product_id, instance.part_id)
+            totals[item] = totals.get(item, 0) + instance.amount
+            target = targets.get(key)
+            if target is None:
+                old_states[instance.pk] = instance.get_counted_state()
+                instance.status = 'COMPLETED'
+                instance.completed = today
+                targets[key] = instance
+                changed[instance.pk] = instance
+            else:
+                old_states.setdefault(target.pk, target.get_counted_state())
+                target.amount += instance.amount
+                target.completed = today
+                changed[target.pk] = target
+                merged.append(instance.pk)
+        # Сигналы отдельных экземпляров не обрабатываются: изменения учитываются ниже для всей выборки
+        with bulk_instance_changes():
+            CreationInstance.objects.bulk_update(
+                changed.values(), ['status', 'amount', 'completed'])
+            # Вопросы по объединённым экземплярам удаляются вместе с ними
+            CreationInstance.objects.filter(pk__in=merged).delete()
+        changes = []
+        for (product_id, instance_product_id, part_id), amount in totals.items():
+            condition = Q(product_id=instance_product_id) if instance_product_id else Q(part_id=part_id)
+            changes.append((product_id, condition, 'in_work', -amount))
+            changes.append((product_id, condition, 'completed', amount))
+        apply_counter_changes(changes)
+        # Цены изделий/частей уже загружены вместе с экземплярами
+        prices = {(instance.product_id, instance.part_id): (instance.product or instance.part).price
+                  for instance in instances}
+        payroll.apply_instance_changes([(old_states[pk], instance.get_counted_state())
+                                        for pk, instance in changed.items()], prices)
+        for instance in changed.values():
+            instance._saved_state = instance.get_counted_state()
+        product_ids = {item[0] for item in totals}
+        object_ids = set(Product.objects.filter(
+            pk__in=product_ids).values_list('object_id', flat=True))
+        publish_on_commit(PRODUCTION_TOPIC, *map(instance_topic, {instance.pk for instance in instances} | set(changed)),
+                          *map(product_topic, product_ids), *map(object_topic, object_ids))
+    return finished
+
+
+def notify_completed(finished):
+    """
+    Создаёт одно уведомление мастерам о завершённых изделиях/частях
+
+    - finished — завершённые экземпляры с их кол-вом (complete_instances)
+    """
+    if not finished:
+        return None
+    if len(finished) == 1:
+        instance = finished[0][0]
+        title = 'Завершено изделие'
+        message = f'{instance.worker.display_name} завершил работу над {instance}'
+    else:
+        title = f'Завершено изделий: {len(finished)}'
+        message = '; '.join(f'{instance.worker.display_name}: {instance} ({amount} шт.)'
+                            for instance, amount in finished)
+    return Notification.objects.create(recipient_group=Group.objects.get(name='master'), title=title,
+                                       message=message)
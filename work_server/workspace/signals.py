@@ -0,0 +1,209 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.contrib.auth.models import User, Group
+from django.dispatch import receiver
+from .models import (Object, ObjectStateInstance, Product, Part, CreationInstance, ProductionCounter, Question, Notification,
+                     WorkerData, ParseBlacklistValue)
+from .middleware import invalidate_roles
+from .blacklist import invalidate_blacklist
+from .counters import apply_instance_change, rebalance_product
+from .events import (PRODUCTION_TOPIC, QUESTIONS_TOPIC, publish_on_commit, object_topic, product_topic,
+                     instance_topic, group_notifications_topic)
+from . import payroll
+
+
+_bulk_changes = threading.local()
+
+
+@contextmanager
+def bulk_instance_changes():
+    """
+    Отключает обработку изменений отдельных экземпляров изделий/частей (счётчики, ведомость выплат, события)
+    на время массового изменения: вызывающий код учитывает изменения сам, один раз для всей выборки
+    """
+    previous = getattr(_bulk_changes, 'active', False)
+    _bulk_changes.active = True
+    try:
+        yield
+    finally:
+        _bulk_changes.active = previous
+
+
+def in_bulk_changes():
+    """Проверяет, выполняется ли массовое изменение экземпляров (bulk_instance_changes)"""
+    return getattr(_bulk_changes, 'active', False)
+
+
+@receiver(pre_save, sender=CreationInstance)
+def remember_instance_state(sender, instance, **kwargs):
+    """Запоминает сохранённое состояние экземпляра, если оно не было загружено вместе с ним"""
+    if instance.pk and not hasattr(instance, '_saved_state'):
+        instance._saved_state = CreationInstance.objects.filter(pk=instance.pk).values_list(
+            'product_id', 'part_id', 'status', 'amount', 'worker_id', 'completed').first()
+
+
+@receiver(post_save, sender=CreationInstance)
+def count_saved_instance(sender, instance, created, **kwargs):
+    """Обновляет счётчики производства и ведомость выплат после создания/изменения экземпляра изделия/части"""
+    if in_bulk_changes():
+        return
+    old_state = None if created else getattr(instance, '_saved_state', None)
+    apply_instance_change(old_state, instance.get_counted_state())
+    payroll.apply_instance_change(old_state, instance.get_counted_state())
+    instance._saved_state = instance.get_counted_state()
+
+
+@receiver(post_delete, sender=CreationInstance)
+def count_deleted_instance(sender, instance, **kwargs):
+    """Обновляет счётчики производства и ведомость выплат после удаления экземпляра изделия/части"""
+    if in_bulk_changes():
+        return
+    old_state = getattr(instance, '_saved_state',
+                        None) or instance.get_counted_state()
+    apply_instance_change(old_state, None)
+    payroll.apply_instance_change(old_state, None)
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, **kwargs):
+    """Создаёт счётчики нового изделия или пересчитывает доступное кол-во при изменении изделия"""
+    if created:
+        ProductionCounter.objects.create(
+            product=instance, available=instance.amount)
+    else:
+        rebalance_product(instance.pk)
+    # Цена изделия определяет выплаты: пересчитываются только записи ведомости с его экземплярами
+    if not created and instance.price_changed():
+        payroll.rebuild_entries(products=[instance.pk])
+    instance._saved_price = instance.price
+
+
+@receiver(post_save, sender=Part)
+def count_saved_part(sender, instance, created, **kwargs):
+    """Создаёт счётчики новой части и пересчитывает доступное кол-во изделия"""
+    if created:
+        ProductionCounter.objects.create(part=instance)
+    rebalance_product(instance.product_id)
+    if not created and instance.price_changed():
+        payroll.rebuild_entries(parts=[instance.pk])
+    instance._saved_price = instance.price
+
+
+@receiver(post_delete, sender=Part)
+def count_deleted_part(sender, instance, **kwargs):
+    """Пересчитывает доступное кол-во изделия после удаления его части"""
+    if Product.objects.filter(pk=instance.product_id).exists():
+        rebalance_product(instance.product_id)
+
+
+def get_instance_topics(instance: CreationInstance):
+    """Возвращает темы событий, затрагиваемые изменением экземпляра изделия/части"""
+    topics = [PRODUCTION_TOPIC, instance_topic(instance.pk)]
+    if instance.product_id:
+        product = Product.objects.filter(pk=instance.product_id).values_list(
+            'id', 'object_id').first()
+    else:
+        product = Part.objects.filter(pk=instance.part_id).values_list(
+            'product_id', 'product__object_id').first()
+    if product:
+        topics += [product_topic(product[0]), object_topic(product[1])]
+    return topics
+
+
+@receiver(post_save, sender=CreationInstance)
+@receiver(post_delete, sender=CreationInstance)
+def publish_instance_change(sender, instance, **kwargs):
+    """Уведомляет клиентов об изменении экземпляра изделия/части"""
+    if in_bulk_changes():
+        return
+    publish_on_commit(*get_instance_topics(instance))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def publish_product_change(sender, instance, **kwargs):
+    """Уведомляет клиентов об изменении изделия"""
+    publish_on_commit(PRODUCTION_TOPIC, product_topic(
+        instance.pk), object_topic(instance.object_id))
+
+
+@receiver(post_save, sender=Part)
+@receiver(post_delete, sender=Part)
+def publish_part_change(sender, instance, **kwargs):
+    """Уведомляет клиентов об изменении части изделия"""
+    topics = [PRODUCTION_TOPIC, product_topic(instance.product_id)]
+    object_id = Product.objects.filter(pk=instance.product_id).values_list(
+        'object_id', flat=True).first()
+    if object_id:
+        topics.append(object_topic(object_id))
+    publish_on_commit(*topics)
+
+
+@receiver(post_save, sender=Object)
+@receiver(post_delete, sender=Object)
+@receiver(post_save, sender=ObjectStateInstance)
+@receiver(post_delete, sender=ObjectStateInstance)
+def publish_object_change(sender, instance, **kwargs):
+    """Уведомляет клиентов об изменении объекта или его состояния"""
+    object_id = instance.pk if sender is Object else instance.object_id
+    publish_on_commit(PRODUCTION_TOPIC, object_topic(object_id))
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def publish_question_change(sender, instance, **kwargs):
+    """Уведомляет клиентов об изменении вопроса"""
+    topics = [QUESTIONS_TOPIC, instance_topic(instance.instance_id)]
+    product_id = CreationInstance.objects.filter(pk=instance.instance_id).values_list(
+        'product_id', 'part__product_id').first()
+    if product_id:
+        topics.append(product_topic(product_id[0] or product_id[1]))
+    publish_on_commit(*topics)
+
+
+@receiver(post_save, sender=Notification)
+def publish_notification(sender, instance, created, **kwargs):
+    """Уведомляет клиентов группы-получателя о новом уведомлении"""
+    if created:
+        publish_on_commit(
+            group_notifications_topic(instance.recipient_group_id))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_changed_user_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает сохранённые в сессиях группы пользователей при изменении их групп"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif pk_set:
+        user_ids = list(pk_set)
+    else:
+        # Группа очищена целиком — её участники уже неизвестны
+        user_ids = None
+    transaction.on_commit(lambda: invalidate_roles(user_ids))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_all_roles(sender, instance, **kwargs):
+    """Сбрасывает сохранённые в сессиях группы всех пользователей при изменении групп"""
+    transaction.on_commit(invalidate_roles)
+
+
+@receiver(post_save, sender=WorkerData)
+@receiver(post_delete, sender=WorkerData)
+def invalidate_worker_roles(sender, instance, **kwargs):
+    """Сбрасывает сохранённый в сессии id данных работника"""
+    if instance.worker_id:
+        worker_id = instance.worker_id
+        transaction.on_commit(lambda: invalidate_roles([worker_id]))
+
+
+@receiver(post_save, sender=ParseBlacklistValue)
+@receiver(post_delete, sender=ParseBlacklistValue)
+def invalidate_parse_blacklist(sender, instance, **kwargs):
+    """Сбрасывает скомпилированный чёрный список парсинга при изменении масок"""
+    transaction.on_commit(invalidate_blacklist)
@@ -0,0 +1,263 @@
+from django.core.exceptions import ValidationError
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple
+from zipfile import BadZipFile
+import openpyxl as xl
+from openpyxl.utils.exceptions import InvalidFileException
+from .headers import is_multi_header, expand_header, number_products
+from .blacklist import BlacklistMatcher, get_blacklist_matcher
+
+
+SPEC_SHEET = 'Спецификация'
+"""Название листа Спецификации"""
+
+SPEC_FIRST_ROW = 11
+"""Номер первой строки с изделиями"""
+
+SPEC_HEADER_FILL = 'FF33CCFF'
+"""Цвет заливки строк изделий и частей (#33CCFF)"""
+
+SPEC_COLUMNS = {1: 'Наименование', 11: 'Итого\nруб', 14: 'З/п'}
+"""Обязательные заголовки столбцов (номер столбца с 0: заголовок)"""
+
+SPEC_COLUMN_ERRORS = {1: "Не найдены наименования частей изделий",
+                      11: "Не найдены итоговые стоимости частей изделий",
+                      14: "Не найдены данные о зарплатах за иготовление изделий"}
+
+SPEC_PROGRESS_EVERY = 200
+"""Через сколько прочитанных строк сообщается о ходе разбора Спецификации"""
+
+SPEC_PARSER_VERSION = 2
+"""Версия разбора Спецификации (входит в ключ кэша разобранных Спецификаций):
+увеличивается при любом изменении результата разбора (spec, headers)"""
+
+class SpecRow(NamedTuple):
+    """Строка Спецификации: значения ячеек и форматирование ячейки наименования"""
+    number: int
+    values: tuple
+    filled: bool
+    bold: bool
+
+    def value(self, col):
+        """Возвращает значение ячейки (None, если ячейка пустая или отсутствует)"""
+        return self.values[col] if col < len(self.values) else None
+
+    def number_value(self, col):
+        """Возвращает числовое значение ячейки (0, если ячейка пустая)"""
+        value = self.value(col)
+        return 0 if value is None else value
+
+    @property
+    def name(self):
+        return self.value(1)
+
+
+def iter_spec_rows(file):
+    """
+    Читает лист Спецификации за один проход (iter_rows в режиме read_only) и возвращает строки с изделиями
+    по одной, вместе с заливкой и начертанием ячейки наименования. Чтение заканчивается на первой строке
+    без наименования. Проверяет заголовки столбцов
+
+    - file — Excel-файл Спецификации (путь или файловый объект)
+    """
+    try:
+        workbook = xl.load_workbook(file, read_only=True)
+    except (BadZipFile, InvalidFileException):
+        raise ValidationError("Файл не является книгой Excel")
+    try:
+        if SPEC_SHEET not in workbook.sheetnames:
+            raise ValidationError("Не найден лист Спецификации")
+        rows = workbook[SPEC_SHEET].iter_rows()
+        header = tuple(cell.value for cell in next(rows, ()))
+        for col, title in SPEC_COLUMNS.items():
+            if col >= len(header) or header[col] != title:
+                raise ValidationError(SPEC_COLUMN_ERRORS[col])
+        for number, cells in enumerate(rows, start=2):
+            if number < SPEC_FIRST_ROW:
+                continue
+            if len(cells) < 2 or cells[1].value is None:
+                break
+            cell = cells[1]
+            filled = bool(
+                cell.fill and cell.fill.start_color.rgb == SPEC_HEADER_FILL)
+            bold = bool(cell.font and cell.font.bold)
+            yield SpecRow(number, tuple(cell.value for cell in cells), filled, bold)
+    finally:
+        workbook.close()
+
+
+def validate_spec_rows(rows):
+    """
+    Проверяет порядок изделий и частей в строках Спецификации по мере чтения и передаёт строки дальше
+
+    - rows — строки Спецификации (iter_spec_rows)
+    """
+    is_header = False
+    any_header = False
+    for row in rows:
+        if row.filled:
+            if row.bold:
+                if is_header:
+                    raise ValidationError("Обнаружено пустое изделие")
+                is_header = True
+                any_header = True
+            else:
+                is_header = False
+        elif any_header is False:
+            raise ValidationError("Обнаружено оборудование без изделия")
+        else:
+            is_header = False
+        yield row
+
+
+def check_spec(file):
+    """
+    Проверяет формат Спецификации
+
+    - file — Excel-файл Спецификации
+    """
+    for _ in validate_spec_rows(iter_spec_rows(file)):
+        pass
+    return True
+
+
+class SkippedPart(NamedTuple):
+    """Часть изделия, пропускаемая при импорте по чёрному списку"""
+    number: int
+    name: str
+    pattern: str
+    product: str
+
+
+def preview_blacklist(file, blacklist=None):
+    """
+    Возвращает список частей Спецификации, которые будут пропущены при импорте по чёрному списку
+    (изделия с такими частями импортируются без разбиения на части)
+
+    - file — Excel-файл Спецификации
+    - blacklist — чёрный список наименований частей (по умолчанию — get_blacklist_matcher())
+    """
+    if blacklist is None:
+        blacklist = get_blacklist_matcher()
+    skipped = []
+    product = ''
+    skip = False
+    for row in validate_spec_rows(iter_spec_rows(file)):
+        if not row.filled:
+            continue
+        if row.bold:
+            # Изделия с нулевым кол-вом не импортируются вовсе
+            skip = row.number_value(12) <= 0
+            product = row.name
+        elif not skip:
+            pattern = blacklist.match(row.name)
+            if pattern is not None:
+                skipped.append(SkippedPart(
+                    row.number, row.name, pattern, product))
+    return skipped
+
+
+def parse_spec(file, blacklist=None, progress=None):
+    """
+    Проверяет Спецификацию и извлекает из неё изделия и их части за один проход по файлу.
+    Возвращает словарь {индекс: данные изделия} с заполненными номерами изделий
+
+    - file — Excel-файл Спецификации
+    - blacklist — чёрный список наименований частей (BlacklistMatcher или маски, по умолчанию — get_blacklist_matcher())
+    - progress — функция, получающая кол-во прочитанных строк (вызывается каждые SPEC_PROGRESS_EVERY строк и в конце разбора)
+    """
+    if blacklist is None:
+        blacklist = get_blacklist_matcher()
+    elif not isinstance(blacklist, BlacklistMatcher):
+        blacklist = BlacklistMatcher(blacklist)
+    prod_data = dict()
+    parts = dict()
+    header = ''
+    part_head = ''
+    prod_price = Decimal(0.00)
+    prod_amount = 0
+    pay = 0
+    part_price = Decimal(0.00)
+    part_amount = Decimal(1.00)
+    max_idx = 0
+    unique_idx = 0
+    skip = False
+    blacklisted = False
+    rows_parsed = 0
+    for row in validate_spec_rows(iter_spec_rows(file)):
+        rows_parsed += 1
+        if progress and rows_parsed % SPEC_PROGRESS_EVERY == 0:
+            progress(rows_parsed)
+        if row.filled:
+            if row.bold:
+                if part_head != '':
+                    payment = ((part_price / part_amount) /
+                               prod_price) * pay
+                    parts[unique_idx] = {
+                        'price': payment.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), 'amount': part_amount, 'name': part_head}
+                    unique_idx += 1
+                if blacklisted:
+                    parts = dict()
+                    blacklisted = False
+                if header != '':
+                    if is_multi_header(header):
+                        for name, number in expand_header(header, prod_amount):
+                            prod_data[unique_idx] = {
+                                'parts': parts.copy(), 'price': pay, 'name': name, 'amount': 1, 'number': number}
+                            unique_idx += 1
+                    else:
+                        prod_data[unique_idx] = {
+                            'parts': parts.copy(), 'price': pay, 'name': header, 'amount': prod_amount}
+                        unique_idx += 1
+                if row.number_value(12) > 0:
+                    header = row.name
+                    prod_amount = int(row.number_value(8))
+                    prod_price = Decimal(row.number_value(11))
+                    pay = int(row.number_value(14) // row.number_value(8))
+                    parts = dict()
+                    part_head = ''
+                    part_price = Decimal(0.00)
+                    part_amount = Decimal(1.00)
+                    max_idx += 1
+                    skip = False
+                else:
+                    skip = True
+            else:
+                if skip or row.name in blacklist:
+                    if not skip:
+                        blacklisted = True
+                    continue
+                if part_head != '':
+                    payment = ((part_price / part_amount) /
+                               prod_price) * pay
+                    parts[unique_idx] = {
+                        'price': payment.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), 'amount': part_amount, 'name': part_head}
+                    unique_idx += 1
+                part_head = row.name
+                if row.value(7) is not None:
+                    part_amount = Decimal(row.value(7))
+                part_price = Decimal(0.00)
+        else:
+            if not skip:
+                part_price += Decimal(row.number_value(11))
+    if part_head != '' and not skip:
+        payment = ((part_price / part_amount) / prod_price) * pay
+        parts[unique_idx] = {
+            'price': payment.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), 'amount': part_amount, 'name': part_head}
+        unique_idx += 1
+    if is_multi_header(header) and not skip:
+        if blacklisted:
+            parts = dict()
+        for name, number in expand_header(header, prod_amount):
+            prod_data[unique_idx] = {
+                'parts': parts.copy(), 'price': pay, 'name': name, 'amount': 1, 'number': number}
+            unique_idx += 1
+    elif not skip:
+        if blacklisted:
+            parts = dict()
+        prod_data[unique_idx] = {
+            'parts': parts.copy(), 'price': pay, 'name': header, 'amount': prod_amount}
+        unique_idx += 1
+    if progress:
+        progress(rows_parsed)
+    return number_products(prod_data, max_idx)
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from .blacklist import get_blacklist_matcher
+from .spec import parse_spec, SPEC_PARSER_VERSION
+
+
+SPEC_CACHE_SUFFIX = '.pickle'
+"""Расширение файлов кэша разобранных Спецификаций"""
+
+
+def hash_file(file):
+    """
+    Возвращает SHA-256 содержимого загруженного файла (читается по частям)
+
+    - file — загруженный файл
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class SpecCache:
+    """
+    Кэш разобранных Спецификаций на диске. Ключ — хэш содержимого файла, масок чёрного списка
+    и версия разбора (SPEC_PARSER_VERSION), поэтому повторная загрузка той же Спецификации не требует её разбора,
+    а после изменения разбора старые результаты не используются.
+    При превышении размера кэша удаляются давно не использовавшиеся файлы
+
+    - directory — папка кэша
+    - max_size — наибольший размер кэша в байтах
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def path(self, content_hash, blacklist):
+        """Возвращает путь к файлу кэша Спецификации, разобранной с указанными масками чёрного списка"""
+        blacklist_hash = hashlib.sha256(
+            '\n'.join(blacklist).encode()).hexdigest()[:16]
+        return self.directory / f'v{SPEC_PARSER_VERSION}-{content_hash}-{blacklist_hash}{SPEC_CACHE_SUFFIX}'
+
+    def get(self, content_hash, blacklist):
+        """Возвращает (данные изделий, кол-во прочитанных строк) или None, если Спецификации нет в кэше"""
+        path = self.path(content_hash, blacklist)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            # Время изменения файла — время последнего использования (для удаления старых файлов)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def set(self, content_hash, blacklist, value):
+        """Сохраняет разобранную Спецификацию (файл записывается целиком, затем переименовывается)"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(value, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(content_hash, blacklist))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.cull()
+
+    def cull(self):
+        """Удаляет давно не использовавшиеся файлы, пока размер кэша превышает max_size"""
+        entries = []
+        for path in self.directory.glob(f'*{SPEC_CACHE_SUFFIX}'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+spec_cache = SpecCache(getattr(settings, 'SPEC_CACHE_DIR', settings.BASE_DIR / 'cache' / 'specs'),
+                       getattr(settings, 'SPEC_CACHE_MAX_SIZE', 256 * 1024 * 1024))
+"""Кэш разобранных Спецификаций"""
+
+
+def parse_spec_cached(file, content_hash, progress=None):
+    """
+    Возвращает данные изделий Спецификации и кол-во прочитанных строк: из кэша, если Спецификация
+    с тем же содержимым уже разбиралась с текущим чёрным списком, иначе разбирает её (spec.parse_spec)
+
+    - file — Excel-файл Спецификации
+    - content_hash — хэш содержимого файла (hash_file)
+    - progress — функция, получающая кол-во прочитанных строк
+    """
+    blacklist = get_blacklist_matcher()
+    cached = spec_cache.get(content_hash, blacklist.patterns)
+    if cached is not None:
+        return cached
+    rows = [0]
+
+    def count_rows(rows_parsed):
+        rows[0] = rows_parsed
+        if progress:
+            progress(rows_parsed)
+    prod_data = parse_spec(file, blacklist, count_rows)
+    spec_cache.set(content_hash, blacklist.patterns, (prod_data, rows[0]))
+    return prod_data, rows[0]
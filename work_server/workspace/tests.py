@@ -1,3 +1,369 @@
-from django.test import TestCase
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, skipUnlessDBFeature
+from django.utils import timezone
+from datetime import date
+import threading
+from decimal import Decimal
+from .models import (Object, ObjectState, ObjectStateInstance, Product, Part, WorkerData, CreationInstance,
+                     ProductionCounter, PayrollLedger, Question, READY_STATE_NAME)
+from .headers import expand_range, expand_header, number_products
+from .counters import rebuild_counters, refresh_ready_percentages
+from .payroll import rebuild_ledger, close_past_months
+from .importer import diff_spec, import_spec
+from .pagination import paginate_keyset, encode_cursor, decode_cursor
+from .reservations import take_to_work, claim_queued, cancel_instance, queue_to_workers, complete_instances
 
-# Create your tests here.
+
+class HeadersTests(SimpleTestCase):
+    """Разбор заголовков с несколькими изделиями и нумерация изделий (headers)"""
+
+    def test_expand_range(self):
+        self.assertEqual(expand_range('А1.1 - А1.3'), ['А1.1', 'А1.2', 'А1.3'])
+        self.assertEqual(expand_range('1 - 4'), ['1', '2', '3', '4'])
+
+    def test_expand_range_crosses_integer(self):
+        # Шаг определяется концом диапазона, начало сохраняет свою запись
+        self.assertEqual(expand_range('А1.8 - А2.0'), ['А1.8', 'А1.9', 'А2.0'])
+
+    def test_expand_range_reversed(self):
+        self.assertEqual(expand_range('5 - 3'), [])
+
+    def test_expand_range_without_number(self):
+        with self.assertRaises(ValidationError):
+            expand_range('АБ - 3')
+
+    def test_expand_header(self):
+        self.assertEqual(expand_header('А1, А3 - А5', 12),
+                         [('А1', '01'), ('А3', '02'), ('А4', '03'), ('А5', '04')])
+
+    def test_number_products(self):
+        prod_data = {1: {'number': None}, 2: {'number': '1'}, 3: {'number': '2'},
+                     4: {'number': '1'}, 5: {'number': None}}
+        numbers = [data['number'] for data in number_products(prod_data, 12).values()]
+        self.assertEqual(numbers, ['01', '02-1', '02-2', '03-1', '04'])
+
+
+class ProductionTestCase(TestCase):
+    """
+    Общие данные тестов производства: два работника, мастер и объект с изделием (5 шт.)
+    из двух частей (2 и 1 шт. на изделие)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        worker_group = Group.objects.create(name='worker')
+        Group.objects.create(name='master').user_set.add(User.objects.create_user('master', password='x'))
+        cls.workers = []
+        for idx in range(2):
+            user = User.objects.create_user(f'worker{idx}', password='x')
+            user.groups.add(worker_group)
+            cls.workers.append(WorkerData.objects.create(worker=user, display_name=f'Работник {idx}'))
+        today = timezone.now().date()
+        cls.object = Object.objects.create(obj_number='100', created_at=today, deadline=today)
+        cls.product = Product.objects.create(object=cls.object, prod_number='01', name='Шкаф', amount=5, price=100)
+        cls.part_a = Part.objects.create(product=cls.product, name='Корпус', amount=2, price=10)
+        cls.part_b = Part.objects.create(product=cls.product, name='Дверь', amount=1, price=20)
+
+    def get_counters(self):
+        """Возвращает значения всех счётчиков производства"""
+        return sorted(ProductionCounter.objects.values_list(
+            'product_id', 'part_id', 'queued', 'in_work', 'completed', 'available', 'parts_busy',
+            'parts_completed'), key=str)
+
+    def assertCountersRebuilt(self):
+        """Проверяет, что счётчики, изменённые по ходу работы, совпадают с пересчитанными заново"""
+        counters = self.get_counters()
+        rebuild_counters()
+        self.assertEqual(counters, self.get_counters())
+
+
+class CountersTests(ProductionTestCase):
+    """Счётчики производства, изменяемые вместе с экземплярами изделий/частей (counters)"""
+
+    def get_available(self, product=None, part=None):
+        return ProductionCounter.objects.get(product=product, part=part).available
+
+    def test_take_to_work(self):
+        take_to_work(self.workers[0], 2, product=self.product)
+        self.assertEqual(self.get_available(product=self.product), 3)
+        self.assertEqual(self.get_available(part=self.part_a), 6)
+        take_to_work(self.workers[1], 3, part=self.part_a)
+        # Части заняты на 1,5 изделия — изделие целиком доступно только одно
+        self.assertEqual(self.get_available(product=self.product), 1)
+        self.assertCountersRebuilt()
+
+    def test_queue_claim_complete(self):
+        queue_to_workers([(self.workers[0], 1, self.product, None), (self.workers[1], 2, None, self.part_b)])
+        self.assertCountersRebuilt()
+        instance = claim_queued(CreationInstance.objects.get(product=self.product))
+        self.assertEqual(instance.status, 'IN_WORK')
+        self.assertCountersRebuilt()
+        complete_instances([instance.pk])
+        self.assertEqual(ProductionCounter.objects.get(product=self.product).completed, 1)
+        self.assertCountersRebuilt()
+
+    def test_merge_and_cancel(self):
+        first = take_to_work(self.workers[0], 1, part=self.part_a)
+        complete_instances([first.pk])
+        second = take_to_work(self.workers[0], 2, part=self.part_a)
+        complete_instances([second.pk])
+        # Произведённые в одном месяце экземпляры объединяются
+        self.assertEqual(CreationInstance.objects.get(part=self.part_a).amount, 3)
+        cancel_instance(take_to_work(self.workers[1], 1, product=self.product))
+        self.assertCountersRebuilt()
+        CreationInstance.objects.all().delete()
+        self.assertCountersRebuilt()
+        self.assertEqual(self.get_available(product=self.product), 5)
+
+
+class PayrollTests(ProductionTestCase):
+    """Ведомость выплат, изменяемая вместе с экземплярами и ценами (payroll)"""
+
+    def get_ledger(self):
+        """Возвращает записи ведомости (пустая запись, оставшаяся после удаления экземпляров, равна её отсутствию)"""
+        return sorted(PayrollLedger.objects.exclude(items=0).values_list(
+            'worker_id', 'month', 'amount', 'payment', 'items', 'closed'))
+
+    def assertLedgerRebuilt(self):
+        """Проверяет, что ведомость, изменённая по ходу работы, совпадает с пересчитанной заново"""
+        ledger = self.get_ledger()
+        rebuild_ledger()
+        self.assertEqual(ledger, self.get_ledger())
+
+    def test_complete_and_delete(self):
+        complete_instances([take_to_work(self.workers[0], 2, product=self.product).pk,
+                            take_to_work(self.workers[1], 1, part=self.part_b).pk])
+        complete_instances([take_to_work(self.workers[0], 1, product=self.product).pk])
+        entry = PayrollLedger.objects.get(worker=self.workers[0])
+        self.assertEqual((entry.amount, entry.payment, entry.items), (3, 300, 1))
+        self.assertLedgerRebuilt()
+        CreationInstance.objects.filter(worker=self.workers[1]).delete()
+        self.assertLedgerRebuilt()
+
+    def test_price_change(self):
+        complete_instances([take_to_work(self.workers[0], 2, part=self.part_a).pk,
+                            take_to_work(self.workers[1], 1, product=self.product).pk])
+        self.part_a.price = 15
+        self.part_a.save()
+        self.assertEqual(PayrollLedger.objects.get(worker=self.workers[0]).payment, 30)
+        self.assertEqual(PayrollLedger.objects.get(worker=self.workers[1]).payment, 100)
+        self.assertLedgerRebuilt()
+
+    def test_closed_month_not_merged(self):
+        CreationInstance.objects.create(worker=self.workers[0], product=self.product, amount=1,
+                                        status='COMPLETED', completed=date(2000, 1, 10))
+        rebuild_ledger(include_closed=True)
+        close_past_months()
+        complete_instances([take_to_work(self.workers[0], 2, product=self.product).pk])
+        # Произведённое в закрытом месяце остаётся в его итогах, текущий месяц получает весь экземпляр
+        self.assertEqual(CreationInstance.objects.filter(status='COMPLETED').count(), 2)
+        self.assertEqual(PayrollLedger.objects.get(worker=self.workers[0], month=date(2000, 1, 1)).amount, 1)
+        self.assertLedgerRebuilt()
+
+
+class ImportDiffTests(ProductionTestCase):
+    """Повторный импорт Спецификации существующего объекта (importer.diff_spec, import_spec)"""
+
+    def get_spec(self):
+        """Возвращает данные Спецификации, совпадающие с объектом, и ещё одним изделием"""
+        return {1: {'number': '01', 'name': 'Шкаф', 'amount': 5, 'price': Decimal(100),
+                    'parts': {1: {'name': 'Корпус', 'price': Decimal(10)}, 2: {'name': 'Дверь', 'price': Decimal(20)}}},
+                2: {'number': '02', 'name': 'Полка', 'amount': 3, 'price': Decimal(40), 'parts': {}}}
+
+    def setUp(self):
+        self.state = ObjectState.objects.create(name='Приостановлен', priority=1, group='Processing')
+        import_spec(self.object.obj_number, self.get_spec(), self.state)
+
+    def test_same_spec(self):
+        totals = diff_spec(self.object.obj_number, self.get_spec()).get_totals()
+        self.assertEqual(totals, {'same': 4})
+
+    def test_busy_product_kept(self):
+        take_to_work(self.workers[0], 1, part=self.part_b)
+        spec = self.get_spec()
+        del spec[1]
+        del spec[2]
+        diff = diff_spec(self.object.obj_number, spec)
+        self.assertEqual({change.number: change.action for change in diff.products}, {'01': 'keep', '02': 'delete'})
+        import_spec(self.object.obj_number, spec, self.state)
+        self.assertEqual(list(self.object.product_set.values_list('prod_number', flat=True)), ['01'])
+        self.assertTrue(Part.objects.filter(pk=self.part_b.pk).exists())
+
+    def test_changed_price(self):
+        spec = self.get_spec()
+        spec[1]['price'] = Decimal(120)
+        spec[1]['parts'][2]['price'] = Decimal(25)
+        diff = diff_spec(self.object.obj_number, spec)
+        self.assertEqual(diff.get_totals(), {'update': 2, 'same': 2})
+        self.assertEqual(diff.products[0].changes, {'price': (Decimal(100), Decimal(120))})
+        import_spec(self.object.obj_number, spec, self.state)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).price, 120)
+        self.assertEqual(Part.objects.get(pk=self.part_b.pk).price, 25)
+        self.assertCountersRebuilt()
+
+
+class KeysetPaginationTests(ProductionTestCase):
+    """Постраничный вывод по курсору (pagination)"""
+
+    def setUp(self):
+        for idx in range(2, 7):
+            Product.objects.create(object=self.object, prod_number=f'0{idx}', name='Полка', amount=1, price=10)
+        self.products = Product.objects.filter(object=self.object)
+
+    def get_page(self, url):
+        return paginate_keyset(RequestFactory().get(url), self.products, ('name', '-id'), page_size=2)
+
+    def test_cursor_round_trip(self):
+        values = [date(2026, 1, 31), 'Шкаф', 15]
+        self.assertEqual(decode_cursor(encode_cursor(values), 3), ['2026-01-31', 'Шкаф', 15])
+        self.assertIsNone(decode_cursor(encode_cursor(values) + 'x', 3))
+        self.assertIsNone(decode_cursor(encode_cursor(values), 2))
+
+    def test_pages(self):
+        page = self.get_page('/?date=2026-01-01')
+        self.assertIsNone(page.first_url)
+        ids = [product.id for product in page]
+        while page.next_url:
+            self.assertIn('date=2026-01-01', page.next_url)
+            page = self.get_page(page.next_url)
+            self.assertIsNotNone(page.first_url)
+            ids.extend(product.id for product in page)
+        self.assertEqual(ids, list(self.products.order_by('name', '-id').values_list('id', flat=True)))
+
+    def test_damaged_cursor(self):
+        # Повреждённый курсор возвращает первую страницу
+        self.assertEqual([product.id for product in self.get_page('/?cursor=broken')],
+                         [product.id for product in self.get_page('/')])
+
+
+class QueryTests(ProductionTestCase):
+    """Индексы и кол-во запросов страниц, не зависящее от кол-ва объектов и изделий"""
+
+    def setUp(self):
+        state = ObjectState.objects.create(name=READY_STATE_NAME, priority=2, group='Processing')
+        ObjectStateInstance.objects.create(object=self.object, state=state, created_at=timezone.now().date())
+        refresh_ready_percentages([self.object])
+        self.state = state
+
+    def add_objects(self, count):
+        """Добавляет объекты В сборке с изделиями, частями и экземплярами в работе"""
+        today = timezone.now().date()
+        for idx in range(count):
+            obj = Object.objects.create(obj_number=f'2{idx:02}', created_at=today, deadline=today)
+            ObjectStateInstance.objects.create(object=obj, state=self.state, created_at=today)
+            for number in range(3):
+                product = Product.objects.create(object=obj, prod_number=f'0{number}', name='Стол', amount=4, price=50)
+                part = Part.objects.create(product=product, name='Столешница', amount=1, price=10)
+                take_to_work(self.workers[1], 1, part=part)
+            refresh_ready_percentages([obj])
+
+    def get_plan(self, queryset):
+        """Возвращает план запроса (в PostgreSQL — без последовательного чтения, если есть подходящий индекс)"""
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, table, index=None):
+        """Проверяет, что таблица читается по индексу (index — имя ожидаемого индекса)"""
+        plan = self.get_plan(queryset)
+        if connection.vendor == 'postgresql':
+            self.assertNotIn(f'Seq Scan on {table}', plan)
+        else:
+            lines = [line for line in plan.splitlines() if f' {table} ' in f'{line} ']
+            self.assertTrue(lines, plan)
+            for line in lines:
+                self.assertIn(' USING ', line, plan)
+        if index:
+            self.assertIn(index, plan)
+
+    def test_instance_indexes(self):
+        instances = CreationInstance.objects.order_by()
+        self.assertUsesIndex(instances.filter(product=self.product, status='IN_WORK'), 'workspace_creationinstance')
+        self.assertUsesIndex(instances.filter(part=self.part_a, status='COMPLETED'), 'workspace_creationinstance',
+                             'instance_part_status_idx')
+        self.assertUsesIndex(instances.filter(worker=self.workers[0], status='COMPLETED',
+                                              completed__gte=date(2026, 1, 1)),
+                             'workspace_creationinstance', 'instance_worker_status_idx')
+        self.assertUsesIndex(instances.filter(status='IN_WORK').order_by('id'), 'workspace_creationinstance',
+                             'instance_in_work_idx')
+        self.assertUsesIndex(Question.objects.filter(answer='').order_by('instance_id', 'id'), 'workspace_question',
+                             'question_unanswered_idx')
+
+    def assertPageQueries(self, username, url, num):
+        """Проверяет кол-во запросов к БД при повторном открытии страницы пользователем (роли уже в сессии)"""
+        self.client.force_login(User.objects.get(username=username))
+        self.client.get(url)
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_available_for_work_queries(self):
+        with self.assertNumQueries(1):
+            products = list(Product.objects.available_for_work('100'))
+        self.assertEqual(products, [self.product])
+        self.add_objects(3)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(Product.objects.available_for_work()), 10)
+
+    def test_index_queries(self):
+        self.assertPageQueries('worker0', '/workspace/', 5)
+        self.assertPageQueries('master', '/workspace/', 8)
+        self.add_objects(3)
+        self.assertPageQueries('worker0', '/workspace/', 5)
+        self.assertPageQueries('master', '/workspace/', 8)
+
+
+class TakeToWorkTests(ProductionTestCase):
+    """Взятие в работу с проверкой доступного кол-ва (reservations.take_to_work)"""
+
+    def test_over_allocation(self):
+        take_to_work(self.workers[0], 4, product=self.product)
+        with self.assertRaises(ValidationError):
+            take_to_work(self.workers[1], 2, product=self.product)
+        # Частей хватает только на оставшееся изделие
+        with self.assertRaises(ValidationError):
+            take_to_work(self.workers[1], 3, part=self.part_a)
+        take_to_work(self.workers[1], 2, part=self.part_a)
+        self.assertEqual(CreationInstance.objects.count(), 2)
+        self.assertCountersRebuilt()
+
+    def test_merge_in_work(self):
+        first = take_to_work(self.workers[0], 1, product=self.product)
+        second = take_to_work(self.workers[0], 2, product=self.product)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(CreationInstance.objects.get().amount, 3)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentTakeToWorkTests(TransactionTestCase):
+    """Одновременное взятие в работу последних изделий (блокировка счётчика изделия)"""
+
+    def setUp(self):
+        today = timezone.now().date()
+        obj = Object.objects.create(obj_number='300', created_at=today, deadline=today)
+        self.product = Product.objects.create(object=obj, prod_number='01', name='Шкаф', amount=3, price=100)
+        self.workers = [WorkerData.objects.create(worker=User.objects.create_user(f'worker{idx}'),
+                                                  display_name=f'Работник {idx}') for idx in range(8)]
+
+    def test_concurrent_take(self):
+        barrier = threading.Barrier(len(self.workers))
+        results = []
+
+        def take(worker):
+            try:
+                barrier.wait()
+                take_to_work(worker, 1, product=self.product)
+                results.append(True)
+            except ValidationError:
+                results.append(False)
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=take, args=(worker,)) for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(ProductionCounter.objects.get(product=self.product).available, 0)
@@ -7,6 +7,7 @@ urlpatterns = [
     path('my_products/', views.my_products_view, name='my_products'),
     path('my_product/<int:pk>', views.my_product_view, name='my-product'),
     path('objects/<pk>', views.object_detail_view, name='object-detail'),
+    path('objects/<int:pk>/queue', views.object_queue_view, name='object-queue'),
     path('in_work/', views.in_work_view, name='in_work'),
     path('workers_list/', views.workers_list_view, name='workers'),
     path('product_in_work/<int:pk>',
@@ -19,5 +20,9 @@ urlpatterns = [
     path('queued_details/<int:pk>',
          views.queued_details, name='queued-details'),
     path('hidden/', views.hidden_view, name="hidden"),
-    path('blacklist/', views.blacklist_settings_view, name="blacklist-settings")
+    path('blacklist/', views.blacklist_settings_view, name="blacklist-settings"),
+    path('events/', views.events_view, name="events"),
+    path('export/payroll/', views.export_payroll_view, name="export-payroll"),
+    path('export/production/', views.export_production_view,
+         name="export-production")
 ]
\ No newline at end of file
@@ -1,21 +1,36 @@
 from django.shortcuts import render, get_object_or_404
 from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
-from django.db.models import F, Prefetch, OuterRef, Exists
+from django.db.models import F
 from django.core.exceptions import ValidationError
-from django.core.cache import cache
-from django.http import HttpResponseRedirect, HttpResponseForbidden, JsonResponse
+from django.http import (HttpResponse, HttpResponseNotModified, HttpResponseRedirect, HttpResponseForbidden,
+                         JsonResponse, StreamingHttpResponse)
+from django.utils.http import parse_etags
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth.models import Group
 from .models import *
 from .forms import *
+from .counters import refresh_ready_percentages
+from .payroll import close_past_months
+from .middleware import get_request_roles
+from .jobs import submit_import, submit_batch, create_import_batch
+from .spec_cache import hash_file
+from .exports import export_response, iter_payroll_rows, iter_production_rows, PAYROLL_HEADER, PRODUCTION_HEADER
+from .spec import preview_blacklist
+from .pagination import paginate_keyset
+from .reservations import (take_to_work, claim_queued, cancel_instance, queue_to_workers, complete_instances,
+                           notify_completed)
+from .caching import (NOTIFICATION_HASHES, WORKER_PRODUCTS_HASHES, MASTER_OBJECTS_HASHES, PRODUCT_DETAIL_HASHES,
+                      WORKER_PRODUCT_HASHES, OBJECT_DETAIL_HASHES, PRODUCT_IN_WORK_HASHES)
+from .events import (broker, get_versions, TOPIC_PATTERN, PRODUCTION_TOPIC, QUESTIONS_TOPIC, NOTIFICATIONS_TOPIC,
+                     HEARTBEAT_INTERVAL, group_notifications_topic, object_topic, product_topic, instance_topic,
+                     import_topic, import_batch_topic)
 from datetime import timedelta
 from dateutil.relativedelta import relativedelta
 from django.utils import timezone
+import asyncio
 import hashlib
 import json
-import pandas as pd
-import openpyxl as xl
-from fnmatch import fnmatch
 
 # Create your views here.
 
@@ -34,10 +49,7 @@ def get_default_object_state():
 
 
 def get_ready_object_state():
-    return ObjectState.objects.filter(name="В сборке").first()
-
-
-ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz!@#$%^&*()-=_+"№;:?'
+    return ObjectState.objects.filter(name=READY_STATE_NAME).first()
 
 
 def check_worker_data(request=None, user=None):
@@ -48,10 +60,13 @@ def check_worker_data(request=None, user=None):
         else:
             return WorkerData.objects.create(worker=user)
     elif request:
-        if WorkerData.objects.filter(worker=request.user).exists():
-            return WorkerData.objects.filter(worker=request.user).first()
-        else:
-            return WorkerData.objects.create(worker=request.user)
+        # id данных работника уже известен из групп пользователя (request.roles)
+        worker_data_id = get_request_roles(request).worker_data_id
+        worker_data = worker_data_id and WorkerData.objects.filter(
+            pk=worker_data_id).first()
+        if worker_data:
+            return worker_data
+        return check_worker_data(user=request.user)
     else:
         raise KeyError("One argument required: request OR user")
 
@@ -66,8 +81,8 @@ def check_user_group(request, group_name: str):
     он будет перенаправлен на главную страницу. Если проверка не строгая, будет возвращено значение True/False в зависимости от того,
     принадлежит ли пользователь выбранной группе
     """
-    target_group = Group.objects.get(name=group_name)
-    if target_group in request.user.groups.all():
+    # Группы пользователя определяются один раз за запрос (UserRolesMiddleware)
+    if group_name in get_request_roles(request):
         return True
     else:
         return False
@@ -75,31 +90,56 @@ def check_user_group(request, group_name: str):
 
 def update_notification(request=None):
     if request.headers.get('X-Requested-With') and 'XMLNotificationUpdate' in request.headers.get('X-Requested-With'):
-        notification = None
-        notifications = Notification.objects.filter(
-            recipient_group=request.user.groups.first())
-        if notifications:
-            for notify in notifications:
-                if request.user not in notify.read_by.all() and (timezone.now() - notify.created_at).seconds < 100:
-                    notification = notify
-                    break
+        # Новейшее непрочитанное уведомление группы пользователя (один запрос)
+        notification = Notification.objects.unread(
+            request.user, get_request_roles(request).first_group_id).first()
         if notification:
-            cache_key = f'notification_{request.user}'
             cur_hash = hashlib.md5(json.dumps(
                 [notification.id, notification.title, notification.message], sort_keys=True).encode()).hexdigest()
-            prev_hash = cache.get(cache_key)
-            if prev_hash and prev_hash == cur_hash:
+            if not NOTIFICATION_HASHES.changed(request.user.pk, cur_hash):
                 return JsonResponse({'html': ""})
-            cache.set(cache_key, cur_hash, timeout=300)
             data = {'html': render_to_string(
                 "partials/notification.html", {'notification': notification}, request), 'message': notification.message, 'time': notification.created_at}
             notification.read_by.add(request.user)
-            notification.save()
             return JsonResponse(data)
         else:
             return JsonResponse({'html': ""})
     return None
 
+
+def check_poll_etag(request, *topics):
+    """
+    Проверяет, изменились ли данные страницы с момента предыдущего периодического запроса (XHR).
+    Версии тем берутся из кэша, поэтому при неизменных данных ответ **304** отправляется без обращения к **БД**.
+    Возвращает ETag для ответа и ответ **304** (или None, если данные нужно отправить).
+    Для остальных запросов возвращает (None, None)
+
+    - request — HTTP-запрос
+    - topics — темы событий, от которых зависят данные страницы
+    """
+    if request.method != 'GET' or request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return None, None
+    etag = '"%s"' % hashlib.md5(json.dumps(
+        [request.user.pk, request.path, topics, get_versions(topics)]).encode()).hexdigest()
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return etag, response
+    return etag, None
+
+
+def poll_response(data, etag):
+    """
+    Возвращает JSON-ответ на периодический запрос страницы с указанным ETag
+
+    - data — данные ответа
+    - etag — ETag, полученный из check_poll_etag
+    """
+    response = JsonResponse(data)
+    if etag:
+        response['ETag'] = etag
+    return response
+
 # def check_summary(data: pd.DataFrame):
 #     """
 #     Проверяет формат Сводной
@@ -141,57 +181,54 @@ def update_notification(request=None):
 #     return True
 
 
-def rc_to_a1(row: int, col: int):
-    """
-    Перевод формата ячеек R1C1 в формат A1
-
-    - row — номер строки
-    - col — номер столбца
-    """
-    letter = ''
-    while col > 0:
-        col, remainder = divmod(col - 1, 26)
-        letter = chr(65 + remainder) + letter
-    return f"{letter}{row}"
+# Главная страница
 
 
-def check_spec(data: pd.DataFrame, formatted: xl.Workbook):
+@login_required
+async def events_view(request):
     """
-    Проверяет формат Спецификации
+    **view** потока событий (***Server-Sent Events***), по которому страницы узнают об изменении данных
+    и запрашивают обновление только тогда, когда оно действительно нужно.
 
-    - data — данные для парсинга из Спецификации в формате pandas.DataFrame
-    - formatted — Excel-файл с форматированием
-    """
-    if data.iloc[0, 1] != 'Наименование':
-        raise ValidationError("Не найдены наименования частей изделий")
-    if data.iloc[0, 11] != 'Итого\nруб':
-        raise ValidationError("Не найдены итоговые стоимости частей изделий")
-    if data.iloc[0, 14] != 'З/п':
-        raise ValidationError(
-            "Не найдены данные о зарплатах за иготовление изделий")
-    row_idx = 10
-    isHeader = False
-    anyHeader = False
-    sheet = formatted['Спецификация']
-    # Цвет: #33CCFF
-    while pd.notna(data.iloc[row_idx, 1]):
-        cell = sheet[rc_to_a1(row_idx+1, 2)]
-        if cell.fill and cell.fill.start_color.rgb == "FF33CCFF":
-            if cell.font and cell.font.bold:
-                if isHeader:
-                    raise ValidationError("Обнаружено пустое изделие")
-                isHeader = True
-                anyHeader = True
-            else:
-                isHeader = False
-        elif anyHeader is False:
-            raise ValidationError("Обнаружено оборудование без изделия")
-        else:
-            isHeader = False
-        row_idx += 1
-    return True
+    Принимает в параметрах ***topic*** темы событий (***production***, ***questions***, ***notifications***,
+    ***object:id***, ***product:id***, ***instance:id***). Тема ***notifications*** заменяется темой групп пользователя.
+    В каждом сообщении передаётся название изменившейся темы.
 
-# Главная страница
+    Работает только под ASGI-сервером (***work_server.asgi***), иначе возвращает ответ **204**,
+    после которого страницы возвращаются к периодическому опросу
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    # Темы брокера, соответствующие темам клиента
+    topics = {topic: topic for topic in request.GET.getlist(
+        'topic') if TOPIC_PATTERN.match(topic)}
+    if topics.pop(NOTIFICATIONS_TOPIC, None):
+        user = await request.auser()
+        async for group_id in user.groups.values_list('id', flat=True):
+            topics[group_notifications_topic(group_id)] = NOTIFICATIONS_TOPIC
+    if not topics:
+        return HttpResponse(status=204)
+
+    async def stream():
+        subscription = broker.subscribe(topics.keys())
+        try:
+            # Задержка (мс) перед переподключением клиента при обрыве соединения
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    topic = await asyncio.wait_for(subscription.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                yield f'data: {topics[topic]}\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(
+        stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -200,6 +237,10 @@ def index(request):
     # Если пользователь принадлежит группе Работник
     # Загружаем шаблон для работника
     if check_user_group(request, "worker"):
+        # Неизменившийся список изделий не вычисляется повторно
+        etag, not_modified = check_poll_etag(request, PRODUCTION_TOPIC)
+        if not_modified:
+            return not_modified
         # Проверка данных после авторизации.
         # В таком случае данные будут созданы в случае
         # Если они не существуют
@@ -214,48 +255,15 @@ def index(request):
             context['queued_first'] = queued.first()
             context['queued'] = queued
         else:
-            ready_state_subquery = ObjectStateInstance.objects.filter(
-                object=OuterRef('pk'),
-                state=get_ready_object_state()
-            )
-
-            objects = Object.objects.filter(
-                hidden=False, ready_percentage__lt=100).annotate(is_ready=Exists(ready_state_subquery)).filter(is_ready=True).prefetch_related(Prefetch('product_set', queryset=Product.objects.prefetch_related(Prefetch('part_set', queryset=Part.objects.all()))))
-            products = []
+            # Доступные изделия и поиск по номеру вычисляются одним запросом к БД
             search_query = request.GET.get('search', '')
-            for object in objects:
-                for product in object.product_set.all():
-                    ava_amount = product.get_ava_amount()
-                    has_available_parts = any(
-                        part.get_ava_amount() > 0
-                        for part in product.part_set.all()
-                    )
-
-                    if (ava_amount > 0 or has_available_parts) and search_query in product.get_id():
-                        products.append(product)
-            # Получаем список всех изделий
-            # raw_products = Product.objects.all().prefetch_related('object')
-            # # Фильтруем, оставляя лишь изделия, которые можно взять в работу
-            # products = []
-            # for product in raw_products:
-            #     if product.object.hidden is True:
-            #         continue
-            #     parts = Part.objects.filter(
-            #         product=product).prefetch_related('product')
-            #     state = ObjectStateInstance.objects.filter(
-            #         object=product.object, state=READY_OBJECT_STATE).prefetch_related('state', 'object')
-            #     # Если доступно всё изделие или какая-либо его часть
-            #     if product.get_ava_amount() > 0 or any(part.get_ava_amount() > 0 for part in parts):
-            #         # Если изделие готово к сборке
-            #         if state.exists():
-            #             products.append(product)
+            products = list(Product.objects.available_for_work(search_query))
             context['products'] = products
             if request.headers.get('X-Requested-With') == 'XMLHttpSearchRequest':
                 data = {'html': render_to_string(
                     "partials/worker_products.html", context, request)}
                 return JsonResponse(data)
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cache_key = f'worker_products_list_{request.user}'
             if queued:
                 cur_hash = hashlib.md5(json.dumps(
                     list(queued.values('id')), sort_keys=True).encode()).hexdigest()
@@ -265,14 +273,11 @@ def index(request):
                     prod_ids.append(product.id)
                 cur_hash = hashlib.md5(json.dumps(
                     prod_ids, sort_keys=True).encode()).hexdigest()
-            prev_hash = cache.get(cache_key)
-            if prev_hash and prev_hash == cur_hash:
-                return JsonResponse({'html': ""})
-            cache.set(cache_key, cur_hash, timeout=300)
+            if not WORKER_PRODUCTS_HASHES.changed(request.user.pk, cur_hash):
+                return poll_response({'html': ""}, etag)
             data = {'html': render_to_string(
                 "partials/worker_products.html", context, request)}
-            return JsonResponse(data)
-        cache_key = f'worker_products_list_{request.user}'
+            return poll_response(data, etag)
         if queued:
             cur_hash = hashlib.md5(json.dumps(
                 list(queued.values('id')), sort_keys=True).encode()).hexdigest()
@@ -282,18 +287,25 @@ def index(request):
                 prod_ids.append(product.id)
             cur_hash = hashlib.md5(json.dumps(
                 prod_ids, sort_keys=True).encode()).hexdigest()
-        cache.set(cache_key, cur_hash, timeout=300)
+        WORKER_PRODUCTS_HASHES.set(request.user.pk, cur_hash)
         # Отправляем пользователю шаблон, заполняя его данными
         return render(request, "worker.html", context)
     # Если пользователь принадлежит группе Мастер
     # Загружаем шаблон для мастера
     elif check_user_group(request, "master"):
-        objects = Object.objects.filter(hidden=False)
-        questions = Question.objects.filter(answer='')
-        context = {'objects': objects, 'questions': len(questions)}
+        etag, not_modified = check_poll_etag(
+            request, PRODUCTION_TOPIC, QUESTIONS_TOPIC)
+        if not_modified:
+            return not_modified
         notify = update_notification(request)
         if notify:
             return notify
+        # Готовность всех видимых объектов пересчитывается одним набором агрегирующих запросов,
+        # состояния объектов (цвет строки) загружаются вместе с ними
+        objects = refresh_ready_percentages(
+            Object.objects.filter(hidden=False).prefetch_related('objectstateinstance_set__state'))
+        questions = Question.objects.filter(answer='')
+        context = {'objects': objects, 'questions': len(questions)}
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             data = []
             for object in objects:
@@ -303,17 +315,14 @@ def index(request):
                 data.append(f'question: {question.id}')
             cur_hash = hashlib.md5(json.dumps(
                 data, sort_keys=True).encode()).hexdigest()
-            cache_key = f'master_object_list_{request.user}'
-            prev_hash = cache.get(cache_key)
-            if prev_hash and prev_hash == cur_hash:
-                return JsonResponse({'html': ""})
-            cache.set(cache_key, cur_hash, timeout=300)
+            if not MASTER_OBJECTS_HASHES.changed(request.user.pk, cur_hash):
+                return poll_response({'html': ""}, etag)
             question_len = 0
             if questions:
                 question_len = len(questions)
             data = {'html': render_to_string(
                 'partials/objects_table.html', context, request), 'questions': question_len}
-            return JsonResponse(data)
+            return poll_response(data, etag)
         return render(request, 'master.html', context)
         # start_dt = timezone.now().date()
         # end_dt = timezone.now().date()
@@ -401,6 +410,9 @@ def product_detail_view(request, pk):
     notify = update_notification(request)
     if notify:
         return notify
+    etag, not_modified = check_poll_etag(request, product_topic(pk))
+    if not_modified:
+        return not_modified
     # Получаем информацию о выбранном изделии
     product = get_object_or_404(Product, pk=pk)
     raw_parts = Part.objects.filter(product=product)
@@ -443,82 +455,37 @@ def product_detail_view(request, pk):
             # Получаем выбранное количество
             amount = form.cleaned_data['amount']
             choice = int(form.cleaned_data['creation'])
-            # Если выбрано всё изделие
-            if choice == 1:
-                # Если количество превышает доступное
-                # Выводим сообщение об ошибке (добавляя ошибку в форму, дальнейшая обработка произойдёт в шаблоне)
-                if amount > product.get_ava_amount():
-                    context = {
-                        'form': form,
-                        'product': product,
-                        'parts': parts,
-                        'choices': tmpl_choices,
-                    }
-                    form.add_error(
-                        'amount', "Указанное количество изделий превышает допустимое")
-                    return render(request, 'product_detail.html', context)
-                # Иначе создаём запись о новом изделии в работе
-                else:
-                    worker_data = check_worker_data(request)
-                    product.ava_amount = None
-                    product.save()
-                    # Если запись уже есть, обновляем её (увеличилось кол-во изделий в работе)
-                    wip_product = CreationInstance.objects.filter(
-                        worker=worker_data, product=product, status="IN_WORK").first()
-                    if wip_product:
-                        wip_product.amount += amount
-                        wip_product.save()
-                    # Иначе создаём новую запись
-                    else:
-                        CreationInstance.objects.create(
-                            product=product, worker=worker_data, amount=amount, status='IN_WORK', started=timezone.now().date())
-                    product.get_ava_amount()
-                    # Возвращаем пользователя на главную страницу
-                    return HttpResponseRedirect('/workspace')
+            selected_part = None
             # Если выбрана часть изделия
-            else:
-                selected_part = None
+            if choice != 1:
                 idx = 2
                 for part in parts:
                     if idx == choice:
                         selected_part = part
                         break
                     idx += 1
-                if amount > selected_part.get_ava_amount():
-                    context = {
-                        'form': form,
-                        'product': product,
-                        'parts': parts,
-                        'choices': tmpl_choices,
-                    }
-                    form.add_error(
-                        'amount', "Указанное количество изделий превышает допустимое")
-                    return render(request, 'product_detail.html', context)
-                else:
-                    worker_data = check_worker_data(request)
-                    # Если запись уже есть, обновляем её (увеличилось кол-во частей в работе)
-                    selected_part.product.ava_amount = None
-                    selected_part.product.save()
-                    selected_part.ava_amount = None
-                    selected_part.save()
-                    wip_part = CreationInstance.objects.filter(
-                        worker=worker_data, part=selected_part).first()
-                    if wip_part:
-                        wip_part.amount += amount
-                        wip_part.save()
-                    # Иначе создаём новую запись
-                    else:
-                        CreationInstance.objects.create(
-                            part=part, worker=worker_data, amount=amount, status='IN_WORK', started=timezone.now().date())
-                    selected_part.get_ava_amount()
-                    selected_part.product.get_ava_amount()
-                    # Возвращаем пользователя на главную страницу
-                    return HttpResponseRedirect('/workspace')
+            # Доступное кол-во проверяется и экземпляр записывается под блокировкой счётчика изделия,
+            # поэтому одновременно берущие изделие работники не могут взять больше доступного
+            try:
+                take_to_work(check_worker_data(request), amount,
+                             product=None if selected_part else product, part=selected_part)
+            # Если количество превышает доступное
+            # Выводим сообщение об ошибке (добавляя ошибку в форму, дальнейшая обработка произойдёт в шаблоне)
+            except ValidationError as e:
+                context = {
+                    'form': form,
+                    'product': product,
+                    'parts': parts,
+                    'choices': tmpl_choices,
+                }
+                form.add_error('amount', e)
+                return render(request, 'product_detail.html', context)
+            # Возвращаем пользователя на главную страницу
+            return HttpResponseRedirect('/workspace')
 
     # Если пришёл другой запрос (GET), возвращаем шаблон с формой для взятия изделия в работу
     else:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cache_key = f'product_detail_{request.user}'
             cache_data = [f'prod: {product.ava_float()}',
                           f'descr: {product.description}']
             if parts:
@@ -526,20 +493,18 @@ def product_detail_view(request, pk):
                     cache_data.append(f'{part.id}: {part.get_ava_amount}')
             cur_hash = hashlib.md5(json.dumps(
                 cache_data, sort_keys=True).encode()).hexdigest()
-            prev_hash = cache.get(cache_key)
-            if prev_hash and prev_hash == cur_hash:
-                return JsonResponse({'html': ""})
-            cache.set(cache_key, cur_hash, timeout=300)
+            if not PRODUCT_DETAIL_HASHES.changed(request.user.pk, cur_hash):
+                return poll_response({'html': ""}, etag)
             form = TakeProductToWorkForm(choices=choices, initial={
                 'amount': def_amount, 'creation': def_choice})
             if parts == None:
                 if product.get_ava_amount() == 0:
                     data = {'return': True}
-                    return JsonResponse(data)
+                    return poll_response(data, etag)
             else:
                 if product.get_ava_amount() == 0 and all(part.get_ava_amount() == 0 for part in parts):
                     data = {'return': True}
-                    return JsonResponse(data)
+                    return poll_response(data, etag)
             context = {
                 'form': form,
                 'product': product,
@@ -548,7 +513,7 @@ def product_detail_view(request, pk):
             }
             data = {'html': render_to_string(
                 "partials/product_details.html", context, request)}
-            return JsonResponse(data)
+            return poll_response(data, etag)
         else:
             form = TakeProductToWorkForm(choices=choices, initial={
                 'amount': def_amount, 'creation': def_choice})
@@ -586,6 +551,9 @@ def my_product_view(request, pk):
     notify = update_notification(request)
     if notify:
         return notify
+    etag, not_modified = check_poll_etag(request, instance_topic(pk))
+    if not_modified:
+        return not_modified
     worker_data = check_worker_data(request)
     # Получаем запись о выбранном изделии
     instance = get_object_or_404(CreationInstance, pk=pk)
@@ -607,62 +575,28 @@ def my_product_view(request, pk):
                     instance=instance, quest=question)
                 all_questions = Question.objects.filter(instance=instance)
         elif 'finish_product' in request.POST:
-            object = instance.product.object if instance.product else instance.part.product.object
-            object.ready_percentage = None
-            object.save()
-            part = None
-            if instance.part:
-                part = instance.part
-                part.ava_amount = None
-                part.save()
-            product = instance.product if instance.product else instance.part.product
-            product.ava_amount = None
-            product.completed_amount = None
-            product.save()
-            completed = CreationInstance.objects.filter(
-                worker=worker_data, product=instance.product, part=instance.part, status="COMPLETED").first()
-            if completed:
-                completed.amount += instance.amount
-                completed.completed = timezone.now().date()
-                completed.save()
-                instance.delete()
-            else:
-                instance.status = 'COMPLETED'
-                instance.completed = timezone.now().date()
-                instance.save()
-            if part:
-                part.get_ava_amount()
-            product.get_ava_amount()
-            product.get_completed_amount()
-            object.get_ready_percentage()
-            Notification.objects.create(recipient_group=Group.objects.get(
-                name='master'), title='Завершено изделие', message=f'{worker_data.display_name} завершил работу над {instance}')
+            # Счётчики производства и готовность объекта обновляются вместе с экземпляром
+            notify_completed(complete_instances(
+                [instance.pk], worker=worker_data))
             return HttpResponseRedirect('/workspace/my_products')
         elif 'cancel_product' in request.POST:
-            while all_questions:
-                all_questions.first().delete()
-            product = instance.product if instance.product else instance.part.product
-            product.ava_amount = None
-            instance.delete()
-            product.get_ava_amount()
+            # Вопросы по экземпляру удаляются вместе с ним
+            cancel_instance(instance)
             return HttpResponseRedirect('/workspace/my_products')
     # Если получен другой запрос (GET), создаём форму для отправки вопроса
     else:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cache_key = f'worker_product_{request.user}'
             cur_hash = hashlib.md5(json.dumps(list(all_questions.values(
                 "id", "quest", "answer")), sort_keys=True).encode()).hexdigest()
-            prev_hash = cache.get(cache_key)
-            if prev_hash and prev_hash == cur_hash:
-                return JsonResponse({'html': ""})
-            cache.set(cache_key, cur_hash, timeout=300)
+            if not WORKER_PRODUCT_HASHES.changed(request.user.pk, cur_hash):
+                return poll_response({'html': ""}, etag)
             context = {
                 'instance': instance,
                 'questions': all_questions
             }
             data = {'html': render_to_string(
                 "partials/questions_list.html", context, request)}
-            return JsonResponse(data)
+            return poll_response(data, etag)
         else:
             form = EnterQuestionForm()
     # Отправляем заполненный шаблон
@@ -681,6 +615,9 @@ def object_detail_view(request, pk):
     notify = update_notification(request)
     if notify:
         return notify
+    etag, not_modified = check_poll_etag(request, object_topic(pk))
+    if not_modified:
+        return not_modified
     object = get_object_or_404(Object, pk=pk)
     states = ObjectStateInstance.objects.filter(object=object)
     # all_states = ObjectState.objects.all()
@@ -693,7 +630,9 @@ def object_detail_view(request, pk):
     #         form_states = [(str(idx), state)]
     #     idx += 1
     # form_states.append((str(idx), 'Дедлайн'))
-    products = Product.objects.filter(object=object).prefetch_related('object')
+    # Кол-во экземпляров изделий и частей подгружается заранее (постоянное число запросов)
+    products = Product.objects.filter(
+        object=object).select_related('object').with_availability()
     can_be_deleted = True
     for product in products:
         if product.get_ava_amount() != product.amount:
@@ -797,20 +736,17 @@ def object_detail_view(request, pk):
             context['object'] = object
 
     elif request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        cache_key = f'object_detail_{object.id}'
         cache_data = []
         for product in products:
             cache_data.append(
                 f'{product.id}: {product.get_ava_amount()}, {product.get_ava_parts_amount()}, {product.get_in_work_amount()}, {product.get_parts_in_work_amount()}')
         cur_hash = hashlib.md5(json.dumps(
             cache_data, sort_keys=True).encode()).hexdigest()
-        prev_hash = cache.get(cache_key)
-        if prev_hash and prev_hash == cur_hash:
-            return JsonResponse({'html': ""})
-        cache.set(cache_key, cur_hash, timeout=300)
+        if not OBJECT_DETAIL_HASHES.changed((request.user.pk, object.id), cur_hash):
+            return poll_response({'html': ""}, etag)
         data = {'html': render_to_string(
             "partials/object_details.html", context, request)}
-        return JsonResponse(data)
+        return poll_response(data, etag)
     # else:
         # form = AddStateForm(
         #     initial={'created_at': timezone.now().date()}, choices=form_states)
@@ -828,36 +764,17 @@ def in_work_view(request):
     if notify:
         return notify
     if request.method == "POST":
-        finished_id = request.POST.get("work_id")
-        instance = CreationInstance.objects.filter(id=finished_id).first()
-        object = instance.product.object if instance.product else instance.part.product.object
-        object.ready_percentage = None
-        object.save()
-        part = None
-        if instance.part:
-            part = instance.part
-            part.ava_amount = None
-        product = instance.product if instance.product else instance.part.product
-        product.ava_amount = None
-        product.completed_amount = None
-        product.save()
-        completed = CreationInstance.objects.filter(
-            worker=instance.worker, product=instance.product, part=instance.part, status="COMPLETED").first()
-        if completed:
-            completed.amount += instance.amount
-            completed.completed = timezone.now().date()
-            completed.save()
-            instance.delete()
-        else:
-            instance.status = 'COMPLETED'
-            instance.completed = timezone.now().date()
-            instance.save()
-        if part:
-            part.get_ava_amount()
-        product.get_ava_amount()
-        product.get_completed_amount()
-        object.get_ready_percentage()
-    instances = CreationInstance.objects.filter(status='IN_WORK')
+        # Счётчики производства и готовность объектов пересчитываются один раз для всех завершённых экземпляров
+        if 'finish_selected' in request.POST:
+            # Мастеру отправляется одно уведомление обо всех завершённых экземплярах
+            notify_completed(complete_instances(
+                [work_id for work_id in request.POST.getlist('work_ids') if work_id.isdigit()]))
+        elif request.POST.get("work_id", "").isdigit():
+            complete_instances([request.POST["work_id"]])
+        return HttpResponseRedirect(request.get_full_path())
+    # Экземпляры выводятся постранично (по курсору) вместе с изделиями, частями и работниками
+    instances = paginate_keyset(request, CreationInstance.objects.filter(status='IN_WORK').select_related(
+        'product__object', 'part__product__object', 'worker'), ('id',))
     questions = Question.objects.filter(answer='')
     context = {
         'instances': instances,
@@ -874,9 +791,9 @@ def workers_list_view(request):
     Получает из **БД**:
     - ***WorkerData*** с полем ***hidden***=**True**
 
-    Включенные запросы к **БД** (вызываются в процессе подготовки данных):
-    - x2 ***CreationInstance*** c полем ***worker***=***WorkerData***, ***completed*** >= **Начало указанного месяца**, ***completed*** <= **Конец указанного месяца**, ***status***=**COMPLETED**
-    - x2 ***CreationInstance*** c полем ***worker***=***WorkerData***, ***status***=**COMPLETED**
+    Кол-во произведённых изделий и выплаты за указанный месяц и за всё время
+    берутся из ведомости выплат (***PayrollLedger***) одним сгруппированным запросом (***WorkerData.objects.with_payroll***).
+    Итоги прошедших месяцев закрываются и далее не пересчитываются
 
     Работает с шаблоном ***workers_list.html***
     """
@@ -939,11 +856,9 @@ def workers_list_view(request):
     next = cur_date + relativedelta(months=1)
     # Определяем начало выбранного месяца
     start = cur_date.replace(day=1)
-    # Определяем конец выбранного месяца
-    end = (start + relativedelta(months=1)
-           ).replace(day=1) - relativedelta(days=1)
-    # Получаем данные о всех работниках
-    workers_data = WorkerData.objects.all()
+    # Закрываем итоги прошедших месяцев и получаем данные о всех работниках вместе с выплатами
+    close_past_months()
+    workers_data = WorkerData.objects.with_payroll(start)
     # Создаём пустой словарь для сбора данных о работниках
     workers = dict()
     # Создаём переменную для хранения общего кол-ва произведённых изделий
@@ -957,16 +872,16 @@ def workers_list_view(request):
     # Собираем данные о всех работниках
     for worker in workers_data:
         # Если работник произвёл какие-либо изделия за выбранный месяц
-        if worker.get_completed(start, end) > 0:
+        if worker.period_completed > 0:
             # Добавляем в словарь данные о нём: его данные, кол-во произведённых изделий, сумму выплат
-            workers[worker] = {"worker": worker, "completed": worker.get_completed(
-                start, end), "payment": worker.get_payment(start, end)}
+            workers[worker] = {"worker": worker, "completed": worker.period_completed,
+                               "payment": worker.period_payment}
             # Обновляем данные за месяц
-            completed += worker.get_completed(start, end)
-            payment += worker.get_payment(start, end)
+            completed += worker.period_completed
+            payment += worker.period_payment
         # Обновляем данные за всё время
-        all_completed += worker.get_all_completed_amount()
-        all_payment += worker.get_all_payment()
+        all_completed += worker.total_completed
+        all_payment += worker.total_payment
     # Заполняем словарь с данными для шаблона
     context['workers'] = workers
     context['completed_products'] = completed
@@ -990,6 +905,9 @@ def product_in_work_detail_view(request, pk):
     notify = update_notification(request)
     if notify:
         return notify
+    etag, not_modified = check_poll_etag(request, product_topic(pk))
+    if not_modified:
+        return not_modified
     product = get_object_or_404(Product, pk=pk)
     parts = Part.objects.filter(product=product)
     in_work_products = CreationInstance.objects.filter(
@@ -1088,7 +1006,6 @@ def product_in_work_detail_view(request, pk):
                 'amount': def_amount, 'creation': def_choice})
             context['queueform'] = form
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cache_key = f'product_detail_{product.id}'
             cache_data = [
                 f'{product.id}: {product.get_ava_amount()}, {product.get_ava_parts_amount()}, {product.get_in_work_amount()}, {product.get_parts_in_work_amount()}']
             for part in parts:
@@ -1096,13 +1013,11 @@ def product_in_work_detail_view(request, pk):
                     f'{part.id}: {part.get_ava_amount()}, {part.get_completed_amount()}, {part.get_in_work_amount()}')
             cur_hash = hashlib.md5(json.dumps(
                 cache_data, sort_keys=True).encode()).hexdigest()
-            prev_hash = cache.get(cache_key)
-            if prev_hash and prev_hash == cur_hash:
-                return JsonResponse({'html': ""})
-            cache.set(cache_key, cur_hash, timeout=300)
+            if not PRODUCT_IN_WORK_HASHES.changed((request.user.pk, product.id), cur_hash):
+                return poll_response({'html': ""}, etag)
             data = {'html': render_to_string(
                 "partials/product_in_work_details.html", context, request)}
-            return JsonResponse(data)
+            return poll_response(data, etag)
     elif request.method == "POST":
         if 'save' in request.POST:
             form = EnterDescriptionForm(request.POST)
@@ -1149,25 +1064,14 @@ def product_in_work_detail_view(request, pk):
                 choice = int(form.cleaned_data['creation'][0])
                 worker = form.cleaned_data['worker']
                 worker_data = check_worker_data(user=worker)
+                selected_part = None
                 if choice == 1:
                     if product.get_ava_amount() < amount:
                         form.add_error(
                             'amount', f'Выбрано недопустимое кол-во. К изготовлению доступно {product.get_ava_amount()} шт.')
                         context['queueform'] = form
                         return render(request, 'product_in_work.html', context)
-                    product.ava_amount = None
-                    product.save()
-                    instance = CreationInstance.objects.filter(
-                        worker=worker_data, product=product, status='QUEUED').first()
-                    if instance:
-                        instance.amount += amount
-                        instance.save()
-                    else:
-                        CreationInstance.objects.create(
-                            worker=worker_data, product=product, status='QUEUED', amount=amount, queued=timezone.now())
-                    product.get_ava_amount()
                 else:
-                    selected_part = None
                     idx = 2
                     for part in selectable_parts:
                         if idx == choice:
@@ -1179,20 +1083,15 @@ def product_in_work_detail_view(request, pk):
                             'amount', f'Выбрано недопустимое кол-во. К изготовлению доступно {selected_part.get_ava_amount()} шт.')
                         context['queueform'] = form
                         return render(request, 'product_in_work.html', context)
-                    selected_part.ava_amount = 0
-                    selected_part.product.ava_amount = 0
-                    selected_part.save()
-                    selected_part.product.save()
-                    instance = CreationInstance.objects.filter(
-                        worker=worker_data, part=selected_part, status='QUEUED').first()
-                    if instance:
-                        instance.amount += amount
-                        instance.save()
-                    else:
-                        CreationInstance.objects.create(
-                            worker=worker_data, part=selected_part, status='QUEUED', amount=amount, queued=timezone.now())
-                    selected_part.get_ava_amount()
-                    selected_part.product.get_ava_amount()
+                # Доступное кол-во проверяется повторно под блокировкой счётчика изделия
+                try:
+                    queue_to_workers([(worker_data, amount, None if selected_part else product, selected_part)])
+                except ValidationError as e:
+                    form.add_error('amount', e.messages)
+                    context['queueform'] = form
+                    return render(request, 'product_in_work.html', context)
+                # Перечитываем изделие вместе с обновлёнными счётчиками производства
+                product.refresh_from_db()
                 raw_parts = Part.objects.filter(product=product)
                 selectable_parts = None
                 for part in raw_parts:
@@ -1237,6 +1136,73 @@ def product_in_work_detail_view(request, pk):
     return render(request, 'product_in_work.html', context)
 
 
+def get_queue_items(object):
+    """
+    Возвращает изделия и части объекта, доступные для постановки в очередь:
+    (варианты выбора, {вариант: (изделие, часть)}). Доступность берётся из счётчиков (два запроса)
+
+    - object — объект
+    """
+    choices = [('', '---------')]
+    items = {}
+    for product in Product.objects.filter(object=object).select_related('object').with_availability():
+        if product.get_ava_amount() > 0:
+            key = f'product-{product.id}'
+            choices.append((key, f'{product} (доступно {product.get_ava_amount()})'))
+            items[key] = (product, None)
+        for part in product.part_set.all():
+            if part.get_ava_amount() > 0:
+                key = f'part-{part.id}'
+                choices.append((key, f'{product.get_id()} {part.name} (доступно {part.get_ava_amount()})'))
+                items[key] = (None, part)
+    return choices, items
+
+
+@login_required
+def object_queue_view(request, pk):
+    """
+    **view** для распределения изделий и частей объекта по очередям работников (несколько строк за раз)
+
+    Работает с шаблоном ***object_queue.html***
+    """
+    if check_user_group(request, "master") is False:
+        return HttpResponseRedirect('/workspace')
+    notify = update_notification(request)
+    if notify:
+        return notify
+    object = get_object_or_404(Object, pk=pk)
+    item_choices, items = get_queue_items(object)
+    workers = {str(worker.id): worker for worker in WorkerData.objects.filter(
+        worker__groups__name='worker').order_by('display_name')}
+    worker_choices = [('', '---------')] + [(key, worker.display_name)
+                                            for key, worker in workers.items()]
+    form_kwargs = {'items': item_choices, 'workers': worker_choices}
+    errors = []
+    if request.method == "POST":
+        formset = QueueAssignmentFormSet(request.POST, form_kwargs=form_kwargs)
+        if formset.is_valid():
+            rows = []
+            for data in formset.cleaned_data:
+                if data:
+                    product, part = items[data['item']]
+                    rows.append((workers[data['worker']], data['amount'], product, part))
+            try:
+                queue_to_workers(rows)
+            # Если кол-во какой-либо строки превышает доступное, ни одна строка не ставится в очередь
+            except ValidationError as e:
+                errors = e.messages
+            else:
+                return HttpResponseRedirect(object.get_absolute_url())
+    else:
+        formset = QueueAssignmentFormSet(form_kwargs=form_kwargs)
+    context = {
+        'object': object,
+        'formset': formset,
+        'errors': errors,
+    }
+    return render(request, 'object_queue.html', context)
+
+
 @login_required
 def worker_detail(request, pk):
     if check_user_group(request, "master") is False:
@@ -1244,7 +1210,6 @@ def worker_detail(request, pk):
     notify = update_notification(request)
     if notify:
         return notify
-    worker_data = get_object_or_404(WorkerData, pk=pk)
     date = request.GET.get("date")
     if date:
         cur_date = datetime.strptime(date, '%Y-%m-%d').date()
@@ -1257,10 +1222,14 @@ def worker_detail(request, pk):
     while end.month == start.month:
         end += relativedelta(days=1)
     end -= relativedelta(days=1)
-    completed_products = CreationInstance.objects.filter(
-        status="COMPLETED", completed__gte=start, completed__lte=end, worker=worker_data)
-    payment = worker_data.get_payment(start, end)
-    completed_amount = worker_data.get_completed(start, end)
+    # Выплаты за месяц и за всё время вычисляются вместе с данными работника
+    worker_data = get_object_or_404(
+        WorkerData.objects.with_payroll(start), pk=pk)
+    # История за месяц выводится постранично (от последних произведённых)
+    completed_products = paginate_keyset(request, worker_data.get_completed_instances(start, end).select_related(
+        'product__object', 'part__product__object'), ('-completed', '-id'))
+    payment = worker_data.period_payment
+    completed_amount = worker_data.period_completed
     if request.method == "POST":
         if 'delete_user' in request.POST:
             worker = worker_data.worker
@@ -1269,7 +1238,8 @@ def worker_detail(request, pk):
             worker.delete()
             return HttpResponseRedirect('/workspace/workers_list')
     products_in_work = CreationInstance.objects.filter(
-        worker=worker_data).filter(status__in=['IN_WORK', 'QUEUED'])
+        worker=worker_data).filter(status__in=['IN_WORK', 'QUEUED']).select_related(
+        'product__object', 'part__product__object')
     context = {
         'worker': worker_data,
         'products': completed_products,
@@ -1301,8 +1271,9 @@ def questions_list(request):
     notify = update_notification(request)
     if notify:
         return notify
-    # Получаем все вопросы, на которые не был дан ответ
-    questions = Question.objects.filter(answer="")
+    # Получаем вопросы, на которые не был дан ответ (постранично, вместе с изделиями/частями и объектами)
+    questions = paginate_keyset(request, Question.objects.filter(answer="").select_related(
+        'instance__product__object', 'instance__part__product__object'), ('instance_id', 'id'))
     # Создаём словарь с данными для шаблона
     context = {
         'questions': questions,
@@ -1362,200 +1333,78 @@ def migrate_view(request):
     # Сохраняем кол-во вопросов в словарь данных для шаблона
     context['questions'] = len(questions)
     if request.method == "GET":
-        form = SelectFileForm()
+        job_id = request.GET.get('job')
+        batch_id = request.GET.get('batch')
+        if batch_id:
+            batch = get_object_or_404(ImportBatch, pk=batch_id)
+            # Периодический запрос хода пакетного импорта
+            etag, not_modified = check_poll_etag(
+                request, import_batch_topic(batch.pk))
+            if not_modified:
+                return not_modified
+            batch_context = {'batch': batch, 'batch_jobs': batch.importjob_set.select_related('object').order_by('id'),
+                             'totals': batch.get_totals()}
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return poll_response({'html': render_to_string('partials/import_batch.html', batch_context),
+                                      'finished': batch.finished}, etag)
+            context.update(batch_context)
+        elif job_id:
+            job = get_object_or_404(ImportJob, pk=job_id)
+            # Периодический запрос хода импорта
+            etag, not_modified = check_poll_etag(request, import_topic(job.pk))
+            if not_modified:
+                return not_modified
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return poll_response(job.progress(), etag)
+            context['job'] = job
+            context['previous_import'] = job.get_previous_import()
+            if job.status == 'DONE' and job.object:
+                context['object'] = job.object
+                context['products'] = job.object.product_set.order_by(
+                    'id').prefetch_related('part_set')
+        form = ImportSpecForm()
         context['form'] = form
+        context['batch_form'] = BatchImportForm()
+        context['jobs'] = ImportJob.objects.select_related('object')[:10]
+    elif request.method == "POST" and 'apply' in request.POST:
+        # Применяем изменения, показанные при предпросмотре (Спецификация разбирается заново,
+        # и, если отличия изменились, задача возвращается к предпросмотру)
+        job = get_object_or_404(
+            ImportJob, pk=request.POST.get('apply'), status='PREVIEW')
+        job.dry_run = False
+        job.status = 'QUEUED'
+        job.error = ''
+        job.finished_at = None
+        job.save(update_fields=['dry_run', 'status', 'error', 'finished_at'])
+        submit_import(job, get_default_object_state())
+        return HttpResponseRedirect(f'/workspace/migrate/?job={job.pk}')
+    elif request.method == "POST" and 'start_batch' in request.POST:
+        batch_form = BatchImportForm(request.POST, request.FILES)
+        if batch_form.is_valid():
+            # Каждая Спецификация пакета (в т.ч. из zip-архива) становится отдельной задачей импорта
+            try:
+                batch = create_import_batch(
+                    batch_form.cleaned_data["specs"], request.user)
+            except ValidationError as e:
+                batch_form.add_error("specs", e)
+            else:
+                submit_batch(batch, get_default_object_state())
+                return HttpResponseRedirect(f'/workspace/migrate/?batch={batch.pk}')
+        context['form'] = ImportSpecForm()
+        context['batch_form'] = batch_form
     elif request.method == "POST":
-        form = SelectFileForm(request.POST, request.FILES)
+        form = ImportSpecForm(request.POST, request.FILES)
         if form.is_valid():
             # Получаем файл из запроса
             spec = request.FILES.get("spec")
-            # deadline = form.cleaned_data["deadline"]
-            # Считываем данные из файла
-            spec_data = pd.read_excel(
-                spec, header=None, sheet_name="Спецификация")
-            spec_format = xl.load_workbook(spec, read_only=True)
-            sheet = spec_format['Спецификация']
-            if check_spec(spec_data, spec_format) is False:
-                raise ValidationError(
-                    "Спецификафия не соответствует формату")
-            obj_number = spec.name.split()[0]
-            # Парсим данные из спецификации
-            prod_data = dict()
-            parts = dict()
-            row_idx = 10
-            header = ''
-            part_head = ''
-            prod_price = Decimal(0.00)
-            prod_amount = 0
-            pay = 0
-            part_price = Decimal(0.00)
-            part_amount = Decimal(1.00)
-            max_idx = 0
-            unique_idx = 0
-            skip = False
-            blacklisted = False
-            while pd.notna(spec_data.iloc[row_idx, 1]):
-                cell = sheet[rc_to_a1(row_idx+1, 2)]
-                if cell.fill and cell.fill.start_color.rgb == "FF33CCFF":
-                    if cell.font and cell.font.bold:
-                        if part_head != '':
-                            payment = ((part_price / part_amount) /
-                                       prod_price) * pay
-                            parts[unique_idx] = {
-                                'price': payment.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), 'amount': part_amount, 'name': part_head}
-                            unique_idx += 1
-                        if blacklisted:
-                            parts = dict()
-                            blacklisted = False
-                        if header != '':
-                            if ', ' in header or ' - ' in header:
-                                list = header.split(', ')
-                                idx = 1
-                                for part in list:
-                                    if ' - ' in part:
-                                        start = part.split(" - ")[0]
-                                        end = part.split(" - ")[1]
-                                        deleted = ''
-                                        sym = start[0]
-                                        while sym.lower() in ALPHABET:
-                                            deleted += sym
-                                            start = start.replace(sym, '', 1)
-                                            sym = start[0]
-                                        if '.' in end:
-                                            dec_places = len(end.split('.')[1])
-                                        else:
-                                            dec_places = 0
-                                        end = end.replace(deleted, '', 1)
-                                        start = Decimal(start)
-                                        end = Decimal(end)
-                                        step = Decimal(1) / pow(10, dec_places)
-                                        while start <= end:
-                                            prod_data[unique_idx] = {
-                                                'parts': parts.copy(), 'price': pay, 'name': deleted + f'{start}', 'amount': 1, 'number': (len(str(prod_amount)) - len(str(idx))) * "0" + str(idx)}
-                                            unique_idx += 1
-                                            start += step
-                                            idx += 1
-                                    else:
-                                        prod_data[unique_idx] = {
-                                            'parts': parts.copy(), 'price': pay, 'name': part, 'amount': 1, 'number': (len(str(prod_amount)) - len(str(idx))) * "0" + str(idx)}
-                                        unique_idx += 1
-                                        idx += 1
-                            else:
-                                prod_data[unique_idx] = {
-                                    'parts': parts.copy(), 'price': pay, 'name': header, 'amount': prod_amount}
-                                unique_idx += 1
-                        if spec_data.iloc[row_idx, 12] > 0:
-                            header = spec_data.iloc[row_idx, 1]
-                            prod_amount = int(spec_data.iloc[row_idx, 8])
-                            prod_price = Decimal(spec_data.iloc[row_idx, 11])
-                            pay = int(
-                                spec_data.iloc[row_idx, 14] // spec_data.iloc[row_idx, 8])
-                            parts = dict()
-                            part_head = ''
-                            part_price = Decimal(0.00)
-                            part_amount = Decimal(1.00)
-                            max_idx += 1
-                            skip = False
-                        else:
-                            skip = True
-                    else:
-                        if any(fnmatch(spec_data.iloc[row_idx, 1], pattern.value) for pattern in ParseBlacklistValue.objects.all()) or skip:
-                            if not skip:
-                                blacklisted = True
-                            row_idx += 1
-                            continue
-                        if part_head != '':
-                            payment = ((part_price / part_amount) /
-                                       prod_price) * pay
-                            parts[unique_idx] = {
-                                'price': payment.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), 'amount': part_amount, 'name': part_head}
-                            unique_idx += 1
-                        part_head = spec_data.iloc[row_idx, 1]
-                        if pd.notna(spec_data.iloc[row_idx, 7]):
-                            part_amount = Decimal(
-                                spec_data.iloc[row_idx, 7])
-                        part_price = Decimal(0.00)
-                else:
-                    if not skip:
-                        part_price += Decimal(spec_data.iloc[row_idx, 11])
-                row_idx += 1
-            if part_head != '' and not skip:
-                payment = ((part_price / part_amount) / prod_price) * pay
-                parts[unique_idx] = {
-                    'price': payment.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), 'amount': part_amount, 'name': part_head}
-                unique_idx += 1
-            if (', ' in header or ' - ' in header) and not skip:
-                if blacklisted:
-                    parts = dict()
-                list = header.split(', ')
-                idx = 1
-                for part in list:
-                    if ' - ' in part:
-                        start = part.split(" - ")[0]
-                        end = part.split(" - ")[1]
-                        deleted = ''
-                        sym = start[0]
-                        while sym.lower() in ALPHABET:
-                            deleted += sym
-                            start = start.replace(sym, '', 1)
-                            sym = start[0]
-                        if '.' in end:
-                            dec_places = len(end.split('.')[1])
-                        else:
-                            dec_places = 0
-                        end = end.replace(deleted, '', 1)
-                        start = Decimal(start)
-                        end = Decimal(end)
-                        step = Decimal(1) / pow(10, dec_places)
-                        while start <= end:
-                            prod_data[unique_idx] = {
-                                'parts': parts.copy(), 'price': pay, 'name': deleted + f'{start}', 'amount': 1, 'number': (len(str(prod_amount)) - len(str(idx))) * "0" + str(idx)}
-                            unique_idx += 1
-                            start += step
-                            idx += 1
-                    else:
-                        prod_data[unique_idx] = {
-                            'parts': parts.copy(), 'price': pay, 'name': part, 'amount': 1, 'number': (len(str(prod_amount)) - len(str(idx))) * "0" + str(idx)}
-                        unique_idx += 1
-                        idx += 1
-            elif not skip:
-                if blacklisted:
-                    parts = dict()
-                prod_data[unique_idx] = {
-                    'parts': parts.copy(), 'price': pay, 'name': header, 'amount': prod_amount}
-                unique_idx += 1
-            idx = 1
-            lst_number = 0
-            for key in prod_data:
-                if prod_data[key].get('number') == None:
-                    if lst_number != 0:
-                        idx += 1
-                        lst_number = 0
-                    prod_data[key]['number'] = (
-                        len(str(max_idx)) - len(str(idx))) * '0' + str(idx)
-                    idx += 1
-                else:
-                    if Decimal(lst_number) > Decimal(prod_data[key].get('number')):
-                        idx += 1
-                    lst_number = prod_data[key].get('number')
-                    prod_data[key]['number'] = (
-                        len(str(max_idx)) - len(str(idx))) * '0' + str(idx) + '-' + lst_number
-            # Добавляем записи в базу данных
-            obj = Object.objects.create(obj_number=obj_number, created_at=timezone.now(
-            ).date())
-            ObjectStateInstance.objects.create(
-                object=obj, state=get_default_object_state(), created_at=timezone.now())
-            for key in prod_data:
-                data = prod_data.get(key)
-                prod = Product.objects.create(prod_number=data.get('number'), object=obj, name=data.get(
-                    'name'), amount=data.get('amount'), price=data.get('price'))
-                parts_data = data.get('parts')
-                for part_key in parts_data:
-                    part_data = parts_data.get(part_key)
-                    Part.objects.create(
-                        name=part_data.get('name'), product=prod, price=part_data.get('price'))
-            context['products'] = prod_data
-            context['object'] = obj
+            # Сохраняем файл и ставим его импорт в очередь, чтобы не держать запрос до окончания разбора и записи
+            job = ImportJob.objects.create(file=spec, file_name=spec.name, content_hash=hash_file(spec),
+                                           obj_number=spec.name.split()[0], dry_run=form.cleaned_data["dry_run"],
+                                           created_by=request.user)
+            submit_import(job, get_default_object_state())
+            return HttpResponseRedirect(f'/workspace/migrate/?job={job.pk}')
+        context['form'] = form
+        context['batch_form'] = BatchImportForm()
     return render(request, "migrate.html", context)
 
 
@@ -1718,21 +1567,61 @@ def queued_details(request, pk):
         return HttpResponseRedirect("/workspace")
     context = {'instance': instance}
     if request.method == "POST" and 'claim_product' in request.POST:
-        in_work = CreationInstance.objects.filter(
-            worker=worker, product=instance.product, part=instance.part, status='IN_WORK').first()
-        if in_work:
-            in_work.amount += instance.amount
-            in_work.save()
-            instance.delete()
-        else:
-            instance.status = "IN_WORK"
-            instance.queued = None
-            instance.started = timezone.now().date()
-            instance.save()
+        # Экземпляр объединяется с уже находящимся в работе экземпляром того же изделия/части
+        claim_queued(instance)
         return HttpResponseRedirect('/workspace')
     return render(request, "queued.html", context)
 
 
+def get_date_param(request, name):
+    """Возвращает дату из параметра запроса в формате ГГГГ-ММ-ДД (None, если параметра нет или он неверный)"""
+    value = request.GET.get(name)
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+
+@login_required
+def export_payroll_view(request):
+    """
+    **view** для выгрузки ведомости выплат по работникам и месяцам (CSV или XLSX)
+
+    Параметры запроса:
+    - format — csv (по умолчанию) или xlsx
+    - worker — id работника (можно указать несколько, по умолчанию — все работники)
+    - start, end — первый и последний месяцы (ГГГГ-ММ-ДД)
+
+    Строки берутся из ведомости (***PayrollLedger***) через курсор **БД** и отправляются по мере получения
+    """
+    if check_user_group(request, "master") is False:
+        return HttpResponseRedirect('/workspace')
+    close_past_months()
+    workers = request.GET.getlist('worker') or None
+    rows = iter_payroll_rows(workers, get_date_param(
+        request, 'start'), get_date_param(request, 'end'))
+    return export_response('payroll', 'Выплаты', PAYROLL_HEADER, rows, request.GET.get('format'))
+
+
+@login_required
+def export_production_view(request):
+    """
+    **view** для выгрузки хода производства по изделиям объектов (CSV или XLSX)
+
+    Параметры запроса:
+    - format — csv (по умолчанию) или xlsx
+    - object — id объекта (можно указать несколько, по умолчанию — все объекты)
+    - hidden — 1, если нужно выгрузить и скрытые объекты
+
+    Строки берутся из счётчиков производства через курсор **БД** и отправляются по мере получения
+    """
+    if check_user_group(request, "master") is False:
+        return HttpResponseRedirect('/workspace')
+    objects = request.GET.getlist('object') or None
+    rows = iter_production_rows(objects, request.GET.get('hidden') == '1')
+    return export_response('production', 'Производство', PRODUCTION_HEADER, rows, request.GET.get('format'))
+
+
 @login_required
 def hidden_view(request):
     """
@@ -1762,6 +1651,9 @@ def hidden_view(request):
     if search_query:
         # Оставляем только подходящие по номеру объекты
         objects = objects.filter(obj_number__icontains=search_query)
+    # Выводим объекты постранично вместе с их состояниями (для цвета строки)
+    objects = paginate_keyset(request, objects.prefetch_related(
+        'objectstateinstance_set__state'), ('obj_number', 'id'))
     # Создаём словарь с нужными данными
     context = {'objects': objects, 'hidden': True, 'questions': len(questions)}
     # Если пришёл запрос на динамическое обновление страницы
@@ -1809,8 +1701,21 @@ def blacklist_settings_view(request):
             blacklist = ParseBlacklistValue.objects.all()
             form = AddParseBlacklistValueForm()
             context['form'] = form
+        if 'preview' in request.POST:
+            # Показываем части Спецификации, которые будут пропущены при импорте
+            preview_form = SelectFileForm(request.POST, request.FILES)
+            if preview_form.is_valid():
+                try:
+                    context['skipped'] = preview_blacklist(
+                        request.FILES.get("spec"))
+                    context['previewed'] = True
+                except ValidationError as e:
+                    preview_form.add_error("spec", e)
+            context['preview_form'] = preview_form
+            context['form'] = AddParseBlacklistValueForm()
     else:
         form = AddParseBlacklistValueForm()
         context['form'] = form
     context['blacklist'] = blacklist
+    context.setdefault('preview_form', SelectFileForm())
     return render(request, 'blacklist_settings.html', context)